@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+
+# Standard library imports
+import asyncio
+import json
+import signal
+import ssl
+import sys
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+# Project modules
+from acremote import systemd
+from acremote.main import ACRemote
+from acremote.telegram import API_URL, TelegramError, jsonable, parse_result
+
+
+class AsyncBot():
+    """Minimal Telegram Bot API client on top of asyncio streams (HTTP/1.1 keep-alive).
+    Only long polling runs here, replies go out through the blocking session of OutboundSender"""
+
+    def __init__(self, token: str, api_url: str = API_URL, max_idle: int = 4):
+        url = urlsplit(api_url)
+        self._TOKEN = token
+        self._HOST = url.hostname
+        self._SSL = ssl.create_default_context() if url.scheme == 'https' else None
+        self._PORT = url.port or (443 if self._SSL else 80)
+        self._PATH = url.path.rstrip('/')
+        self._IDLE = []  # idle keep-alive connections [(reader, writer)]
+        self._MAX_IDLE = max_idle
+
+    async def _connect(self):
+        return await asyncio.open_connection(self._HOST, self._PORT, ssl=self._SSL)
+
+    @staticmethod
+    async def _read_response(reader) -> tuple:
+        status_line = await reader.readuntil(b'\r\n')
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await reader.readuntil(b'\r\n')
+            if line == b'\r\n':
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readuntil(b'\r\n')).split(b';')[0], 16)
+                if size == 0:
+                    while await reader.readuntil(b'\r\n') != b'\r\n':
+                        pass  # skip trailers
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            body = b''.join(chunks)
+        else:
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+        return status, headers, body
+
+    async def _request(self, method: str, params: dict = None, timeout: float = 30):
+        body = json.dumps(jsonable(params or {})).encode('utf-8')
+        head = (
+            'POST {}/bot{}/{} HTTP/1.1\r\n'
+            'Host: {}\r\n'
+            'Content-Type: application/json\r\n'
+            'Content-Length: {}\r\n'
+            'Connection: keep-alive\r\n'
+            '\r\n'
+        ).format(self._PATH, self._TOKEN, method, self._HOST, len(body)).encode('latin-1')
+
+        while True:
+            reused = bool(self._IDLE)
+            reader, writer = self._IDLE.pop() if reused else await self._connect()
+            try:
+                writer.write(head + body)
+                await writer.drain()
+                status, headers, data = await asyncio.wait_for(self._read_response(reader), timeout)
+            except (ConnectionError, asyncio.IncompleteReadError) as error:
+                writer.close()
+                if reused:
+                    continue  # the server dropped an idle connection, retry on a fresh one
+                raise ConnectionError('Telegram API connection failed: {!r}'.format(error))
+            except BaseException:
+                writer.close()
+                raise
+            break
+
+        if headers.get('connection', '').lower() == 'close' or len(self._IDLE) >= self._MAX_IDLE:
+            writer.close()
+        else:
+            self._IDLE.append((reader, writer))
+
+        return parse_result(status, data)
+
+    def set_token(self, token: str):
+        # Idle connections belong to the event loop, they are kept: the token is only in the request path
+        self._TOKEN = token
+
+    async def close(self):
+        while self._IDLE:
+            _, writer = self._IDLE.pop()
+            writer.close()
+
+    #################################################
+    # BOT API METHODS
+    #################################################
+
+    async def getUpdates(self, offset=None, limit=None, timeout=None, allowed_updates=None):
+        params = {
+            'offset': offset,
+            'limit': limit,
+            'timeout': timeout,
+            'allowed_updates': allowed_updates,
+        }
+        return await self._request('getUpdates', params, timeout=(timeout or 0) + 10)
+
+
+class AsyncACRemote(ACRemote):
+
+    def __init__(self, bot_token: str, *args, api_url: str = API_URL,
+                 workers: int = 4, poll_timeout: int = 20, **kwargs):
+        super().__init__(bot_token, *args, api_url=api_url, **kwargs)
+
+        self._ABOT = AsyncBot(bot_token, api_url)
+
+        self._EXECUTOR = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='acremote')
+
+        self._POLL_TIMEOUT = poll_timeout
+
+        # {chat_id:asyncio.Lock} keeps per-chat ordering, a lock goes away with its last waiting update
+        self._CHAT_LOCKS = weakref.WeakValueDictionary()
+
+        self._TASKS = set()
+
+        self._LOOP = None
+
+    #################################################
+    # ROUTINE METHODS
+    #################################################
+
+    def _rotate_token(self, bot_token: str):
+        super()._rotate_token(bot_token)
+        self._ABOT.set_token(bot_token)  # picked up by the next getUpdates
+
+    async def _on_update(self, update):
+        route = self._route_update(update)
+        if route is None:
+            return
+        chat_id, handler, msg = route
+
+        lock = self._CHAT_LOCKS.get(chat_id)
+        if lock is None:
+            lock = self._CHAT_LOCKS[chat_id] = asyncio.Lock()
+        async with lock:
+            try:
+                # Handlers touch the IR transmitter and sensors, keep them off the event loop
+                await self._LOOP.run_in_executor(self._EXECUTOR, handler, msg)
+            except Exception as error:
+                print('update_id={} error={!r}'.format(update.get('update_id'), error),
+                      file=sys.stderr, flush=True)
+
+    async def _poll_updates(self):
+        backoff = 1
+        while True:
+            try:
+                updates = await self._ABOT.getUpdates(
+                    offset=self._UPDATE_OFFSET,
+                    timeout=self._POLL_TIMEOUT,
+                    allowed_updates=['message', 'callback_query'],
+                )
+                backoff = 1
+            except (OSError, asyncio.TimeoutError, TelegramError) as error:
+                print('getUpdates failed: {!r}'.format(error), file=sys.stderr, flush=True)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+                continue
+
+            if updates:
+                self._UPDATE_OFFSET = updates[-1]['update_id'] + 1
+                if self._OFFSET_STORE:  # on disk before the updates are handled, as in polling mode
+                    self._OFFSET_STORE.update({'offset': self._UPDATE_OFFSET})
+                    await self._LOOP.run_in_executor(self._EXECUTOR, self._OFFSET_STORE.flush)
+            stale = [update for update in updates if self._is_stale(update)]
+            if stale:
+                # The backlog is applied before anything newer of the same chats
+                await self._LOOP.run_in_executor(self._EXECUTOR, self._replay_backlog, stale)
+            for update in updates:
+                if self._is_stale(update):
+                    continue
+                task = asyncio.ensure_future(self._on_update(update))
+                self._TASKS.add(task)
+                task.add_done_callback(self._TASKS.discard)
+
+    #################################################
+    # USER METHODS
+    #################################################
+
+    async def run(self):
+        self._LOOP = asyncio.get_running_loop()
+        await self._LOOP.run_in_executor(self._EXECUTOR, self._wait_for_network)
+        await self._LOOP.run_in_executor(self._EXECUTOR, self._clear_webhook)
+        self._load_offset()
+        systemd.notify('READY=1')
+        try:
+            await self._poll_updates()
+        finally:
+            if self._TASKS:
+                await asyncio.wait(self._TASKS, timeout=5)
+            await self._ABOT.close()
+            self._EXECUTOR.shutdown(wait=False)
+
+    def start(self):
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            asyncio.run(self.run())
+        except KeyboardInterrupt:
+            sys.exit(0)
+        finally:
+            self.shutdown()
@@ -0,0 +1,73 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _APIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, every response has a Content-Length
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, code: int, body: dict, headers: dict = None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _route(self) -> tuple:
+        # -> (user_id, unit name or None), replies and returns None when the request can't go on
+        parts = self.path.split('?')[0].strip('/').split('/')
+        if parts[0] != 'state' or len(parts) > 2:
+            return self._reply(404, {'error': 'Not found'})
+        authorization = self.headers.get('Authorization', '')
+        user_id = self.server.remote.api_user(authorization[7:] if authorization.startswith('Bearer ') else '')
+        if user_id is None:
+            return self._reply(401, {'error': 'Unauthorized'}, {'WWW-Authenticate': 'Bearer'})
+        return user_id, parts[1] if len(parts) == 2 else None
+
+    def do_GET(self):
+        route = self._route()
+        if route:
+            self._reply(*self.server.remote.api_state(*route))
+
+    def do_PATCH(self):
+        length = int(self.headers.get('Content-Length', 0))
+        if length > self.server.max_body:
+            self.close_connection = True
+            return self._reply(413, {'error': 'Request body too large'})
+        body = self.rfile.read(length)  # read before any reply to keep the connection usable
+        route = self._route()
+        if not route:
+            return
+        try:
+            changes = json.loads(body)
+        except ValueError:
+            return self._reply(400, {'error': 'Body must be a JSON object'})
+        if not isinstance(changes, dict):
+            return self._reply(400, {'error': 'Body must be a JSON object'})
+        self._reply(*self.server.remote.api_patch(*route, changes))
+
+
+class LocalAPIServer(ThreadingHTTPServer):
+    # JSON API for clients on the LAN: GET /state[/UNIT] and PATCH /state[/UNIT] with
+    # a partial state, authorized with "Authorization: Bearer TOKEN". Works without internet
+    daemon_threads = True
+
+    def __init__(self, address: tuple, remote, max_body: int = 4096):
+        super().__init__(address, _APIHandler)
+        self.remote = remote
+        self.max_body = max_body
+        self._THREAD = threading.Thread(target=self.serve_forever, name='acremote-api', daemon=True)
+
+    def start(self):
+        self._THREAD.start()
+
+    def close(self):
+        if self._THREAD.is_alive():
+            self.shutdown()
+        self.server_close()
@@ -0,0 +1,121 @@
+import json
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS commands (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    user_id INTEGER,
+    username TEXT,
+    command TEXT NOT NULL,
+    args TEXT,
+    latency_ms REAL,
+    outcome TEXT,
+    state TEXT
+);
+CREATE INDEX IF NOT EXISTS commands_ts ON commands (ts);
+'''
+
+_COLUMNS = ('ts', 'user_id', 'username', 'command', 'args', 'latency_ms', 'outcome', 'state')
+
+
+class AuditLog(threading.Thread):
+    # Command audit trail: handlers enqueue records, this thread batches them into SQLite
+
+    def __init__(self, db_file: str, retention_days: float = 30, batch_size: int = 100):
+        super().__init__(name='acremote-audit', daemon=True)
+        self._DB_FILE = db_file
+        self._RETENTION = retention_days * 86400
+        self._BATCH_SIZE = batch_size
+        self._QUEUE = queue.SimpleQueue()
+        self._PRUNE_INTERVAL = 3600
+        self._READY = threading.Event()
+
+    def record(self, user_id: int, username: str, command: str, args: list,
+               latency: float, outcome: str, state: dict):
+        self._QUEUE.put((time.time(), user_id, username, command, args, latency, outcome, state))
+
+    def query(self, command: str = None, user: str = None, since: float = None,
+              until: float = None, limit: int = 20) -> list:
+        self._READY.wait(5)
+        where, params = [], []
+        if command:
+            where.append('command = ?')
+            params.append(command)
+        if user:
+            where.append('(username = ? OR CAST(user_id AS TEXT) = ?)')
+            params += [user.lstrip('@'), user]
+        if since is not None:
+            where.append('ts >= ?')
+            params.append(since)
+        if until is not None:
+            where.append('ts < ?')
+            params.append(until)
+        sql = 'SELECT {} FROM commands {} ORDER BY ts DESC LIMIT ?'.format(
+            ', '.join(_COLUMNS),
+            'WHERE ' + ' AND '.join(where) if where else '',
+        )
+        connection = sqlite3.connect(self._DB_FILE)
+        try:
+            rows = connection.execute(sql, params + [limit]).fetchall()
+        finally:
+            connection.close()
+        records = [dict(zip(_COLUMNS, row)) for row in rows]
+        for record in records:
+            record['args'] = json.loads(record['args'])
+            record['state'] = json.loads(record['state'])
+        return records
+
+    def close(self, timeout: float = None):
+        self._QUEUE.put(None)
+        self.join(timeout)
+
+    def _prune(self, connection):
+        connection.execute('DELETE FROM commands WHERE ts < ?', (time.time() - self._RETENTION,))
+        connection.commit()
+
+    def run(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self._DB_FILE)), exist_ok=True)
+        connection = sqlite3.connect(self._DB_FILE)
+        connection.execute('PRAGMA journal_mode=WAL')  # readers never block the writer
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.executescript(_SCHEMA)
+        self._prune(connection)
+        self._READY.set()
+        pruned_at = time.monotonic()
+
+        running = True
+        while running:
+            batch = [self._QUEUE.get()]
+            while len(batch) < self._BATCH_SIZE:
+                try:
+                    batch.append(self._QUEUE.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                running = False
+                batch = [item for item in batch if item is not None]
+
+            rows = [
+                (ts, user_id, username, command, json.dumps(args),
+                 round(latency * 1000, 1), outcome, json.dumps(state, separators=(',', ':')))
+                for ts, user_id, username, command, args, latency, outcome, state in batch
+            ]
+            try:
+                connection.executemany(
+                    'INSERT INTO commands ({}) VALUES ({})'.format(', '.join(_COLUMNS), ', '.join('?' * len(_COLUMNS))),
+                    rows,
+                )
+                connection.commit()
+                if time.monotonic() - pruned_at > self._PRUNE_INTERVAL:
+                    self._prune(connection)
+                    pruned_at = time.monotonic()
+            except sqlite3.Error as error:
+                print('Audit log write failed: {!r}'.format(error), file=sys.stderr, flush=True)
+
+        connection.close()
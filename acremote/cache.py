@@ -0,0 +1,81 @@
+import threading
+import time
+from collections import OrderedDict, deque
+
+
+class ExpiringCache():
+    # Dict-like cache with a per-entry TTL and a size limit. Expired entries are dropped
+    # when they are looked up and by sweep(); entries dropped for any reason are handed
+    # out by the next sweep() so their cleanup can be batched
+
+    def __init__(self, ttl: float, max_size: int = 256, clock: callable = time.monotonic):
+        self._TTL = ttl
+        self._MAX_SIZE = max_size
+        self._CLOCK = clock
+        self._ENTRIES = OrderedDict()  # {key:(expires_at, value)}, oldest first
+        self._EVICTED = deque(maxlen=max_size)  # [(key, value)] waiting for sweep()
+        self._LOCK = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._ENTRIES)
+
+    def __contains__(self, key) -> bool:
+        return self.get(key, self) is not self
+
+    def __getitem__(self, key):
+        value = self.get(key, self)
+        if value is self:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __delitem__(self, key):
+        if self.pop(key, self) is self:
+            raise KeyError(key)
+
+    def set(self, key, value, ttl: float = None):
+        with self._LOCK:
+            replaced = self._ENTRIES.pop(key, None)
+            if replaced is not None and replaced[1] != value:
+                self._EVICTED.append((key, replaced[1]))
+            self._ENTRIES[key] = (self._CLOCK() + (self._TTL if ttl is None else ttl), value)
+            while len(self._ENTRIES) > self._MAX_SIZE:
+                self._EVICTED.append(self._evict_oldest())
+
+    def _evict_oldest(self) -> tuple:
+        key, (_, value) = self._ENTRIES.popitem(last=False)
+        return key, value
+
+    def get(self, key, default=None):
+        with self._LOCK:
+            entry = self._ENTRIES.get(key)
+            if entry is None:
+                return default
+            if entry[0] <= self._CLOCK():
+                del self._ENTRIES[key]
+                self._EVICTED.append((key, entry[1]))
+                return default
+            return entry[1]
+
+    def pop(self, key, default=None):
+        with self._LOCK:
+            entry = self._ENTRIES.pop(key, None)
+            if entry is None:
+                return default
+            if entry[0] <= self._CLOCK():
+                self._EVICTED.append((key, entry[1]))
+                return default
+            return entry[1]
+
+    def sweep(self) -> list:
+        # Drops every expired entry, returns [(key, value)] of all entries evicted since the last sweep
+        now = self._CLOCK()
+        with self._LOCK:
+            expired = [key for key, (expires_at, _) in self._ENTRIES.items() if expires_at <= now]
+            for key in expired:
+                self._EVICTED.append((key, self._ENTRIES.pop(key)[1]))
+            evicted = list(self._EVICTED)
+            self._EVICTED.clear()
+        return evicted
@@ -0,0 +1,34 @@
+import sys
+import threading
+from collections import namedtuple
+
+# Published on the thread that caused them, subscribers must not block
+StateChanged = namedtuple('StateChanged', ['unit', 'state'])         # after a press or a committed transaction
+IRSent = namedtuple('IRSent', ['unit', 'state', 'seconds'])          # one frame went out
+SensorSample = namedtuple('SensorSample', ['source', 'readings'])    # {'w1': {device: °C}} or {'system': {...}}
+
+
+class EventBus():
+    # In-process publish/subscribe by event type. A failing subscriber is reported
+    # and skipped, it never breaks the publisher (usually the hardware worker)
+
+    def __init__(self):
+        self._SUBSCRIBERS = {}  # {event type: (callback, ...)}
+        self._LOCK = threading.Lock()
+
+    def subscribe(self, event_type: type, callback: callable):
+        with self._LOCK:
+            self._SUBSCRIBERS[event_type] = self._SUBSCRIBERS.get(event_type, ()) + (callback,)
+
+    def unsubscribe(self, event_type: type, callback: callable):
+        with self._LOCK:
+            callbacks = self._SUBSCRIBERS.get(event_type, ())
+            self._SUBSCRIBERS[event_type] = tuple(other for other in callbacks if other != callback)
+
+    def publish(self, event):
+        for callback in self._SUBSCRIBERS.get(type(event), ()):  # tuples are swapped, never mutated
+            try:
+                callback(event)
+            except Exception as error:
+                print('{} subscriber {!r} failed: {!r}'.format(type(event).__name__, callback, error),
+                      file=sys.stderr, flush=True)
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Capture and decode IR remote frames (NEC style pulse distance coding).
+
+Usage: python3 -m acremote.gpirdecode [--pin 23] [--save FILE]
+       python3 -m acremote.gpirdecode --replay FILE
+
+Capturing needs the pigpio daemon (pigpiod): edges are timestamped by the daemon
+in microseconds and delivered to a callback, so nothing busy-polls the pin.
+Captured frames can be appended to a replay file with --save and decoded later
+on any machine with --replay.
+"""
+import argparse
+import queue
+import struct
+import sys
+
+MARK, SPACE = 0, 1  # pin levels of an active-low IR receiver module
+
+SPACE_THRESHOLD = 1000  # µs, longer spaces are ones
+
+# NEC timings, the same as gpirblast transmits
+LEADER = (9000, 4500)
+BIT_MARK = 562
+ZERO_SPACE, ONE_SPACE = 562, 1688
+
+# Replay files start with REPLAY_MAGIC, followed by one record per frame: a header
+# (number of pulses, level of the first pulse) and the pulse durations in µs as LEB128
+# varints. Levels alternate, so they are not stored; a typical frame takes ~2 bytes/pulse
+REPLAY_MAGIC = b'IRP\x01'
+FRAME_HEADER = struct.Struct('<HB')
+
+
+class DecodeError(ValueError):
+    pass
+
+
+def nec_pulses(bits: str) -> list:
+    # '0101...' -> [(level, µs)] the way gpirblast.send_code puts it on the air
+    pulses = [(MARK, LEADER[0]), (SPACE, LEADER[1])]
+    for bit in bits:
+        pulses.append((MARK, BIT_MARK))
+        pulses.append((SPACE, ONE_SPACE if bit == '1' else ZERO_SPACE))
+    pulses.append((MARK, BIT_MARK))
+    return pulses
+
+
+def decode(pulses) -> dict:
+    # Any iterable of (level, µs) starting with the leader mark -> the frame's octets.
+    # Octets are sent LSB first; the last one is the sum of the others (Vestel checksum)
+    pulses = iter(pulses)
+    try:
+        (_, leader_mark), (_, leader_space) = next(pulses), next(pulses)
+    except StopIteration:
+        raise DecodeError('Frame is too short') from None
+    ratio = round(leader_mark / leader_space) if leader_space else 0
+    if ratio not in (1, 2):  # NEC or Samsung
+        raise DecodeError('Invalid beginning sequence for NEC IR protocol')
+
+    bits = ''.join('1' if duration > SPACE_THRESHOLD else '0' for level, duration in pulses if level == SPACE)
+    if not bits or len(bits) % 8:
+        raise DecodeError('"{}" length must be multiple of 8'.format(bits))
+
+    octets = [int(bits[first:first + 8][::-1], 2) for first in range(0, len(bits), 8)]
+    checksum = sum(octets[:-1]) & 0xFF
+    return {
+        'ratio': ratio,
+        'bits': bits,
+        'octets': octets,
+        'checksum': checksum,
+        'checksum_ok': checksum == octets[-1],
+    }
+
+
+def _normalize(pulses) -> list:
+    # Merges repeated levels (missed edges) so that levels strictly alternate
+    merged = []
+    for level, duration in pulses:
+        if merged and merged[-1][0] == level:
+            merged[-1] = (level, merged[-1][1] + duration)
+        else:
+            merged.append((level, duration))
+    return merged
+
+
+def write_replay(file_handle, frames) -> int:
+    # Appends frames of (level, µs) pulses to a binary file opened with 'ab' or 'wb'
+    if file_handle.tell() == 0:
+        file_handle.write(REPLAY_MAGIC)
+    written = 0
+    for pulses in frames:
+        pulses = _normalize(pulses)[:0xFFFF]
+        if not pulses:
+            continue
+        record = bytearray(FRAME_HEADER.pack(len(pulses), pulses[0][0]))
+        for _, duration in pulses:
+            duration = max(0, int(duration))
+            while duration > 0x7F:
+                record.append(duration & 0x7F | 0x80)
+                duration >>= 7
+            record.append(duration)
+        file_handle.write(record)
+        written += 1
+    return written
+
+
+def read_replay(file_handle):
+    # Yields every frame of a replay file as a list of (level, µs)
+    data = file_handle.read()
+    if data[:len(REPLAY_MAGIC)] != REPLAY_MAGIC:
+        raise DecodeError('Not an IR replay file')
+    position = len(REPLAY_MAGIC)
+    while position < len(data):
+        if position + FRAME_HEADER.size > len(data):
+            raise DecodeError('Truncated replay file')
+        count, level = FRAME_HEADER.unpack_from(data, position)
+        position += FRAME_HEADER.size
+        pulses = []
+        for _ in range(count):
+            duration = shift = 0
+            while True:
+                if position >= len(data):
+                    raise DecodeError('Truncated replay file')
+                byte = data[position]
+                position += 1
+                duration |= (byte & 0x7F) << shift
+                shift += 7
+                if byte < 0x80:
+                    break
+            pulses.append((level, duration))
+            level ^= 1
+        yield pulses
+
+
+class EdgeCapture():
+    # Pulse trains from an IR receiver via pigpio edge callbacks. Durations come from the
+    # daemon's microsecond ticks (wrap-around safe), a frame ends after gap_ms without an
+    # edge. The trailing space is not part of the frame
+
+    def __init__(self, gpio_pin: int = 23, gap_ms: int = 20, host: str = 'localhost'):
+        import pigpio  # only needed to capture, decoding and replay files work without it
+
+        self._PIGPIO = pigpio
+        self._PI = pigpio.pi(host)
+        if not self._PI.connected:
+            raise OSError('Cannot connect to pigpiod on {}'.format(host))
+        self._PIN = gpio_pin
+        self._FRAMES = queue.Queue()
+        self._PULSES = []
+        self._LAST_TICK = None
+        self._PI.set_mode(gpio_pin, pigpio.INPUT)
+        self._CALLBACK = self._PI.callback(gpio_pin, pigpio.EITHER_EDGE, self._on_edge)
+        self._PI.set_watchdog(gpio_pin, gap_ms)  # fires with level TIMEOUT while the pin is quiet
+
+    def _on_edge(self, gpio: int, level: int, tick: int):
+        # Runs on the pigpio callback thread
+        if level == self._PIGPIO.TIMEOUT:
+            if self._PULSES:
+                self._FRAMES.put(self._PULSES)
+            self._PULSES = []
+            self._LAST_TICK = None
+            return
+        if self._LAST_TICK is not None:
+            # the level before this edge lasted since the previous one
+            self._PULSES.append((level ^ 1, self._PIGPIO.tickDiff(self._LAST_TICK, tick)))
+        self._LAST_TICK = tick
+
+    def frames(self, timeout: float = None):
+        # Yields captured frames until close() or until no frame arrives for `timeout` seconds
+        while True:
+            try:
+                pulses = self._FRAMES.get(timeout=timeout)
+            except queue.Empty:
+                return
+            if pulses is None:
+                return
+            yield pulses
+
+    def close(self):
+        self._PI.set_watchdog(self._PIN, 0)
+        self._CALLBACK.cancel()
+        self._PI.stop()
+        self._FRAMES.put(None)
+
+
+def print_frame(pulses, out=sys.stdout):
+    try:
+        frame = decode(pulses)
+    except DecodeError as error:
+        print('ERROR: {}'.format(error), file=out)
+        return
+    print('RATIO: ', frame['ratio'], file=out)
+    print('BIN: ', frame['bits'], file=out)
+    print('--COMMAND-START--', file=out)
+    print('bin  \t\tdec', file=out)
+    for octet in frame['octets']:
+        print('{:08b}\t{}'.format(octet, octet), file=out)
+    print('{:08b} <- AC CHECKSUM {}'.format(frame['checksum'], 'MATCH' if frame['checksum_ok'] else 'MISMATCH'),
+          file=out)
+    print('--COMMAND-END----\n', file=out, flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pin', type=int, default=23, help='GPIO (BCM) pin of the IR receiver')
+    parser.add_argument('--gap', type=int, default=20, help='ms of silence that end a frame')
+    parser.add_argument('--save', help='append captured frames to this replay file')
+    parser.add_argument('--replay', help='decode the frames of a replay file instead of capturing')
+    options = parser.parse_args()
+
+    if options.replay:
+        with open(options.replay, 'rb') as file_handle:
+            for pulses in read_replay(file_handle):
+                print_frame(pulses)
+        return
+
+    capture = EdgeCapture(options.pin, options.gap)
+    save = open(options.save, 'ab') if options.save else None
+    try:
+        for pulses in capture.frames():
+            print_frame(pulses)
+            if save:
+                write_replay(save, [pulses])
+                save.flush()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        capture.close()
+        if save:
+            save.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Batch decoding of captured IR frames with NumPy.
+
+Usage: python3 -m acremote.irbatch [--list] FILE [FILE ...]
+
+Every frame of the given replay files (see acremote.gpirdecode) is decoded in one
+vectorized pass: spaces are classified with a threshold, bits are packed into octets
+and checksums are validated for the whole corpus at once. Needs numpy.
+"""
+import argparse
+import itertools
+import sys
+import time
+
+import numpy as np
+
+from acremote.gpirdecode import FRAME_HEADER, REPLAY_MAGIC, SPACE, SPACE_THRESHOLD, DecodeError
+
+
+def to_arrays(frames) -> tuple:
+    # [[(level, µs)]] -> (pulses per frame, levels, durations), the pulses of all frames concatenated
+    frames = list(frames)
+    lengths = np.fromiter(map(len, frames), dtype=np.int64, count=len(frames))
+    total = int(lengths.sum())
+    flat = np.fromiter(
+        itertools.chain.from_iterable(itertools.chain.from_iterable(frames)),
+        dtype=np.int64,
+        count=total * 2,
+    ).reshape(total, 2)
+    return lengths, flat[:, 0], flat[:, 1]
+
+
+def load_replay(file_handle) -> tuple:
+    # A replay file -> the arrays of to_arrays() without building a tuple per pulse.
+    # Only the frame headers are walked in Python, the varints are decoded in one pass
+    data = np.frombuffer(file_handle.read(), dtype=np.uint8)
+    if data[:len(REPLAY_MAGIC)].tobytes() != REPLAY_MAGIC:
+        raise DecodeError('Not an IR replay file')
+    last_bytes = np.flatnonzero(data < 0x80)  # also has header bytes, searches skip those
+    headers, counts, first_levels = [], [], []
+    position = len(REPLAY_MAGIC)
+    while position < len(data):
+        count, level = FRAME_HEADER.unpack_from(data, position)
+        first = np.searchsorted(last_bytes, position + FRAME_HEADER.size)
+        if first + count > len(last_bytes):
+            raise DecodeError('Truncated replay file')
+        headers.append(position)
+        counts.append(count)
+        first_levels.append(level)
+        position = int(last_bytes[first + count - 1]) + 1 if count else position + FRAME_HEADER.size
+
+    varint_bytes = np.ones(len(data), dtype=bool)
+    varint_bytes[:len(REPLAY_MAGIC)] = False
+    for offset in range(FRAME_HEADER.size):
+        varint_bytes[np.asarray(headers, dtype=np.int64) + offset] = False
+    payload = data[varint_bytes].astype(np.int64)
+    ends = payload < 0x80
+    value_of = np.cumsum(ends) - ends  # index of the varint every byte belongs to
+    value_starts = np.flatnonzero(np.concatenate(([True], ends[:-1])))
+    shift = 7 * (np.arange(len(payload)) - value_starts[value_of])
+    durations = np.bincount(value_of, weights=(payload & 0x7F) << shift, minlength=int(ends.sum()))
+
+    lengths = np.asarray(counts, dtype=np.int64)
+    starts = np.cumsum(lengths) - lengths
+    frame_of = np.repeat(np.arange(len(lengths)), lengths)
+    levels = (np.asarray(first_levels, dtype=np.int64)[frame_of] + np.arange(len(frame_of)) - starts[frame_of]) & 1
+    return lengths, levels, durations.astype(np.int64)
+
+
+def decode_batch(frames) -> dict:
+    # [[(level, µs)]] -> decode_arrays()
+    return decode_arrays(*to_arrays(frames))
+
+
+def decode_arrays(lengths, levels, durations) -> dict:
+    # Same rules as gpirdecode.decode() for every frame. Octets of all decoded frames are
+    # concatenated in 'octets', frame i owns octets[octet_starts[i]:octet_starts[i] + n_octets[i]]
+    count = len(lengths)
+    starts = np.cumsum(lengths) - lengths
+    frame_of = np.repeat(np.arange(count), lengths)
+    position = np.arange(len(durations)) - starts[frame_of]
+
+    # Leader mark / leader space, 1 for NEC and 2 for Samsung
+    has_leader = lengths >= 2
+    leader = np.where(has_leader, starts, 0)
+    if len(durations):
+        lead_mark = np.where(has_leader, durations[leader], 0)
+        lead_space = np.where(has_leader, durations[np.minimum(leader + 1, len(durations) - 1)], 0)
+    else:
+        lead_mark = lead_space = np.zeros(count, dtype=np.int64)
+    ratio = np.rint(np.divide(lead_mark, lead_space, out=np.zeros(count), where=lead_space > 0)).astype(np.int64)
+    leader_ok = has_leader & ((ratio == 1) | (ratio == 2))
+
+    # Every space after the leader carries one bit, long spaces are ones
+    is_bit = (levels == SPACE) & (position >= 2)
+    bit_frame = frame_of[is_bit]
+    bits = (durations[is_bit] > SPACE_THRESHOLD).astype(np.int64)
+    n_bits = np.bincount(bit_frame, minlength=count)
+    valid = leader_ok & (n_bits > 0) & (n_bits % 8 == 0)
+
+    # Octets are sent LSB first: bit k of a frame is bit k % 8 of octet k // 8
+    n_octets = np.where(valid, n_bits // 8, 0)
+    octet_starts = np.cumsum(n_octets) - n_octets
+    bit_pos = np.arange(len(bits)) - (np.cumsum(n_bits) - n_bits)[bit_frame]
+    keep = valid[bit_frame]
+    octet_id = octet_starts[bit_frame[keep]] + bit_pos[keep] // 8
+    octets = np.bincount(
+        octet_id,
+        weights=bits[keep] << (bit_pos[keep] % 8),
+        minlength=int(n_octets.sum()),
+    ).astype(np.int64)
+
+    # The last octet is the sum of the others
+    checksum = np.zeros(count, dtype=np.int64)
+    last = np.zeros(count, dtype=np.int64)
+    if valid.any():
+        valid_starts = octet_starts[valid]
+        last[valid] = octets[valid_starts + n_octets[valid] - 1]
+        checksum[valid] = (np.add.reduceat(octets, valid_starts) - last[valid]) & 0xFF
+    return {
+        'ratio': ratio,
+        'valid': valid,
+        'n_octets': n_octets,
+        'octet_starts': octet_starts,
+        'octets': octets.astype(np.uint8),
+        'checksum': checksum,
+        'checksum_ok': valid & (checksum == last),
+    }
+
+
+def frame_octets(result: dict, index: int) -> list:
+    start = result['octet_starts'][index]
+    return result['octets'][start:start + result['n_octets'][index]].tolist()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('files', nargs='+', help='replay files')
+    parser.add_argument('--list', action='store_true', help='print the octets of every frame')
+    options = parser.parse_args()
+
+    started = time.perf_counter()
+    arrays = []
+    for path in options.files:
+        with open(path, 'rb') as file_handle:
+            arrays.append(load_replay(file_handle))
+    result = decode_arrays(*(np.concatenate(parts) for parts in zip(*arrays)))
+    elapsed = time.perf_counter() - started
+    frames = len(result['valid'])
+
+    if options.list:
+        for index in range(frames):
+            if not result['valid'][index]:
+                print('{}\tERROR'.format(index))
+                continue
+            print('{}\t{}\t{}'.format(
+                index,
+                ' '.join('{:02x}'.format(octet) for octet in frame_octets(result, index)),
+                'MATCH' if result['checksum_ok'][index] else 'MISMATCH',
+            ))
+    print('frames={} decoded={} checksum_ok={} seconds={:.3f}'.format(
+        frames, int(result['valid'].sum()), int(result['checksum_ok'].sum()), elapsed,
+    ), file=sys.stderr if options.list else sys.stdout)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,22 +1,48 @@
 #!/usr/bin/env python3
 
 # Standard library imports
+import hmac
+import html
 import json
+import logging
+import math
 import os
-import pprint
+import queue
+import re
+import signal
 import sys
 import subprocess
+import threading
 import time
-from functools import wraps
-
-# 3rd party modules
-import telepot
-from telepot.loop import MessageLoop
-from telepot.namedtuple import ReplyKeyboardMarkup, InlineKeyboardMarkup, InlineKeyboardButton
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext, suppress
+from functools import partial, wraps
+from logging.handlers import QueueListener
 
 # Project modules
+from acremote import metrics, systemd
+from acremote.cache import ExpiringCache
+from acremote.events import EventBus, SensorSample
+from acremote.perf import LatencyWindow, SamplingProfiler
+from acremote.ratelimit import AdmissionControl
+from acremote.scheduler import Scheduler, format_days, parse_days
+from acremote.sender import OutboundSender
+from acremote.state import StateStore
+from acremote.telegram import API_URL, TelegramError, TelegramSession, merge_messages
+from acremote.telemetry import SystemTelemetry, throttled_flags
 from acremote.thermo import W1Thermo
-from acremote.vestel import VestelACRemote
+from acremote.unit import ACUnit
+
+MESSAGE_SECONDS = metrics.histogram('acremote_message_seconds', 'Time to run all commands of one message')
+COMMAND_SECONDS = metrics.histogram('acremote_command_seconds', 'Time to run one command', label='command')
+COMMAND_ERRORS = metrics.counter('acremote_command_errors_total', 'Commands that raised an exception', label='command')
+COMMANDS_REJECTED = metrics.counter('acremote_commands_rejected_total', 'Commands refused by admission control',
+                                    label='lane')
+
+# Config keys only read at startup, a reload just reports that they changed
+_RESTART_KEYS = ('mode', 'gpio_pin', 'state_file', 'audit_db', 'audit_retention_days', 'metrics_port',
+                 'schedule_file', 'defer_power', 'webhook', 'units', 'offset_file', 'api', 'mqtt',
+                 'snapshot_file')
 
 
 class _ConfigHandler():
@@ -26,10 +52,66 @@ class _ConfigHandler():
         else:
             self._CONFIG_FILE = '/etc/acremote.json'
 
+    @property
+    def config_file(self) -> str:
+        return self._CONFIG_FILE
+
     def read_config(self) -> dict:
         with open(self._CONFIG_FILE, 'r') as file_handle:
             return json.load(file_handle)
 
+    @staticmethod
+    def validate(config: dict):
+        # Raises ValueError listing everything that is wrong with the config
+        errors = []
+        if not isinstance(config.get('bot_token'), str) or not config.get('bot_token'):
+            errors.append('bot_token must be a non-empty string')
+        units = config.get('units') or [{'name': 'ac', 'gpio_pin': config.get('gpio_pin'),
+                                         'state_file': config.get('state_file')}]
+        if not isinstance(units, list) or not all(isinstance(unit, dict) for unit in units):
+            errors.append('units must be a list of objects')
+            units = []
+        for unit in units:
+            if not isinstance(unit.get('name'), str) or not unit.get('name'):
+                errors.append('every unit needs a name')
+            if not isinstance(unit.get('gpio_pin'), int):
+                errors.append('gpio_pin of {} must be an integer'.format(unit.get('name')))
+            if not isinstance(unit.get('state_file'), str):
+                errors.append('state_file of {} must be a path'.format(unit.get('name')))
+        names = [unit.get('name') for unit in units]
+        if len(set(names)) != len(names):
+            errors.append('unit names must be unique')
+        for key in ('admin_ids', 'user_ids'):
+            ids = config.get(key)
+            if not isinstance(ids, list) or not all(isinstance(user_id, int) for user_id in ids):
+                errors.append('{} must be a list of user IDs'.format(key))
+        eggs = config.get('easter_eggs')
+        if not isinstance(eggs, dict) or not all(isinstance(value, str) for value in eggs.values()):
+            errors.append('easter_eggs must map phrases to replies')
+        api = config.get('api')
+        if api is not None and (not isinstance(api, dict) or not isinstance(api.get('port'), int)):
+            errors.append('api must be an object with a port')
+        elif api is not None and not all(isinstance(token, str) and len(token) >= 16 and isinstance(user_id, int)
+                                         for token, user_id in api.get('tokens', {}).items()):
+            errors.append('api tokens must map strings of 16+ characters to user IDs')
+        mqtt = config.get('mqtt')
+        if mqtt is not None and (not isinstance(mqtt, dict) or not isinstance(mqtt.get('host'), str)
+                                 or not isinstance(mqtt.get('user_id'), int)):
+            errors.append('mqtt must be an object with a host and the user_id commands run as')
+        if not isinstance(config.get('snapshot_file', ''), (str, type(None))):
+            errors.append('snapshot_file must be a path')
+        if config.get('mode', 'polling') not in ('polling', 'asyncio', 'webhook'):
+            errors.append('mode must be polling, asyncio or webhook')
+        webhook = config.get('webhook')
+        if config.get('mode') == 'webhook':
+            # Without the secret anybody reaching the port could post updates as an admin
+            if not isinstance(webhook, dict) or not isinstance(webhook.get('webhook_url'), str):
+                errors.append('webhook must be an object with a webhook_url')
+            elif not re.fullmatch(r'[A-Za-z0-9_-]{16,256}', str(webhook.get('secret_token') or '')):
+                errors.append('webhook secret_token must be 16 to 256 letters, digits, _ or -')
+        if errors:
+            raise ValueError('; '.join(errors))
+
     def write_config(self, config: dict):
         with open(self._CONFIG_FILE, 'w') as file_handle:
             json.dump(config, file_handle, indent='\t')
@@ -38,57 +120,78 @@ class _ConfigHandler():
 
 # TODO: Add a BotCommander class to separate bot functionality from AC-specific code
 
+# Bot API errors about messages that are already gone or unchanged, nothing to report
+_MESSAGE_GONE = ('message to delete not found', 'message to edit not found', 'message is not modified')
+
 
 class ACRemote():
 
     def __init__(self, bot_token: str, gpio_pin: int, state_file: str,
-                 admin_ids: list, user_ids: list, easter_eggs: dict):
+                 admin_ids: list, user_ids: list, easter_eggs: dict,
+                 audit_db: str = None, audit_retention_days: float = 30,
+                 metrics_port: int = None, schedule_file: str = None, defer_power: bool = False,
+                 units: list = None, offset_file: str = None, api: dict = None, mqtt: dict = None,
+                 snapshot_file: str = None, api_url: str = API_URL):
 
-        self._AC_HANDLER = VestelACRemote(gpio_pin)
+        self._EVENTS = EventBus()  # state changes, IR frames and sensor samples
 
-        self._AC_STATE_FILE = state_file
+        # [{'name', 'gpio_pin', 'state_file'}], a single unit called "ac" by default
+        units = units or [{'name': 'ac', 'gpio_pin': gpio_pin, 'state_file': state_file}]
 
-        self._AC_START_TIME = 0
+        self._UNITS = {
+            unit['name']: ACUnit(unit['name'], unit['gpio_pin'], unit['state_file'], events=self._EVENTS)
+            for unit in units
+        }
 
-        self._AC_STOP_TIME = 0
+        self._DEFAULT_UNIT = units[0]['name']
+
+        self._CHAT_UNITS = {}  # {chat_id:unit name} selected with /unit
+
+        self._UNIT_CONTEXT = threading.local()  # unit the current thread's commands go to
 
         self._AC_COOLDOWN = 20
 
-        self._AC_TIMER = 0.0
+        self._AC_DEFER_POWER = defer_power  # queue /on and /off during the cooldown instead of refusing them
+
+        self._POWER_BUTTONS = {
+            'btn_on': 'Turning on the AC',
+            'btn_off': 'Turning off the AC',
+        }
 
         self._BOT_KB = {
-            'admin': ReplyKeyboardMarkup(keyboard=[
+            'admin': dict(keyboard=[
                 ['/shutdown', '/restart', '/cpu_temp'],
+                ['/sys_stat', '/hw_stat', '/perf'],
                 ['/main'],
             ], resize_keyboard=True)
         }
 
         self._AC_KB = {
-            'main': ReplyKeyboardMarkup(keyboard=[
+            'main': dict(keyboard=[
                 ['/on', '/temp_up'],
                 ['/off', '/temp_down'],
                 ['/speed', '/mode', '/swing'],
-                ['/get_stat', '/other'],
-            ], resize_keyboard=True),
-            'speed': ReplyKeyboardMarkup(keyboard=[
+                ['/get_stat', '/panel', '/other'],
+            ] + ([['/unit', '/all off']] if len(self._UNITS) > 1 else []), resize_keyboard=True),
+            'speed': dict(keyboard=[
                 ['/speed_auto', '/speed_low'],
                 ['/speed_mid', '/speed_high'],
                 ['/strong', '/sleep'],
                 ['/main'],
             ], resize_keyboard=True),
-            'mode': ReplyKeyboardMarkup(keyboard=[
+            'mode': dict(keyboard=[
                 ['/mode_auto', '/mode_cool'],
                 ['/mode_dry', '/mode_heat'],
                 ['/mode_fan'],
                 ['/main'],
             ], resize_keyboard=True),
-            'other': ReplyKeyboardMarkup(keyboard=[
+            'other': dict(keyboard=[
                 ['/feeling', '/fresh'],
                 ['/screen', '/timer'],
                 ['/health', '/fungusproof'],
                 ['/admin', '/main'],
             ], resize_keyboard=True),
-            'timer': ReplyKeyboardMarkup(keyboard=[
+            'timer': dict(keyboard=[
                 ['/timer_set', '/timer_up'],
                 ['/timer_unset', '/timer_down'],
                 ['/timer_get'],
@@ -96,13 +199,43 @@ class ACRemote():
             ], resize_keyboard=True),
         }
 
-        self._BOT = telepot.Bot(bot_token)
+        self._BOT_TOKEN = bot_token
+
+        self._API_URL = api_url
+
+        self._CONFIG_HANDLER = None  # set by watch_config()
+
+        self._CONFIG = None  # config the process was started with, for reload diffs
+
+        self._CONFIG_MTIME = None
+
+        self._CONFIG_WATCH = 0  # seconds between config file mtime checks, 0 = SIGHUP only
+
+        self._POLL_TIMEOUT = 20  # getUpdates long polling
+
+        self._STALE_AGE = 30  # older messages are replayed as a backlog
+
+        self._OFFSET_STORE = StateStore(offset_file) if offset_file else None  # getUpdates offset
+
+        self._UPDATE_OFFSET = None
+
+        self._SESSION = TelegramSession(bot_token, api_url)
+
+        self._SENDER = OutboundSender(self._SESSION)
 
         self._THERMO = W1Thermo()
 
-        self._ADMIN_IDS = admin_ids
+        self._SENSORS = {}  # {device: °C} of the last 1-Wire sample
+
+        self._SENSOR_TIME = float('-inf')
+
+        self._SENSOR_INTERVAL = 60
+
+        self._SENSOR_LOCK = threading.Lock()
+
+        self._ADMIN_IDS = frozenset(admin_ids)
 
-        self._ALLOWED_IDS = self._ADMIN_IDS + user_ids
+        self._ALLOWED_IDS = self._ADMIN_IDS | frozenset(user_ids)
 
         self._RESPONSES = easter_eggs
 
@@ -117,10 +250,15 @@ class ACRemote():
             '/speed': self.menu_speed,
             '/other': self.menu_other,
             '/timer': self.menu_timer,
+            '/panel': self.menu_panel,
             # ADMIN COMMANDS
             '/shutdown': self.cmd_shutdown,
             '/restart': self.cmd_restart,
             '/cpu_temp': self.cmd_cpu_temp,
+            '/sys_stat': self.cmd_sys_stat,
+            '/perf': self.cmd_perf,
+            '/hw_stat': self.cmd_hw_stat,
+            '/audit': self.cmd_audit,
             # COMMANDS
             '/temp_up': self.cmd_temp_up,
             '/temp_down': self.cmd_temp_down,
@@ -154,12 +292,28 @@ class ACRemote():
             '/fresh': self.cmd_fresh,
             '/feeling': self.cmd_feeling,
             '/fungusproof': self.cmd_fungusproof,
+            '/schedule': self.cmd_schedule,
+            '/unit': self.cmd_unit,
+            '/all': self.cmd_all,
             '/help': self.cmd_help,
             '/test': self.cmd_test,
         }
 
         self._ILKB_COMMANDS = {
             'confirm': self.ilkb_confirm,
+            'panel': self.ilkb_panel,
+        }
+
+        # /panel: one message per chat with inline buttons, edited in place
+        self._PANELS = {}  # {chat_id:{'msg', 'rendered', 'confirm', 'note', 'edit'}}
+
+        self._PANEL_LOCK = threading.Lock()
+
+        self._PANEL_DELAY = 0.5  # presses within this window share one edit
+
+        self._PANEL_ACTIONS = {
+            'temp_up', 'temp_down', 'swing', 'sleep', 'strong', 'mode_auto', 'mode_cool', 'mode_dry',
+            'mode_heat', 'mode_fan', 'speed_auto', 'speed_low', 'speed_mid', 'speed_high',
         }
 
         self._B2S = {  # boolean to string mapping
@@ -167,14 +321,125 @@ class ACRemote():
             False: 'OFF',
         }
 
-        self._SENT_MSG_ID = {}  # Last sent {from_id:message_id}
+        self._CONFIRM_TTL = 120  # unanswered "Are you sure?" prompts expire and get deleted
+
+        self._CACHE_SWEEP = 60
+
+        self._SENT_MSG_ID = ExpiringCache(self._CONFIRM_TTL)  # Last sent {from_id:(chat_id, message_id)}
+
+        # Power and admin commands have their own budget per user, flooding tweaks can't block them
+        self._PRIORITY_COMMANDS = {'/on', '/off', '/all'}
+
+        # Menus and queries never reach the hardware, they don't use up the admission budget
+        self._READ_ONLY_COMMANDS = {
+            '/adm', '/admin', '/start', '/main', '/mode', '/speed', '/other', '/timer', '/panel', '/cpu_temp',
+            '/sys_stat', '/perf', '/hw_stat', '/audit', '/get_stat', '/timer_get', '/schedule', '/unit', '/help',
+            '/test',
+        }
+
+        self._ADMISSION = AdmissionControl({
+            'priority': (0.2, 3),  # (tokens per second, burst)
+            'tweak': (0.5, 5),
+        })
+
+        # AC settings repeated from a backlog of late messages, other commands are only reported
+        self._BACKLOG_COMMANDS = {
+            '/temp_up', '/temp_down', '/set', '/set_temp', '/swing', '/speed_auto', '/speed_low', '/speed_mid',
+            '/speed_high', '/mode_auto', '/mode_cool', '/mode_dry', '/mode_heat', '/mode_fan', '/health',
+            '/strong', '/sleep', '/timer_up', '/timer_down', '/timer_set', '/timer_unset', '/screen', '/fresh',
+            '/feeling', '/unit',
+        }
+
+        # {from_id:{'cmd':self.cmd,args:None,kwargs:None,'confirmed':False}}
+        self._CONFIRM_CMDS = ExpiringCache(self._CONFIRM_TTL)
+
+        self._REPLY_BUFFER = threading.local()  # replies collected during a transaction
+
+        # Command log lines are printed by a listener thread, a slow stdout or journald pipe never holds up a handler
+        self._CMD_LOG = queue.SimpleQueue()
+        self._CMD_LOG_LISTENER = QueueListener(self._CMD_LOG, logging.StreamHandler(sys.stdout))
 
-        self._CONFIRM_CMDS = {}  # {from_id:{'cmd':self.cmd,args:None,kwargs:None,'confirmed':False}}
+        self._AUDIT = None
+        if audit_db:
+            from acremote.audit import AuditLog  # sqlite3 is only loaded when auditing is enabled
+            self._AUDIT = AuditLog(audit_db, audit_retention_days)
+
+        self._SCHEDULER = Scheduler(self._run_schedule, schedule_file)
+
+        # Sensor reads, sysfs samples and config reloads, so timed AC actions never wait behind them
+        self._IO = ThreadPoolExecutor(max_workers=1, thread_name_prefix='acremote-io')
+
+        self._PERF = LatencyWindow()  # per-command latencies for /perf
+
+        self._TELEMETRY = SystemTelemetry()  # the last hour of /cpu_temp and /sys_stat
+
+        self._TELEMETRY_INTERVAL = 60
+
+        self._PROFILER = None  # armed by "/perf profile"
+
+        self._METRICS = None
+        if metrics_port:
+            self._METRICS = metrics.MetricsServer(('127.0.0.1', metrics_port))
+
+        # {'listen', 'port', 'tokens': {token: user_id}} LAN JSON API, a token acts as its user
+        self._API_TOKENS = dict((api or {}).get('tokens', {}))
+
+        self._API_TOGGLES = ('swing', 'health', 'strong', 'sleep', 'screen', 'fresh', 'feeling')
+
+        self._API = None
+        if api:
+            from acremote.api import LocalAPIServer
+            self._API = LocalAPIServer((api.get('listen', '0.0.0.0'), api['port']), self)
+
+        self._MQTT = None
+        if mqtt:
+            from acremote.mqtt import MQTTBridge
+            self._MQTT = MQTTBridge(self, self._EVENTS, **mqtt)
+
+        # Fixed-layout copy of the unit states and sensor readings for other processes
+        self._SNAPSHOT = None
+        if snapshot_file:
+            from acremote.snapshot import StateSnapshot
+            self._SNAPSHOT = StateSnapshot(snapshot_file, self._EVENTS, units=len(self._UNITS))
 
         self._DEBUG = False
 
         self._load_remote_state()
 
+        if self._SNAPSHOT:
+            self._SNAPSHOT.start({name: unit.handler.state for name, unit in self._UNITS.items()})
+
+        for unit in self._UNITS.values():
+            unit.start()
+
+        self._SENDER.start()
+
+        self._SCHEDULER.load()
+
+        self._SCHEDULER.start()
+
+        self._SCHEDULER.call_later(self._CACHE_SWEEP, self._sweep_caches)
+
+        self._SCHEDULER.call_later(0, self._in_background(self._sample_telemetry))
+
+        self._SCHEDULER.call_later(0, self._in_background(self._sample_sensors))
+
+        self._CMD_LOG_LISTENER.start()
+
+        if self._AUDIT:
+            self._AUDIT.start()
+
+        if self._METRICS:
+            self._METRICS.start()
+
+        if self._API:
+            self._API.start()
+
+        if self._MQTT:
+            self._MQTT.start({name: unit.handler.state for name, unit in self._UNITS.items()},
+                             {name: (unit.handler.min_temp, unit.handler.max_temp)
+                              for name, unit in self._UNITS.items()})
+
     #################################################
     # DECORATORS
     #################################################
@@ -205,46 +470,152 @@ class ACRemote():
             chat_id = args[1]
             if chat_id in self._ADMIN_IDS:  # chat_id is also user's ID
                 return cmd(*args, **kwargs)
-            self._BOT.sendMessage(
+            self._send_message(
                 chat_id,
                 text='<code>You are not an admin</code>',
                 parse_mode='HTML',
             )
+        wrapper.admin = True  # admission control puts these in the priority lane
         return wrapper
 
+    #################################################
+    # UNITS
+    #################################################
+
+    # The _AC_* attributes resolve to the unit selected for the running thread,
+    # so command handlers don't need to know which room they are controlling
+
+    @property
+    def _unit(self) -> ACUnit:
+        return getattr(self._UNIT_CONTEXT, 'unit', None) or self._UNITS[self._DEFAULT_UNIT]
+
+    @property
+    def _AC_HANDLER(self):
+        return self._unit.handler
+
+    @property
+    def _AC_WORKER(self):
+        return self._unit.worker
+
+    @property
+    def _AC_TXN_LOCK(self):
+        return self._unit.lock
+
+    @property
+    def _AC_STORE(self):
+        return self._unit.store
+
+    @property
+    def _AC_START_TIME(self) -> int:
+        return self._unit.start_time
+
+    @_AC_START_TIME.setter
+    def _AC_START_TIME(self, value: int):
+        self._unit.start_time = value
+
+    @property
+    def _AC_STOP_TIME(self) -> int:
+        return self._unit.stop_time
+
+    @_AC_STOP_TIME.setter
+    def _AC_STOP_TIME(self, value: int):
+        self._unit.stop_time = value
+
+    @property
+    def _AC_TIMER(self) -> float:
+        return self._unit.timer
+
+    @_AC_TIMER.setter
+    def _AC_TIMER(self, value: float):
+        self._unit.timer = value
+
+    @property
+    def _AC_PENDING(self) -> dict:
+        return self._unit.pending  # {'chat_id', 'button', 'job'} power command waiting for the cooldown
+
+    @_AC_PENDING.setter
+    def _AC_PENDING(self, value: dict):
+        self._unit.pending = value
+
+    def _chat_unit(self, chat_id) -> ACUnit:
+        return self._UNITS.get(self._CHAT_UNITS.get(chat_id)) or self._UNITS[self._DEFAULT_UNIT]
+
+    @contextmanager
+    def _use_unit(self, unit: ACUnit):
+        previous = getattr(self._UNIT_CONTEXT, 'unit', None)
+        self._UNIT_CONTEXT.unit = unit
+        try:
+            yield unit
+        finally:
+            self._UNIT_CONTEXT.unit = previous
+
     #################################################
     # INTERNAL METHODS (AC SPECIFIC)
     #################################################
 
     @_confirm_cmd
     def _ac_switch(self, chat_id, start=False):
-        start_cd = int(time.time()) - self._AC_START_TIME
-        stop_cd = int(time.time()) - self._AC_STOP_TIME
-        start_done = start_cd > self._AC_COOLDOWN
-        stop_done = stop_cd > self._AC_COOLDOWN * 3
-        if start_done and stop_done:
-            if start:
-                self._AC_START_TIME = int(time.time())
-                self._BOT.sendMessage(chat_id, text='Turning on the AC')
-                self._AC_HANDLER.btn_on()
-            else:
-                self._AC_STOP_TIME = int(time.time())
-                self._BOT.sendMessage(chat_id, text='Turning off the AC')
-                self._AC_HANDLER.btn_off()
-        elif not stop_done:
-            self._BOT.sendMessage(
-                chat_id,
-                text='AC is shutting down, please wait {}s'.format(self._AC_COOLDOWN * 3 - stop_cd)
-            )
-        elif not start_done:
-            self._BOT.sendMessage(
-                chat_id,
-                text='AC is starting, please wait {}s'.format(self._AC_COOLDOWN - start_cd)
-            )
+        self._ac_cmd(chat_id, 'btn_on' if start else 'btn_off')
+
+    def _power_cooldown(self) -> tuple:
+        # (seconds left, message) while the unit is starting or shutting down, (0, None) when ready
+        now = int(time.time())
+        start_left = self._AC_COOLDOWN - (now - self._AC_START_TIME) + 1
+        stop_left = self._AC_COOLDOWN * 3 - (now - self._AC_STOP_TIME) + 1
+        if stop_left > 0:
+            return stop_left, 'AC is shutting down'
+        if start_left > 0:
+            return start_left, 'AC is starting'
+        return 0, None
+
+    def _defer_power(self, chat_id, button: str, delay: int, reason: str):
+        # Only the latest requested power state is kept, it runs once the cooldown is over
+        pending, self._AC_PENDING = self._AC_PENDING, None
+        if pending:
+            self._SCHEDULER.remove(pending['job'])
+            if pending['chat_id'] != chat_id:
+                self._send_message(pending['chat_id'], text='Your queued power command was replaced by a newer one')
+        self._AC_PENDING = {
+            'chat_id': chat_id,
+            'button': button,
+            'job': self._SCHEDULER.call_later(delay, partial(self._run_deferred_power, self._unit)),
+        }
+        self._send_message(chat_id, text='{}, turning it {} in {}s'.format(
+            reason, 'on' if button == 'btn_on' else 'off', delay,
+        ))
+
+    def _run_deferred_power(self, unit: ACUnit):
+        with self._use_unit(unit):
+            with self._AC_TXN_LOCK:
+                pending, self._AC_PENDING = self._AC_PENDING, None
+            if not pending:
+                return
+            started = time.monotonic()
+            outcome = 'ok'
+            try:
+                self._ac_cmd(pending['chat_id'], pending['button'])
+            except Exception as error:
+                outcome = 'error: {!r}'.format(error)
+                raise
+            finally:
+                self._log_cmd({'from': {'id': pending['chat_id']}}, '/' + pending['button'][4:], ['deferred'],
+                              time.monotonic() - started, outcome)
+        self._save_remote_state()
 
     @property
     def _room_temp(self):
-        return round(list(self._THERMO.poll().values())[0], 1)
+        # Sampled in the background, the sensors are only read here when that fell behind
+        if time.monotonic() - self._SENSOR_TIME > self._SENSOR_INTERVAL * 2:
+            self._read_sensors()
+        return round(list(self._SENSORS.values())[0], 1)
+
+    def _read_sensors(self) -> dict:
+        with self._SENSOR_LOCK:
+            readings = dict(self._THERMO.poll())
+            self._SENSORS, self._SENSOR_TIME = readings, time.monotonic()
+        if readings:
+            self._EVENTS.publish(SensorSample('w1', readings))
+        return readings
 
     def _timer_dial(self, up=True):
         if up and self._AC_TIMER < 24.0:
@@ -252,30 +623,89 @@ class ACRemote():
         elif not up and self._AC_TIMER > 0.0:
             self._AC_TIMER -= self._AC_HANDLER.timer_step(self._AC_TIMER)
 
-    def _save_remote_state(self):  # TODO add unittests for states
-        remote_state = {
-            attr: getattr(self._AC_HANDLER, attr)
-            for attr in dir(self._AC_HANDLER)
-            if isinstance(getattr(self._AC_HANDLER, attr), (bool, str, int, float))
-            and not attr.startswith('_')
-            and attr not in ('max_temp', 'min_temp')
-        }
-        with open(self._AC_STATE_FILE, 'w') as file_handle:
-            json.dump(remote_state, file_handle, separators=(',', ':'))
+    def _save_remote_state(self):
+        for unit in self._UNITS.values():
+            unit.save_state()
 
     def _load_remote_state(self):
-        if not os.path.isfile(self._AC_STATE_FILE):
-            return
-        with open(self._AC_STATE_FILE, 'r') as file_handle:
-            remote_state = json.load(file_handle)
-        for attr in remote_state:
+        for unit in self._UNITS.values():
+            unit.load_state()
+
+    def _ac_cmd(self, chat_id, button: str, *args):
+        # Button presses are serialized by the hardware worker, tell the user when they wait in line
+        # presses of other chats wait for a running transaction, power presses go first in line
+        with self._unit.lock.urgent() if button in self._POWER_BUTTONS else self._AC_TXN_LOCK:
+            if button in self._POWER_BUTTONS:
+                delay, reason = self._power_cooldown()
+                if delay and self._AC_DEFER_POWER:
+                    return self._defer_power(chat_id, button, delay, reason)
+                if delay:
+                    return self._send_message(chat_id, text='{}, please wait {}s'.format(reason, delay))
+                self._send_message(chat_id, text=self._POWER_BUTTONS[button])
+            was_on = self._AC_HANDLER.on
+            ahead = self._AC_WORKER.depth
+            future = self._AC_WORKER.submit(button, *args)
+            if ahead:
+                self._send_message(chat_id, text='Queued, {} command(s) ahead'.format(ahead))
+            result = future.result()
+            if self._AC_HANDLER.on != was_on:  # power cooldown applies to any command that switches the unit
+                if self._AC_HANDLER.on:
+                    self._AC_START_TIME = int(time.time())
+                else:
+                    self._AC_STOP_TIME = int(time.time())
+            return result
+
+    @contextmanager
+    def _ac_transaction(self, chat_id):
+        # Stage every state change on the remote, transmit once and reply once
+        unit = self._unit  # stays the same even if /unit switches in between
+        with unit.lock, self._buffer_replies(chat_id):
+            unit.worker.submit('begin').result()
             try:
-                setattr(self._AC_HANDLER, attr, remote_state[attr])
-            except AttributeError:
-                pass  # skip properties without setter
+                yield
+            except BaseException:
+                unit.worker.submit('rollback').result()
+                raise
+            unit.worker.submit('commit').result()
+
+    @contextmanager
+    def _capture_replies(self, chat_id):
+        # Replies to chat_id are collected and not sent, e.g. when the panel shows the outcome
+        previous = getattr(self._REPLY_BUFFER, 'replies', None), getattr(self._REPLY_BUFFER, 'chat_id', None)
+        self._REPLY_BUFFER.chat_id = chat_id
+        self._REPLY_BUFFER.replies = replies = []
+        try:
+            yield replies
+        finally:
+            self._REPLY_BUFFER.replies, self._REPLY_BUFFER.chat_id = previous
+
+    @contextmanager
+    def _buffer_replies(self, chat_id):
+        # Replies to chat_id are merged into one message, a nested buffer joins the outer one
+        if getattr(self._REPLY_BUFFER, 'replies', None) is not None:
+            yield
+            return
+        self._REPLY_BUFFER.chat_id = chat_id
+        self._REPLY_BUFFER.replies = []
+        try:
+            yield
+        finally:
+            replies = self._REPLY_BUFFER.replies
+            self._REPLY_BUFFER.replies = None
+            self._flush_replies(chat_id, replies)
+
+    @_confirm_cmd
+    def _ac_group(self, chat_id, buttons: list):
+        # The same presses on every unit, one frame per unit and one reply
+        with self._buffer_replies(chat_id):
+            for unit in self._UNITS.values():
+                with self._use_unit(unit), self._ac_transaction(chat_id):
+                    self._send_message(chat_id, text='<b>{}</b>'.format(html.escape(unit.name)), parse_mode='HTML')
+                    for button in buttons:
+                        self._ac_cmd(chat_id, *button)
 
     def _cmd_response(self, chat_id, setting, value):
-        self._BOT.sendMessage(
+        self._send_message(
             chat_id,
             text='AC {0}: <b>{1}</b>'.format(setting, value),
             parse_mode='HTML',
@@ -288,7 +718,7 @@ class ACRemote():
     @_admin_cmd
     @_confirm_cmd
     def cmd_shutdown(self, chat_id):
-        self._BOT.sendMessage(
+        self._send_message(
             chat_id,
             text='<code>Shutting down</code>',
             parse_mode='HTML',
@@ -298,24 +728,138 @@ class ACRemote():
     @_admin_cmd
     @_confirm_cmd
     def cmd_restart(self, chat_id):
-        self._BOT.sendMessage(
+        self._send_message(
             chat_id,
             text='<code>Restarting</code>',
             parse_mode='HTML',
         )
         subprocess.run(['/sbin/init', '6'])
 
+    @staticmethod
+    def _format_trend(trend: dict, fmt: str) -> str:
+        # ' (min..max, change in N min)' over the buffered telemetry samples
+        if not trend or not trend['minutes']:
+            return ''
+        return ' ({}..{}, {}{} in {} min)'.format(
+            fmt.format(trend['min']), fmt.format(trend['max']),
+            '+' if trend['change'] >= 0 else '-', fmt.format(abs(trend['change'])), trend['minutes'],
+        )
+
+    def _format_cpu_temp(self, sample: dict) -> str:
+        if sample['cpu_temp'] is None:
+            return 'CPU temperature: n/a'
+        return 'CPU temperature: {:.1f}°C{}'.format(
+            sample['cpu_temp'], self._format_trend(self._TELEMETRY.trend('cpu_temp'), '{:.1f}°C'),
+        )
+
     @_admin_cmd
     def cmd_cpu_temp(self, chat_id):
-        result = subprocess.run(
-            args=['/opt/vc/bin/vcgencmd', 'measure_temp'],
-            stdout=subprocess.PIPE,
-            universal_newlines=True,
+        self._send_message(
+            chat_id,
+            text='<code>{}</code>'.format(self._format_cpu_temp(self._TELEMETRY.latest())),
+            parse_mode='HTML',
+        )
+
+    @_admin_cmd
+    def cmd_sys_stat(self, chat_id):
+        # Answered from the telemetry ring buffer, see _sample_telemetry
+        sample = self._TELEMETRY.latest()
+        reply = [self._format_cpu_temp(sample)]
+        if sample['load']:
+            reply.append('Load: {:.2f} {:.2f} {:.2f}{}'.format(
+                *sample['load'], self._format_trend(self._TELEMETRY.trend('load', 0), '{:.2f}'),
+            ))
+        if sample['mem_available'] is not None:
+            reply.append('Memory: {} of {} MB available{}'.format(
+                sample['mem_available'], sample['mem_total'],
+                self._format_trend(self._TELEMETRY.trend('mem_available'), '{} MB'),
+            ))
+        if sample['throttled'] is not None:
+            now, since_boot = throttled_flags(sample['throttled'])
+            reply.append('Throttling: {}'.format(', '.join(now) or 'none'))
+            if since_boot:
+                reply.append('Since boot: {}'.format(', '.join(since_boot)))
+        self._send_message(
+            chat_id,
+            text='<code>' + html.escape('\n'.join(reply)) + '</code>',
+            parse_mode='HTML',
+        )
+
+    @_admin_cmd
+    def cmd_perf(self, chat_id, *args):
+        # /perf -> latency percentiles, /perf profile [messages] -> sample the next messages, /perf off
+        if args and args[0] == 'profile':
+            messages = int(args[1]) if len(args) > 1 and args[1].isdigit() else 20
+            if self._PROFILER:
+                self._PROFILER.stop()
+            self._PROFILER = SamplingProfiler(
+                messages,
+                on_done=lambda profiler: self._send_profile(chat_id, profiler),
+                extra_threads=lambda: [unit.worker.ident for unit in self._UNITS.values()] + [self._SENDER.ident],
+            )
+            self._send_message(chat_id, text='Profiling the next {} messages'.format(messages))
+            return
+
+        if args and args[0] == 'off':
+            if self._PROFILER:
+                self._PROFILER.stop()
+                self._PROFILER = None
+            self._send_message(chat_id, text='Profiling is off')
+            return
+
+        reply = ['Latency, last hour:']
+        for command, stats in sorted(self._PERF.percentiles().items()):
+            reply.append('{} n={} p50={:.0f}ms p95={:.0f}ms p99={:.0f}ms'.format(
+                command, stats['count'], stats['p50'] * 1000, stats['p95'] * 1000, stats['p99'] * 1000,
+            ))
+        if self._PROFILER:
+            reply.append('Profiling, {} messages to go'.format(self._PROFILER.remaining))
+        self._send_message(
+            chat_id,
+            text='<code>' + html.escape('\n'.join(reply)) + '</code>',
+            parse_mode='HTML',
         )
-        result = result.stdout.strip().split('=')[1].replace('\'', '°')
-        self._BOT.sendMessage(
+
+    @_admin_cmd
+    def cmd_hw_stat(self, chat_id):
+        reply = []
+        for unit in self._UNITS.values():
+            if len(self._UNITS) > 1:
+                reply.append('[{}]'.format(unit.name))
+            reply.append('Queue depth: {}'.format(unit.worker.depth))
+            for command, stats in sorted(unit.worker.stats().items()):
+                reply.append('{} n={count} wait={wait_ms}ms run={run_ms}ms max={max_ms}ms'.format(command, **stats))
+        self._send_message(
             chat_id,
-            text='<code>CPU temperature: {}</code>'.format(result),
+            text='<code>' + '\n'.join(reply) + '</code>',
+            parse_mode='HTML',
+        )
+
+    @_admin_cmd
+    def cmd_audit(self, chat_id, *args):
+        # /audit [command] [hours], e.g. "/audit off 12" -> who turned it off in the last 12h
+        if not self._AUDIT:
+            self._send_message(chat_id, text='Audit log is disabled')
+            return
+
+        command, hours = None, 24.0
+        for arg in args:
+            try:
+                hours = float(arg)
+            except ValueError:
+                command = '/' + arg.lstrip('/')
+
+        records = self._AUDIT.query(command=command, since=time.time() - hours * 3600)
+        reply = ['{} {} {}{} {}'.format(
+            time.strftime('%m-%d %H:%M', time.localtime(record['ts'])),
+            '@' + record['username'] if record['username'] else record['user_id'],
+            record['command'],
+            ''.join(' ' + arg for arg in record['args']),
+            record['outcome'],
+        ) for record in records]
+        self._send_message(
+            chat_id,
+            text='<code>' + html.escape('\n'.join(reply) or 'No records') + '</code>',
             parse_mode='HTML',
         )
 
@@ -325,7 +869,7 @@ class ACRemote():
 
     def cmd_get_stat(self, chat_id):
         reply = [
-            'AC Status:',
+            'AC Status:' if len(self._UNITS) == 1 else 'AC Status ({}):'.format(html.escape(self._unit.name)),
             'Power       = {}'.format(self._B2S[self._AC_HANDLER.on]),
             'Mode        = {}'.format(self._AC_HANDLER.mode),
             'Temperature = {}°C'.format(self._AC_HANDLER.temp),
@@ -341,100 +885,99 @@ class ACRemote():
             'Screen      = {}'.format(self._B2S[self._AC_HANDLER.screen]),
         ]
         reply = '<code>' + '\n'.join(line for line in reply) + '</code>'
-        self._BOT.sendMessage(chat_id, text=reply, parse_mode='HTML')
+        self._send_message(chat_id, text=reply, parse_mode='HTML')
 
     def cmd_set_temp(self, chat_id, *args):
         try:
             temp = args[0]
         except IndexError:
-            self._BOT.sendMessage(chat_id, text='You need to supply temperature value')
+            self._send_message(chat_id, text='You need to supply temperature value')
             return
 
         try:
-            self._AC_HANDLER.btn_tmp_set(temp)
-            self._AC_START_TIME = time.time()
+            self._ac_cmd(chat_id, 'btn_tmp_set', temp)
             reply = 'AC temperature: <b>{}°C</b>'.format(temp)
         except ValueError as error:
             reply = str(error)
 
-        self._BOT.sendMessage(
+        self._send_message(
             chat_id,
             text=reply,
             parse_mode='HTML',
         )
 
     def cmd_temp_up(self, chat_id, *args):
-        if self._AC_HANDLER.btn_tmp_up():
+        if self._ac_cmd(chat_id, 'btn_tmp_up'):
             reply = 'AC temperature: <b>{}°C</b>'
         else:
             reply = 'AC temperature: <b>{}°C MAX</b>'
 
-        self._BOT.sendMessage(
+        self._send_message(
             chat_id,
             text=reply.format(self._AC_HANDLER.temp),
             parse_mode='HTML',
         )
 
     def cmd_temp_down(self, chat_id, *args):
-        if self._AC_HANDLER.btn_tmp_down():
+        if self._ac_cmd(chat_id, 'btn_tmp_down'):
             reply = 'AC temperature: <b>{}°C</b>'
         else:
             reply = 'AC temperature: <b>{}°C MIN</b>'
 
-        self._BOT.sendMessage(
+        self._send_message(
             chat_id,
             text=reply.format(self._AC_HANDLER.temp),
             parse_mode='HTML',
         )
 
     def cmd_swing(self, chat_id, *args):
-        self._AC_HANDLER.btn_swing()
+        self._ac_cmd(chat_id, 'btn_swing')
         self._cmd_response(chat_id, 'swing', self._B2S[self._AC_HANDLER.swing])
 
     def cmd_health(self, chat_id, *args):
-        self._AC_HANDLER.btn_health()
+        self._ac_cmd(chat_id, 'btn_health')
         self._cmd_response(chat_id, 'health', self._B2S[self._AC_HANDLER.health])
 
     def cmd_strong(self, chat_id, *args):
-        self._AC_HANDLER.btn_strong()
+        self._ac_cmd(chat_id, 'btn_strong')
         self._cmd_response(chat_id, 'strong', self._B2S[self._AC_HANDLER.strong])
 
     def cmd_sleep(self, chat_id, *args):
-        self._AC_HANDLER.btn_sleep()
+        self._ac_cmd(chat_id, 'btn_sleep')
         self._cmd_response(chat_id, 'sleep', self._B2S[self._AC_HANDLER.sleep])
 
     def cmd_screen(self, chat_id):
-        self._AC_HANDLER.btn_screen()
+        self._ac_cmd(chat_id, 'btn_screen')
         self._cmd_response(chat_id, 'screen', self._B2S[self._AC_HANDLER.screen])
 
     def cmd_clean(self, chat_id):
-        if self._AC_HANDLER.btn_clean():
-            self._BOT.sendMessage(chat_id, text='AC cleaning mode')
+        if self._ac_cmd(chat_id, 'btn_clean'):
+            self._send_message(chat_id, text='AC cleaning mode')
         else:
-            self._BOT.sendMessage(chat_id, text='AC must be off')
+            self._send_message(chat_id, text='AC must be off')
 
     def cmd_fresh(self, chat_id):
-        self._AC_HANDLER.btn_fresh()  # TODO: Add check like cmd_clean
+        self._ac_cmd(chat_id, 'btn_fresh')  # TODO: Add check like cmd_clean
         self._cmd_response(chat_id, 'fresh', self._B2S[self._AC_HANDLER.fresh])
 
     def cmd_feeling(self, chat_id):
-        self._AC_HANDLER.btn_feeling()
+        self._ac_cmd(chat_id, 'btn_feeling')
         self._cmd_response(chat_id, 'feeling', self._B2S[self._AC_HANDLER.feeling])
 
     def cmd_speed_auto(self, chat_id):
-        self._AC_HANDLER.btn_speed('AUTO')
+        self._ac_cmd(chat_id, 'btn_speed', 'AUTO')
         self._cmd_response(chat_id, 'speed', self._AC_HANDLER.speed)
 
     def cmd_speed_low(self, chat_id):
-        self._AC_HANDLER.btn_speed('LOW')
+        self._ac_cmd(chat_id, 'btn_speed', 'LOW')
         self._cmd_response(chat_id, 'speed', self._AC_HANDLER.speed)
 
     def cmd_speed_mid(self, chat_id):
-        self._AC_HANDLER.btn_speed('MID')
+        self._ac_cmd(chat_id, 'btn_speed', 'MID')
         self._cmd_response(chat_id, 'speed', self._AC_HANDLER.speed)
 
     def cmd_speed_high(self, chat_id):
-        self._AC_HANDLER.btn_speed('HIGH')
+        self._ac_cmd(chat_id, 'btn_speed', 'HIGH')
         self._cmd_response(chat_id, 'speed', self._AC_HANDLER.speed)
 
     def cmd_turn_on(self, chat_id):
@@ -444,28 +987,28 @@ class ACRemote():
         self._ac_switch(chat_id, False)
 
     def cmd_mode_auto(self, chat_id):
-        self._AC_HANDLER.btn_mode('AUTO')
+        self._ac_cmd(chat_id, 'btn_mode', 'AUTO')
         self._cmd_response(chat_id, 'mode', self._AC_HANDLER.mode)
 
     def cmd_mode_cool(self, chat_id):
-        self._AC_HANDLER.btn_mode('COOL')
+        self._ac_cmd(chat_id, 'btn_mode', 'COOL')
         self._cmd_response(chat_id, 'mode', self._AC_HANDLER.mode)
 
     def cmd_mode_dry(self, chat_id):
-        self._AC_HANDLER.btn_mode('DRY')
+        self._ac_cmd(chat_id, 'btn_mode', 'DRY')
         self._cmd_response(chat_id, 'mode', self._AC_HANDLER.mode)
 
     def cmd_mode_heat(self, chat_id):
-        self._AC_HANDLER.btn_mode('HEAT')
+        self._ac_cmd(chat_id, 'btn_mode', 'HEAT')
         self._cmd_response(chat_id, 'mode', self._AC_HANDLER.mode)
 
     def cmd_mode_fan(self, chat_id):
-        self._AC_HANDLER.btn_mode('FAN')
+        self._ac_cmd(chat_id, 'btn_mode', 'FAN')
         self._cmd_response(chat_id, 'mode', self._AC_HANDLER.mode)
 
     def cmd_timer_up(self, chat_id):
         self._timer_dial(True)
-        self._BOT.sendMessage(
+        self._send_message(
             chat_id,
             text='Timer dial: <b>{}</b> hours'.format(self._AC_TIMER),
             parse_mode='HTML',
@@ -473,14 +1016,14 @@ class ACRemote():
 
     def cmd_timer_down(self, chat_id):
         self._timer_dial(False)
-        self._BOT.sendMessage(
+        self._send_message(
             chat_id,
             text='Timer dial: <b>{}</b> hours'.format(self._AC_TIMER),
             parse_mode='HTML',
         )
 
     def cmd_timer_get(self, chat_id):
-        self._BOT.sendMessage(
+        self._send_message(
             chat_id,
             text='AC timer set to: <b>{}</b> hours'.format(self._AC_HANDLER.timer),
             parse_mode='HTML',
@@ -493,46 +1036,147 @@ class ACRemote():
             pass  # Make the argument optional
 
         try:
-            self._AC_HANDLER.btn_timer(self._AC_TIMER)
+            self._ac_cmd(chat_id, 'btn_timer', self._AC_TIMER)
         except ValueError as error:
             self._AC_TIMER = self._AC_HANDLER.timer
-            self._BOT.sendMessage(chat_id, text=str(error))
+            self._send_message(chat_id, text=str(error))
 
         self.cmd_timer_get(chat_id)
 
     def cmd_timer_unset(self, chat_id):
         self._AC_TIMER = 0.0
-        self._AC_HANDLER.btn_timer(self._AC_TIMER)
+        self._ac_cmd(chat_id, 'btn_timer', self._AC_TIMER)
         self.cmd_timer_get(chat_id)
 
     def cmd_fungusproof(self, chat_id):
         if self._AC_HANDLER.on:
-            self._BOT.sendMessage(chat_id, text='AC must be off')
+            self._send_message(chat_id, text='AC must be off')
         else:
-            self._AC_HANDLER.btn_clean()
-            self._BOT.sendMessage(chat_id, text='AC fungusproof mode')
+            self._ac_cmd(chat_id, 'btn_clean')
+            self._send_message(chat_id, text='AC fungusproof mode')
+
+    def cmd_schedule(self, chat_id, *args):
+        # /schedule [add HH:MM [days] action | del ID], e.g. "/schedule add 8:30 mon-fri cool 24"
+        usage = ('Usage:\n/schedule\n/schedule add HH:MM [once|daily|weekdays|weekends|mon-fri|sat,sun] '
+                 'off|on|[mode] [temperature]\n/schedule del ID')
+        if args and args[0] == 'add':
+            try:
+                at, days, action = args[1], (), args[2:]
+                try:
+                    days, action = parse_days(args[2]), args[3:]
+                except (IndexError, ValueError):
+                    pass
+                self._schedule_buttons(action)
+                unit = self._unit.name if len(self._UNITS) > 1 else None
+                job = self._SCHEDULER.add(chat_id, at, days, ' '.join(action).lower(), unit=unit)
+            except (IndexError, ValueError):
+                self._send_message(chat_id, text=usage)
+                return
+            self._send_message(chat_id, text='Scheduled #{}: {}'.format(job['id'], self._format_job(job)))
+        elif args and args[0] == 'del' and len(args) > 1 and args[1].lstrip('#').isdigit():
+            removed = self._SCHEDULER.remove(int(args[1].lstrip('#')))
+            self._send_message(chat_id, text='Schedule removed' if removed else 'No such schedule')
+        elif args:
+            self._send_message(chat_id, text=usage)
+        else:
+            jobs = self._SCHEDULER.jobs()
+            reply = ['#{} {}'.format(job['id'], self._format_job(job)) for job in jobs]
+            self._send_message(chat_id, text='\n'.join(reply) or 'Nothing scheduled')
+
+    def cmd_unit(self, chat_id, *args):
+        # /unit -> list the units, /unit NAME -> send the following commands to that unit
+        if args:
+            unit = self._UNITS.get(args[0].lower()) or self._UNITS.get(args[0])
+            if unit is None:
+                self._send_message(chat_id, text='No unit called "{}"'.format(args[0]))
+                return
+            self._CHAT_UNITS[chat_id] = unit.name
+            self._UNIT_CONTEXT.unit = unit  # also for the rest of this message
+            self._send_message(
+                chat_id,
+                text='Controlling <b>{}</b>'.format(html.escape(unit.name)),
+                parse_mode='HTML',
+                reply_markup=self._AC_KB['main'],
+            )
+            return
+
+        current = self._chat_unit(chat_id)
+        reply = ['{} {} {} {}°C{}'.format(
+            unit.name,
+            self._B2S[unit.handler.on],
+            unit.handler.mode,
+            unit.handler.temp,
+            ' (current)' if unit is current else '',
+        ) for unit in self._UNITS.values()]
+        self._send_message(
+            chat_id,
+            text='\n'.join(reply),
+            reply_markup=dict(
+                keyboard=[['/unit ' + name] for name in self._UNITS] + [['/main']],
+                resize_keyboard=True,
+            ),
+        )
+
+    def cmd_all(self, chat_id, *args):
+        # /all off|on|[mode] [temperature], e.g. "/all cool 24"
+        try:
+            buttons = self._schedule_buttons(args)
+        except ValueError:
+            self._send_message(chat_id, text='Usage: /all off|on|[mode] [temperature]')
+            return
+        self._ac_group(chat_id, buttons)
 
     def cmd_help(self, chat_id):
         reply = 'List of available commands:\n\n'
         reply += '\n\n'.join(sorted(self._COMMANDS.keys()))
-        self._BOT.sendMessage(chat_id, text=reply)
+        self._send_message(chat_id, text=reply)
 
     @_confirm_cmd
     def cmd_test(self, chat_id, *args):
-        self._BOT.sendMessage(chat_id, text='Passed\nArguments: {}'.format(args))
+        self._send_message(chat_id, text='Passed\nArguments: {}'.format(args))
 
     #################################################
     # INLINE KEYBOARD COMMANDS
     #################################################
 
     def ilkb_confirm(self, chat_id, value):
-        if int(value) == 1:
-            self._CONFIRM_CMDS[chat_id]['confirmed'] = True
-            cmd = self._CONFIRM_CMDS[chat_id]['cmd']
-            args = self._CONFIRM_CMDS[chat_id]['args']
-            kwargs = self._CONFIRM_CMDS[chat_id]['kwargs']
-            cmd(*args, **kwargs)
-        del self._CONFIRM_CMDS[chat_id]
+        confirm_cmd = self._CONFIRM_CMDS.pop(chat_id)
+        if confirm_cmd is None:
+            self._send_message(chat_id, text='This confirmation has expired, please send the command again')
+        elif int(value) == 1:
+            confirm_cmd['confirmed'] = True
+            confirm_cmd['cmd'](*confirm_cmd['args'], **confirm_cmd['kwargs'])
+
+    def ilkb_panel(self, chat_id, action):
+        # Presses change the AC right away, the panel is redrawn once they stop coming
+        with self._PANEL_LOCK:
+            panel = self._PANELS.get(chat_id)
+        if panel is None:
+            self._send_message(chat_id, text='This panel has expired, send /panel for a new one')
+            return
+
+        if action in ('power', 'no'):  # power asks on the panel itself instead of a prompt
+            panel['confirm'] = action == 'power'
+            panel['note'] = None
+        elif action == 'yes' or action in self._PANEL_ACTIONS:
+            panel['confirm'] = False
+            power = action == 'yes'
+            command = ('/off' if self._AC_HANDLER.on else '/on') if power else '/' + action
+            wait = self._ADMISSION.admit(chat_id, self._lane(command))
+            if wait:
+                COMMANDS_REJECTED.labels(self._lane(command)).inc()
+                panel['note'] = 'Too many presses, try again in {}s'.format(math.ceil(wait))
+            else:
+                with self._capture_replies(chat_id) as replies:
+                    if power:
+                        self._ac_cmd(chat_id, 'btn_off' if command == '/off' else 'btn_on')
+                    else:
+                        self._COMMANDS[command](chat_id)
+                # the panel shows the state, only power outcomes (cooldown, queued) are worth a line
+                panel['note'] = replies[-1][0] if power and replies else None
+        else:
+            return
+        self._queue_panel_edit(chat_id)
 
     #################################################
     # ADMIN MENU
@@ -540,7 +1184,7 @@ class ACRemote():
 
     @_admin_cmd
     def menu_admin(self, chat_id):
-        self._BOT.sendMessage(
+        self._send_message(
             chat_id,
             text='<code>Admin:</code>',
             parse_mode='HTML',
@@ -552,7 +1196,7 @@ class ACRemote():
     #################################################
 
     def menu_start(self, chat_id):
-        self._BOT.sendMessage(
+        self._send_message(
             chat_id,
             text='Rise and shine <b>Mr. Freeman</b>',
             parse_mode='HTML',
@@ -560,14 +1204,14 @@ class ACRemote():
         )
 
     def menu_main(self, chat_id):
-        self._BOT.sendMessage(
+        self._send_message(
             chat_id,
             text='Main:',
             reply_markup=self._AC_KB['main']
         )
 
     def menu_mode(self, chat_id):
-        self._BOT.sendMessage(
+        self._send_message(
             chat_id,
             text='AC mode: <b>{}</b>'.format(self._AC_HANDLER.mode),
             parse_mode='HTML',
@@ -580,7 +1224,7 @@ class ACRemote():
             'AC strong: <b>{}</b>'.format(self._B2S[self._AC_HANDLER.strong]),
             'AC sleep: <b>{}</b>'.format(self._B2S[self._AC_HANDLER.sleep]),
         ])
-        self._BOT.sendMessage(
+        self._send_message(
             chat_id,
             text=reply,
             parse_mode='HTML',
@@ -588,18 +1232,40 @@ class ACRemote():
         )
 
     def menu_other(self, chat_id):
-        self._BOT.sendMessage(
+        self._send_message(
             chat_id,
             text='Other:',
             reply_markup=self._AC_KB['other']
         )
 
+    def menu_panel(self, chat_id):
+        with self._PANEL_LOCK:
+            old = self._PANELS.pop(chat_id, None)
+        if old:  # one panel per chat
+            self._SENDER.call(chat_id, 'deleteMessage', old['msg'], ignore=_MESSAGE_GONE)
+        rendered = self._render_panel(chat_id)
+        sent_msg = self._SENDER.send(
+            chat_id,
+            text=rendered[0],
+            parse_mode='HTML',
+            reply_markup=rendered[1],
+            merge=False,  # edited later, keep it a separate message
+        ).result()
+        with self._PANEL_LOCK:
+            self._PANELS[chat_id] = {
+                'msg': (sent_msg['chat']['id'], sent_msg['message_id']),
+                'rendered': rendered,
+                'confirm': False,
+                'note': None,
+                'edit': None,
+            }
+
     def menu_timer(self, chat_id):
         reply = '\n'.join([
             'AC timer: {} hours'.format(self._AC_HANDLER.timer),
             'Remote dial: {} hours'.format(self._AC_TIMER),
         ])
-        self._BOT.sendMessage(
+        self._send_message(
             chat_id,
             text=reply,
             reply_markup=self._AC_KB['timer']
@@ -610,26 +1276,112 @@ class ACRemote():
     #################################################
 
     def _send_confirm(self, chat_id):
-        keyboard = InlineKeyboardMarkup(
+        keyboard = dict(
             inline_keyboard=[[
-                InlineKeyboardButton(text='Yes', callback_data='confirm:1'),
-                InlineKeyboardButton(text='No', callback_data='confirm:0'),
+                dict(text='Yes', callback_data='confirm:1'),
+                dict(text='No', callback_data='confirm:0'),
             ]]
         )
-        sent_msg = self._BOT.sendMessage(
+        sent_msg = self._SENDER.send(
             chat_id,
             text='Are you sure?',
-            reply_markup=keyboard
-        )
-        self._SENT_MSG_ID[chat_id] = telepot.message_identifier(sent_msg)
+            reply_markup=keyboard,
+            merge=False,  # the prompt gets deleted later, keep it a separate message
+        ).result()
+        self._SENT_MSG_ID[chat_id] = (sent_msg['chat']['id'], sent_msg['message_id'])
+
+    def _render_panel(self, chat_id) -> tuple:
+        # (text, reply_markup) of the chat's control panel for the current unit
+        handler = self._AC_HANDLER
+        panel = self._PANELS.get(chat_id) or {}
+        lines = ['<b>{}</b>'.format(html.escape(self._unit.name))] if len(self._UNITS) > 1 else []
+        lines += [
+            'Power: <b>{}</b>  Mode: <b>{}</b>'.format(self._B2S[handler.on], handler.mode),
+            'Temperature: <b>{}°C</b>  Speed: <b>{}</b>'.format(handler.temp, handler.speed),
+            'Swing: <b>{}</b>  Sleep: <b>{}</b>  Strong: <b>{}</b>'.format(
+                self._B2S[handler.swing], self._B2S[handler.sleep], self._B2S[handler.strong],
+            ),
+        ]
+        if panel.get('note'):
+            lines.append('<i>{}</i>'.format(html.escape(panel['note'])))
+
+        def button(text, action):
+            return dict(text=text, callback_data='panel:' + action)
+
+        if panel.get('confirm'):
+            first_row = [button('Turn {}? Yes'.format('off' if handler.on else 'on'), 'yes'), button('No', 'no')]
+        else:
+            first_row = [button('Turn off' if handler.on else 'Turn on', 'power'),
+                         button('−', 'temp_down'), button('+', 'temp_up')]
+        keyboard = dict(inline_keyboard=[
+            first_row,
+            [button(mode.capitalize(), 'mode_' + mode) for mode in ('auto', 'cool', 'dry', 'heat', 'fan')],
+            [button(speed.capitalize(), 'speed_' + speed) for speed in ('auto', 'low', 'mid', 'high')],
+            [button('Swing', 'swing'), button('Sleep', 'sleep'), button('Strong', 'strong')],
+        ])
+        return '\n'.join(lines), keyboard
+
+    def _queue_panel_edit(self, chat_id):
+        with self._PANEL_LOCK:
+            panel = self._PANELS.get(chat_id)
+            if panel is None or panel['edit'] is not None:
+                return  # an edit is already coming
+            panel['edit'] = self._SCHEDULER.call_later(self._PANEL_DELAY, partial(self._edit_panel, chat_id))
+
+    def _edit_panel(self, chat_id):
+        # Runs on the scheduler thread and only queues the edit, when the panel looks different
+        with self._PANEL_LOCK:
+            panel = self._PANELS.get(chat_id)
+            if panel is None:
+                return
+            panel['edit'] = None
+        with self._use_unit(self._chat_unit(chat_id)):
+            rendered = self._render_panel(chat_id)
+        if rendered == panel['rendered']:
+            return
+        panel['rendered'] = rendered
+        self._SENDER.call(
+            chat_id, 'editMessageText', panel['msg'], rendered[0], parse_mode='HTML', reply_markup=rendered[1],
+            ignore=_MESSAGE_GONE,
+        ).add_done_callback(partial(self._panel_edited, panel))
+
+    @staticmethod
+    def _panel_edited(panel, future):
+        if future.exception() is not None:
+            panel['rendered'] = None  # unknown, the next press redraws it
+
+    def _send_message(self, chat_id, text, parse_mode=None, reply_markup=None):
+        replies = getattr(self._REPLY_BUFFER, 'replies', None)
+        if replies is not None and chat_id == self._REPLY_BUFFER.chat_id:
+            replies.append((text, parse_mode, reply_markup))
+            return None
+        return self._SENDER.send(chat_id, text, parse_mode=parse_mode, reply_markup=reply_markup)
+
+    def _flush_replies(self, chat_id, replies):
+        if not replies:
+            return
+        text, parse_mode, reply_markup = merge_messages(replies)
+        self._send_message(chat_id, text=text, parse_mode=parse_mode, reply_markup=reply_markup)
 
     def _unknown_cmd(self, chat_id, cmd):
-        self._BOT.sendMessage(
+        self._send_message(
             chat_id,
             text='Unknown command "{}".\nTry "/help" to bring the list of commands'.format(cmd)
         )
 
-    def _log_cmd(self, msg, cmd, args):
+    def _log_cmd(self, msg, cmd, args, latency, outcome):
+        unit = self._unit.name if len(self._UNITS) > 1 else None
+        if self._AUDIT:  # only enqueue, the audit and log threads do the I/O
+            self._AUDIT.record(
+                msg['from'].get('id'),
+                msg['from'].get('username'),
+                cmd,
+                args,
+                latency,
+                outcome,
+                dict(self._AC_HANDLER.state, unit=unit) if unit else self._AC_HANDLER.state,
+            )
+
         log = 'user_id={} is_bot={} username={} first_name={} last_name={} command={}'.format(
             msg['from'].get('id'),
             msg['from'].get('is_bot'),
@@ -641,17 +1393,113 @@ class ACRemote():
 
         if args:
             log += ' arguments={}'.format(args)
-        print(log, flush=True)
+        if unit:
+            log += ' unit={}'.format(unit)
+        log += ' latency={:.3f}s outcome={}'.format(latency, outcome)
+        self._CMD_LOG.put(logging.makeLogRecord({'msg': log}))
+
+    def _send_profile(self, chat_id, profiler):
+        if self._PROFILER is profiler:
+            self._PROFILER = None
+        reply = ['Profile: {} samples'.format(profiler.samples), ' self  total  function']
+        for function, own, total in profiler.top():
+            reply.append('{:>5.0%}  {:>5.0%}  {}'.format(own, total, function))
+        self._send_message(
+            chat_id,
+            text='<code>' + html.escape('\n'.join(reply)) + '</code>',
+            parse_mode='HTML',
+        )
 
-    def _process_entities(self, msg):
+    def _schedule_buttons(self, action) -> list:
+        # 'off' | 'on' | '[mode] [temperature]' -> button presses sent as one frame
+        words = [word.upper() for word in action]
+        if words == ['OFF']:
+            return [('btn_off',)]
+        if words == ['ON']:
+            return [('btn_on',)]
+        mode = temp = None
+        for word in words:
+            if word.isdigit() and self._AC_HANDLER.min_temp <= int(word) <= self._AC_HANDLER.max_temp:
+                temp = int(word)
+            elif word in self._AC_HANDLER.modes:
+                mode = word
+            else:
+                raise ValueError('Unknown action {!r}'.format(word))
+        if mode is None and temp is None:
+            raise ValueError('Empty action')
+        buttons = [('btn_tmp_set', temp) if temp is not None else ('btn_on',)]
+        if mode:
+            buttons.append(('btn_mode', mode))
+        return buttons
+
+    @staticmethod
+    def _format_job(job) -> str:
+        return '{} {} {}{} (next: {})'.format(
+            job['time'],
+            format_days(job['days']),
+            job['unit'] + ' ' if job.get('unit') else '',
+            job['action'],
+            time.strftime('%a %d %b %H:%M', time.localtime(job['due'])),
+        )
 
+    def _run_schedule(self, job):
+        # Runs on the scheduler thread, goes through the same worker and transaction as chat commands
+        chat_id = job['chat_id']
+        started = time.monotonic()
+        outcome = 'ok'
+        unit = self._UNITS.get(job.get('unit') or self._DEFAULT_UNIT)
+        try:
+            if unit is None:
+                raise ValueError('Unknown unit {!r}'.format(job['unit']))
+            with self._use_unit(unit), self._ac_transaction(chat_id):
+                self._send_message(chat_id, text='Schedule #{id} {time}: {action}'.format(**job))
+                for button in self._schedule_buttons(job['action'].split()):
+                    self._ac_cmd(chat_id, *button)
+        except Exception as error:
+            outcome = 'error: {!r}'.format(error)
+            raise
+        finally:
+            self._log_cmd({'from': {'id': chat_id}}, '/schedule', ['run', str(job['id'])],
+                          time.monotonic() - started, outcome)
+        self._save_remote_state()
+
+    def _run_cmd(self, msg, chat_id, cmd, args):
+        started = time.monotonic()
+        outcome = 'ok'
+        try:
+            try:
+                handler = self._COMMANDS[cmd]
+            except KeyError:
+                outcome = 'unknown'
+                self._unknown_cmd(chat_id, cmd)
+            else:
+                prompt = self._CONFIRM_CMDS.get(chat_id)
+                handler(chat_id, *args)
+                pending = self._CONFIRM_CMDS.get(chat_id)
+                if pending is not None and pending is not prompt:  # asked "Are you sure?"
+                    pending['command'] = (cmd, list(args))  # logged again once answered
+                    outcome = 'prompted'
+        except Exception as error:
+            outcome = 'error: {!r}'.format(error)
+            COMMAND_ERRORS.labels(cmd if cmd in self._COMMANDS else 'unknown').inc()
+            raise
+        finally:
+            latency = time.monotonic() - started
+            label = cmd if cmd in self._COMMANDS else 'unknown'
+            COMMAND_SECONDS.labels(label).observe(latency)
+            self._PERF.record(label, latency)
+            self._log_cmd(msg, cmd, args, latency, outcome)
+
+    @staticmethod
+    def _parse_commands(msg) -> list:
+        # Message -> [(cmd, args)] in the order they were written
         try:
             entities = msg['entities']
             text = msg['text']
-            chat_id = msg['chat']['id']  # TODO change to from->id
         except KeyError:
-            return
+            return []
 
+        commands = []
         for entity in entities:
             if entity['type'] == 'bot_command':
                 offset = entity['offset']
@@ -662,82 +1510,539 @@ class ACRemote():
                     args = text[endpos:text.index('/', endpos)].split()
                 except ValueError:
                     args = text[endpos:].split()
-                self._log_cmd(msg, cmd, args)
-                try:
-                    self._COMMANDS[cmd](chat_id, *args)
-                except KeyError:
-                    self._unknown_cmd(chat_id, cmd)
+                commands.append((cmd, args))
+        return commands
+
+    def _process_entities(self, msg):
+        commands = self._admit(msg, self._parse_commands(msg))
+        if commands:
+            self._run_commands(msg, msg['chat']['id'], commands)  # TODO change to from->id
+
+    def _lane(self, cmd: str):
+        if cmd in self._READ_ONLY_COMMANDS or cmd not in self._COMMANDS:
+            return None  # never refused, unknown commands only get a reply
+        if cmd in self._PRIORITY_COMMANDS or getattr(self._COMMANDS.get(cmd), 'admin', False):
+            return 'priority'
+        return 'tweak'
+
+    def _admit(self, msg, commands) -> list:
+        # One token per lane and message (the tweaks of a message are one IR frame).
+        # Refused commands are logged and reported but never reach the hardware
+        refused = {}
+        for lane in set(map(self._lane, (cmd for cmd, _ in commands))) - {None}:
+            wait = self._ADMISSION.admit(msg['from']['id'], lane)
+            if wait:
+                refused[lane] = wait
+        if not refused:
+            return commands
+
+        admitted, rejected = [], []
+        for cmd, args in commands:
+            lane = self._lane(cmd)
+            if lane not in refused:
+                admitted.append((cmd, args))
+                continue
+            rejected.append(cmd)
+            COMMANDS_REJECTED.labels(lane).inc()
+            self._log_cmd(msg, cmd, args, 0.0, 'rejected')
+        self._send_message(msg['chat']['id'], text='Too many commands, ignored {}. Try again in {}s'.format(
+            ' '.join(rejected), math.ceil(max(refused.values())),
+        ))
+        return admitted
+
+    def _run_commands(self, msg, chat_id, commands):
+        # Several commands in one message -> one IR frame per unit and one combined reply,
+        # "/unit bedroom /set 22 /mode_cool" selects the unit before the frame is staged
+        segments = [[]]
+        for cmd, args in commands:
+            if cmd == '/unit' or segments[-1] and segments[-1][-1][0] == '/unit':
+                segments.append([])
+            segments[-1].append((cmd, args))
+
+        started = time.perf_counter()
+        with self._buffer_replies(chat_id) if len(commands) > 1 else nullcontext():
+            for segment in filter(None, segments):
+                with self._ac_transaction(chat_id) if len(segment) > 1 else nullcontext():
+                    for cmd, args in segment:
+                        self._run_cmd(msg, chat_id, cmd, args)
+        MESSAGE_SECONDS.observe(time.perf_counter() - started)
+
+    def _replay_backlog(self, updates):
+        # Messages that waited too long (network outage, restart) are not dropped: per chat the
+        # AC settings are applied as one frame with one summary reply, power goes last and
+        # still asks for confirmation, everything else is only reported
+        backlog = {}
+        for update in updates:
+            msg = update.get('message')
+            if msg and 'text' in msg and msg['chat']['type'] == 'private' and msg['from']['id'] in self._ALLOWED_IDS:
+                backlog.setdefault(msg['chat']['id'], []).append(msg)
+        for chat_id, msgs in backlog.items():
+            try:
+                self._apply_backlog(chat_id, msgs)
+            except Exception as error:
+                print('Backlog of chat_id={} failed: {!r}'.format(chat_id, error), file=sys.stderr, flush=True)
+
+    def _apply_backlog(self, chat_id, msgs):
+        settings, skipped, power = [], [], None
+        for msg in msgs:
+            for cmd, args in self._parse_commands(msg):
+                if cmd in ('/on', '/off'):
+                    power = (cmd, args)  # only the latest power state is meant
+                elif cmd in self._BACKLOG_COMMANDS:
+                    settings.append((cmd, args))
+                else:
+                    skipped.append(cmd)
+
+        self._cleanup_ilkb(chat_id)
+        with self._use_unit(self._chat_unit(chat_id)):
+            with self._buffer_replies(chat_id):
+                self._send_message(chat_id, text='{} message(s) arrived late{}'.format(
+                    len(msgs), ', applying them now' if settings or power else '',
+                ))
+                if skipped:
+                    self._send_message(chat_id, text='Not repeated: ' + ' '.join(skipped))
+                # the whole backlog of the chat counts as one message for admission control
+                admitted = self._admit(msgs[-1], settings + [power] if power else settings)
+                power = power if power in admitted else None
+                settings = [command for command in admitted if command != power]
+                if settings:
+                    self._run_commands(msgs[-1], chat_id, settings)
+            if power:
+                self._run_cmd(msgs[-1], chat_id, *power)
+            self._save_remote_state()
 
     def _cleanup_ilkb(self, chat_id):  # clean cached stuff related to inline keyboards
+        self._CONFIRM_CMDS.pop(chat_id)  # the user moved on without answering
+        msg_identifier = self._SENT_MSG_ID.pop(chat_id)
+        if msg_identifier:  # queued, the handler doesn't wait for Telegram
+            self._SENDER.call(chat_id, 'deleteMessage', msg_identifier, ignore=_MESSAGE_GONE)
+
+    def _sweep_caches(self):
+        # Runs on the scheduler thread: expired prompts are deleted with one queued request per chat
         try:
-            self._BOT.deleteMessage(self._SENT_MSG_ID[chat_id])
-            del self._SENT_MSG_ID[chat_id]
-        except KeyError:
-            return
+            self._CONFIRM_CMDS.sweep()
+            prompts = {}
+            for _, (prompt_chat_id, message_id) in self._SENT_MSG_ID.sweep():
+                prompts.setdefault(prompt_chat_id, []).append(message_id)
+            for prompt_chat_id, message_ids in prompts.items():
+                for first in range(0, len(message_ids), 100):
+                    self._SENDER.call(prompt_chat_id, 'deleteMessages', prompt_chat_id,
+                                      message_ids[first:first + 100], ignore=_MESSAGE_GONE)
+        finally:
+            self._SCHEDULER.call_later(self._CACHE_SWEEP, self._sweep_caches)
+
+    def _in_background(self, callback: callable) -> callable:
+        # Scheduler job that only hands `callback` to the I/O thread
+        def run():
+            try:
+                callback()
+            except Exception as error:
+                print('Background job {} failed: {!r}'.format(callback.__name__, error), file=sys.stderr, flush=True)
+
+        def submit():
+            with suppress(RuntimeError):  # shutting down
+                self._IO.submit(run)
+        return submit
+
+    def _sample_telemetry(self):
+        try:
+            self._EVENTS.publish(SensorSample('system', self._TELEMETRY.sample()))
+        except (OSError, ValueError) as error:
+            print('Telemetry sample failed: {!r}'.format(error), file=sys.stderr, flush=True)
+        finally:
+            self._SCHEDULER.call_later(self._TELEMETRY_INTERVAL, self._in_background(self._sample_telemetry))
+
+    def _sample_sensors(self):
+        try:
+            self._read_sensors()
+        except (OSError, ValueError, IndexError) as error:
+            print('Sensor sample failed: {!r}'.format(error), file=sys.stderr, flush=True)
+        finally:
+            self._SCHEDULER.call_later(self._SENSOR_INTERVAL, self._in_background(self._sample_sensors))
 
     def _on_chat_message(self, msg):
-        if msg['date'] < int(time.time()) - 30:
+        if msg['date'] < int(time.time()) - self._STALE_AGE:
             return
 
-        content_type, chat_type, chat_id = telepot.glance(msg)
+        chat_id = msg['chat']['id']
         self._cleanup_ilkb(chat_id)
 
-        if content_type != 'text' or chat_type != 'private':
+        if 'text' not in msg or msg['chat']['type'] != 'private':
             return
 
         if self._DEBUG:
-            pprint.pprint(msg)
+            print(json.dumps(msg, indent=1), flush=True)
         text = msg['text']
         if msg['from']['id'] not in self._ALLOWED_IDS:
-            self._BOT.sendMessage(
+            self._send_message(
                 chat_id,
                 text='These aren\'t the bots you are looking for. Move along.'
             )
             for admin_id in self._ADMIN_IDS:
-                self._BOT.sendMessage(admin_id, text=str(msg))  # Send info about the trespasser
+                self._send_message(admin_id, text=str(msg))  # Send info about the trespasser
             return
 
         if text.lower() in self._RESPONSES:
-            self._BOT.sendMessage(chat_id, text=self._RESPONSES[text.lower()])
+            self._send_message(chat_id, text=self._RESPONSES[text.lower()])
 
-        self._process_entities(msg)
-        self._save_remote_state()
+        profiler = self._PROFILER
+        with profiler.message() if profiler else nullcontext(), self._use_unit(self._chat_unit(chat_id)):
+            self._process_entities(msg)
+            self._save_remote_state()
 
     def _on_callback_query(self, msg):
-        if msg['message']['date'] < int(time.time()) - 30:
-            return
-
-        query_id, from_id, callback_data = telepot.glance(msg, flavor='callback_query')
+        # Not dropped by age: the date is when the keyboard was sent, panels live for long.
+        # Expired prompts are caught by the TTL of _CONFIRM_CMDS
+        query_id, callback_data = msg['id'], msg['data']
         chat_id = msg['message']['chat']['id']  # TODO: chage to ['from']['id']
 
         ilkb_cmd, ilkb_args = callback_data.split(':')  # ':' is the border between cmd and args
         ilkb_args = ilkb_args.split(',')                # ',' is a delimiter for args
-        self._log_cmd(msg['message'], ilkb_cmd, ilkb_args)
-        self._ILKB_COMMANDS[ilkb_cmd](chat_id, *ilkb_args)
+        if not self._callback_allowed(msg['from']['id'], chat_id, ilkb_cmd):
+            with suppress(OSError, TelegramError):
+                self._SESSION.answerCallbackQuery(query_id, text='You are not allowed to do this', show_alert=True)
+            self._log_cmd(msg, ilkb_cmd, ilkb_args, 0.0, 'forbidden')
+            return
+        if ilkb_cmd == 'panel' and not self._DEBUG:  # stops the button's spinner, the edit follows
+            with suppress(OSError, TelegramError):
+                self._SESSION.answerCallbackQuery(query_id)
+        started = time.monotonic()
+        log_cmd, log_args, outcome = ilkb_cmd, ilkb_args, 'ok'
+        try:
+            with self._use_unit(self._chat_unit(chat_id)):
+                log_cmd, log_args, outcome = self._resolve_callback(chat_id, ilkb_cmd, ilkb_args)
+                self._ILKB_COMMANDS[ilkb_cmd](chat_id, *ilkb_args)
+        except Exception as error:
+            outcome = 'error: {!r}'.format(error)
+            raise
+        finally:
+            self._log_cmd(msg, log_cmd, log_args, time.monotonic() - started, outcome)
 
         if self._DEBUG:
-            pprint.pprint(msg)
-            self._BOT.answerCallbackQuery(query_id, text='Passed query: ' + callback_data)
+            print(json.dumps(msg, indent=1), flush=True)
+            self._SESSION.answerCallbackQuery(query_id, text='Passed query: ' + callback_data)
 
         self._cleanup_ilkb(chat_id)
         self._save_remote_state()
 
+    def _callback_allowed(self, user_id, chat_id, ilkb_cmd) -> bool:
+        # Checked on every press, a user removed by a config reload loses their panels and prompts too
+        if user_id not in self._ALLOWED_IDS:
+            return False
+        if ilkb_cmd == 'confirm':  # the prompted command runs without its admin check
+            pending = self._CONFIRM_CMDS.get(chat_id) or {}
+            cmd = pending.get('command', (None,))[0]
+            return user_id in self._ADMIN_IDS or not getattr(self._COMMANDS.get(cmd), 'admin', False)
+        return True
+
+    def _resolve_callback(self, chat_id, ilkb_cmd, ilkb_args) -> tuple:
+        # -> (command, args, outcome) to log: an answered prompt as the command it was about,
+        # a power press confirmed on a panel as /on or /off
+        if ilkb_cmd == 'confirm':
+            pending = self._CONFIRM_CMDS.get(chat_id)
+            if pending is None:
+                return ilkb_cmd, ilkb_args, 'expired'
+            cmd, args = pending.get('command', (ilkb_cmd, ilkb_args))
+            return cmd, args, 'confirmed' if ilkb_args[0] == '1' else 'declined'
+        if ilkb_cmd == 'panel' and ilkb_args == ['yes']:
+            return '/off' if self._AC_HANDLER.on else '/on', [], 'confirmed'
+        return ilkb_cmd, ilkb_args, 'ok'
+
+    def _is_stale(self, update) -> bool:
+        # Only messages: the date of a callback query is the date of the message with the keyboard
+        msg = update.get('message')
+        return msg is not None and msg['date'] < int(time.time()) - self._STALE_AGE
+
+    def _load_offset(self):
+        if self._OFFSET_STORE:
+            self._UPDATE_OFFSET = self._OFFSET_STORE.load().get('offset')
+
+    def _fetch_updates(self) -> list:
+        updates = self._SESSION.getUpdates(
+            offset=self._UPDATE_OFFSET,
+            timeout=self._POLL_TIMEOUT,
+            allowed_updates=['message', 'callback_query'],
+        )
+        if updates:
+            # On disk before the updates are handled: a crash loses them rather than
+            # repeating toggles like /swing after the restart, so no write-behind here
+            self._UPDATE_OFFSET = updates[-1]['update_id'] + 1
+            if self._OFFSET_STORE:
+                self._OFFSET_STORE.update({'offset': self._UPDATE_OFFSET})
+                self._OFFSET_STORE.flush()
+        return updates
+
+    def _dispatch_updates(self, updates):
+        stale = [update for update in updates if self._is_stale(update)]
+        if stale:
+            self._replay_backlog(stale)
+        for update in updates:
+            route = self._route_update(update)
+            if route is None or self._is_stale(update):
+                continue
+            try:
+                route[1](route[2])
+            except Exception as error:
+                print('update_id={} error={!r}'.format(update.get('update_id'), error), file=sys.stderr, flush=True)
+
+    def _poll_updates(self):
+        backoff = 1
+        while True:
+            try:
+                updates = self._fetch_updates()
+                backoff = 1
+            except (OSError, TelegramError) as error:
+                print('getUpdates failed: {!r}'.format(error), file=sys.stderr, flush=True)
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+                continue
+            self._dispatch_updates(updates)
+
+    def _route_update(self, update) -> tuple:
+        # Raw Bot API update -> (chat_id, handler, msg), None for update types we don't handle
+        if 'message' in update:
+            msg = update['message']
+            return msg['chat']['id'], self._on_chat_message, msg
+        if 'callback_query' in update:
+            msg = update['callback_query']
+            return msg['message']['chat']['id'], self._on_callback_query, msg
+        return None
+
+    def _wait_for_network(self, max_delay: float = 60):
+        # Replaces a fixed boot delay: retry the Bot API with exponential backoff until it answers
+        delay = 1
+        while True:
+            try:
+                self._SESSION.call('getMe')
+                return
+            except TelegramError:
+                return  # an API error still means the network is up
+            except OSError as error:
+                print('Network is not ready: {!r}'.format(error), file=sys.stderr, flush=True)
+                systemd.notify('STATUS=Waiting for network')
+            time.sleep(delay)
+            delay = min(delay * 2, max_delay)
+
+    def _clear_webhook(self):
+        # getUpdates is refused while a webhook is registered
+        try:
+            self._SESSION.call('deleteWebhook')
+        except (OSError, TelegramError) as error:
+            print('deleteWebhook failed: {!r}'.format(error), file=sys.stderr, flush=True)
+
+    def _rotate_token(self, bot_token: str):
+        self._BOT_TOKEN = bot_token
+        self._SESSION.set_token(bot_token)
+
+    def _check_config_file(self):
+        try:
+            mtime = os.stat(self._CONFIG_HANDLER.config_file).st_mtime
+        except OSError:
+            mtime = self._CONFIG_MTIME
+        if mtime != self._CONFIG_MTIME:
+            self._CONFIG_MTIME = mtime
+            self.reload_config()
+        self._SCHEDULER.call_later(self._CONFIG_WATCH, self._in_background(self._check_config_file))
+
+    #################################################
+    # LOCAL API
+    #################################################
+
+    # Called by acremote.api on its request threads, return (HTTP status, JSON body)
+
+    def api_user(self, token: str):
+        # Bearer token -> user ID, None unless the user is still allowed to use the bot
+        for api_token, user_id in self._API_TOKENS.items():
+            if hmac.compare_digest(token.encode('utf-8'), api_token.encode('utf-8')):
+                return user_id if user_id in self._ALLOWED_IDS else None
+        return None
+
+    def _api_unit_state(self, unit: ACUnit) -> dict:
+        with self._use_unit(unit):
+            delay, reason = self._power_cooldown()
+            return dict(unit.handler.state, unit=unit.name, cooldown=delay, cooldown_reason=reason)
+
+    def api_state(self, user_id, unit_name: str = None) -> tuple:
+        if unit_name is None:
+            return 200, {'units': [self._api_unit_state(unit) for unit in self._UNITS.values()]}
+        unit = self._UNITS.get(unit_name)
+        if unit is None:
+            return 404, {'error': 'Unknown unit {!r}'.format(unit_name)}
+        return 200, self._api_unit_state(unit)
+
+    def _api_buttons(self, changes: dict) -> list:
+        # Partial state -> button presses staged into one frame, ValueError when it is invalid
+        handler = self._AC_HANDLER
+        unknown = set(changes) - {'on', 'mode', 'temp', 'speed'} - set(self._API_TOGGLES)
+        if unknown:
+            raise ValueError('Unknown fields: {}'.format(', '.join(sorted(unknown))))
+        for field in self._API_TOGGLES + ('on',):
+            if field in changes and not isinstance(changes[field], bool):
+                raise ValueError('{} must be true or false'.format(field))
+        on = changes.get('on', handler.on)  # only btn_on/btn_off switch the unit, both go through the cooldown
+        buttons = []
+        if on and not handler.on:
+            buttons.append(('btn_on',))
+        if 'temp' in changes:
+            temp = changes['temp']
+            if not isinstance(temp, int) or isinstance(temp, bool) or not handler.min_temp <= temp <= handler.max_temp:
+                raise ValueError('temp must be within {} and {}'.format(handler.min_temp, handler.max_temp))
+            if temp != handler.temp:
+                # still off (refused, deferred or not asked for): the setpoint is kept for later
+                buttons.append(('btn_tmp_set', temp, False))
+        if 'mode' in changes:
+            mode = str(changes['mode']).upper()
+            if mode not in handler.modes:
+                raise ValueError('mode must be one of {}'.format(', '.join(handler.modes)))
+            if mode != handler.mode:
+                buttons.append(('btn_mode', mode))
+        if 'speed' in changes:
+            speed = str(changes['speed']).upper()
+            if speed not in handler.speeds:
+                raise ValueError('speed must be one of {}'.format(', '.join(handler.speeds)))
+            if speed != handler.speed:
+                buttons.append(('btn_speed', speed))
+        for field in self._API_TOGGLES:
+            if field in changes and changes[field] != getattr(handler, field):
+                buttons.append(('btn_' + field,))
+        if not on and handler.on:
+            buttons.append(('btn_off',))  # last, the other settings still reach the unit
+        return buttons
+
+    def api_patch(self, user_id, unit_name: str, changes: dict) -> tuple:
+        # Same rules as chat commands: admission control, power cooldown, one IR frame,
+        # audit log and state file. Replies the bot would send are returned as messages
+        if user_id not in self._ALLOWED_IDS:
+            return 403, {'error': 'Forbidden'}
+        unit = self._UNITS.get(unit_name or self._DEFAULT_UNIT)
+        if unit is None:
+            return 404, {'error': 'Unknown unit {!r}'.format(unit_name)}
+        lane = 'priority' if 'on' in changes else 'tweak'
+        wait = self._ADMISSION.admit(user_id, lane)
+        if wait:
+            COMMANDS_REJECTED.labels(lane).inc()
+            return 429, {'error': 'Too many requests, try again in {}s'.format(math.ceil(wait))}
+
+        msg = {'from': {'id': user_id, 'username': 'api'}}
+        started = time.monotonic()
+        outcome = 'ok'
+        status, body = 200, {}
+        try:
+            with self._use_unit(unit), unit.lock:
+                buttons = self._api_buttons(changes)
+                delay, reason = self._power_cooldown()
+                if delay and not self._AC_DEFER_POWER and any(button[0] in self._POWER_BUTTONS for button in buttons):
+                    outcome = 'refused'
+                    return 409, {'error': '{}, please wait {}s'.format(reason, delay)}
+                with self._capture_replies(user_id) as replies:
+                    with self._ac_transaction(user_id):
+                        for button in buttons:
+                            self._ac_cmd(user_id, *button)
+                if self._AC_PENDING and self._AC_PENDING['chat_id'] == user_id:
+                    status = 202  # the power change runs when the cooldown ends
+                body = dict(self._api_unit_state(unit), messages=[reply[0] for reply in replies])
+        except ValueError as error:
+            outcome = 'invalid'
+            return 400, {'error': str(error)}
+        except Exception as error:
+            outcome = 'error: {!r}'.format(error)
+            raise
+        finally:
+            with self._use_unit(unit):
+                self._log_cmd(msg, '/api', ['{}={}'.format(key, value) for key, value in sorted(changes.items())],
+                              time.monotonic() - started, outcome)
+        self._save_remote_state()
+        return status, body
+
     #################################################
     # USER METHODS
     #################################################
 
+    def watch_config(self, config_handler: _ConfigHandler, config: dict, interval: float = 0):
+        # Reload on SIGHUP and, with an interval, whenever the config file changes.
+        # Reloads run on the single background I/O thread so they never race each other
+        self._CONFIG_HANDLER = config_handler
+        self._CONFIG = config
+        self._CONFIG_WATCH = interval
+        signal.signal(signal.SIGHUP,
+                      lambda signum, frame: self._SCHEDULER.call_later(0, self._in_background(self.reload_config)))
+        if interval:
+            with suppress(OSError):
+                self._CONFIG_MTIME = os.stat(config_handler.config_file).st_mtime
+            self._SCHEDULER.call_later(interval, self._in_background(self._check_config_file))
+
+    def reload_config(self) -> bool:
+        systemd.notify('RELOADING=1')
+        try:
+            config = self._CONFIG_HANDLER.read_config()
+            _ConfigHandler.validate(config)
+        except (OSError, ValueError) as error:
+            print('Config reload failed, keeping the running config: {}'.format(error),
+                  file=sys.stderr, flush=True)
+            return False
+        else:
+            self.apply_config(config)
+            return True
+        finally:
+            systemd.notify('READY=1')
+
+    def apply_config(self, config: dict):
+        # Everything is built first and swapped in with plain assignments, so handlers
+        # running concurrently see either the old or the new set, never a mix
+        admin_ids = frozenset(config['admin_ids'])
+        allowed_ids = admin_ids | frozenset(config['user_ids'])
+        responses = dict(config['easter_eggs'])
+        self._ALLOWED_IDS = allowed_ids
+        self._ADMIN_IDS = admin_ids
+        self._RESPONSES = responses
+        if config['bot_token'] != self._BOT_TOKEN:
+            self._rotate_token(config['bot_token'])
+        if self._CONFIG is not None:
+            changed = [key for key in _RESTART_KEYS if config.get(key) != self._CONFIG.get(key)]
+            if changed:
+                print('Config reloaded, restart to apply: {}'.format(', '.join(changed)),
+                      file=sys.stderr, flush=True)
+        print('Config reloaded: {} admins, {} users'.format(len(admin_ids), len(allowed_ids - admin_ids)),
+              flush=True)
+
+    def shutdown(self):
+        systemd.notify('STOPPING=1')
+        self._SCHEDULER.stop(timeout=5)
+        self._IO.shutdown(wait=False)
+        for unit in self._UNITS.values():
+            unit.stop(timeout=5)
+        self._SENDER.stop(timeout=5)
+        self._SESSION.close()
+        if self._OFFSET_STORE:
+            self._OFFSET_STORE.flush()
+        if self._AUDIT:
+            self._AUDIT.close(timeout=5)
+        with suppress(AttributeError):  # already stopped
+            self._CMD_LOG_LISTENER.stop()  # after the last commands are logged
+        if self._METRICS:
+            self._METRICS.close()
+        if self._API:
+            self._API.close()
+        if self._MQTT:
+            self._MQTT.close()
+        if self._SNAPSHOT:
+            self._SNAPSHOT.close()
+        if self._PROFILER:
+            self._PROFILER.stop()
+
     def start(self):
-        router = {
-            'chat': self._on_chat_message,
-            'callback_query': self._on_callback_query,
-        }
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        self._wait_for_network()
+        self._clear_webhook()
+        self._load_offset()
         try:
-            MessageLoop(self._BOT, router).run_as_thread()
-            while True:
-                time.sleep(10)
+            systemd.notify('READY=1')
+            self._poll_updates()
 
         except KeyboardInterrupt:
             sys.exit(0)
+        finally:
+            self.shutdown()
 
 
 if __name__ == '__main__':
@@ -747,13 +2052,40 @@ if __name__ == '__main__':
 
     config_handler = _ConfigHandler()
     config = config_handler.read_config()
+    try:
+        _ConfigHandler.validate(config)
+    except ValueError as error:
+        print('Invalid config {}: {}'.format(config_handler.config_file, error), file=sys.stderr)
+        sys.exit(1)
 
-    server = ACRemote(
+    mode = config.get('mode', 'polling')
+    mode_kwargs = {}
+    if mode == 'asyncio':
+        from acremote.aio import AsyncACRemote as server_class
+    elif mode == 'webhook':
+        from acremote.webhook import WebhookACRemote as server_class
+        mode_kwargs = config['webhook']
+    else:
+        server_class = ACRemote
+
+    server = server_class(
         bot_token=config['bot_token'],
-        gpio_pin=config['gpio_pin'],
-        state_file=config['state_file'],
+        gpio_pin=config.get('gpio_pin'),
+        state_file=config.get('state_file'),
         admin_ids=config['admin_ids'],
         user_ids=config['user_ids'],
-        easter_eggs=config['easter_eggs']
+        easter_eggs=config['easter_eggs'],
+        audit_db=config.get('audit_db'),
+        audit_retention_days=config.get('audit_retention_days', 30),
+        metrics_port=config.get('metrics_port'),
+        schedule_file=config.get('schedule_file'),
+        defer_power=config.get('defer_power', False),
+        units=config.get('units'),
+        offset_file=config.get('offset_file'),
+        api=config.get('api'),
+        mqtt=config.get('mqtt'),
+        snapshot_file=config.get('snapshot_file'),
+        **mode_kwargs
     )
+    server.watch_config(config_handler, config, interval=config.get('config_watch_interval', 0))
     server.start()
@@ -0,0 +1,169 @@
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Seconds, from a single IR frame to a slow Bot API round trip
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Counter():
+    def __init__(self):
+        self._VALUE = 0
+        self._LOCK = threading.Lock()
+
+    @property
+    def value(self):
+        return self._VALUE
+
+    def inc(self, amount: int = 1):
+        with self._LOCK:
+            self._VALUE += amount
+
+
+class Histogram():
+    # Bucket slots are allocated once; observe() bumps one slot and the sum,
+    # cumulative counts are only computed when rendering
+
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self._BOUNDS = tuple(sorted(buckets))
+        self._COUNTS = [0] * (len(self._BOUNDS) + 1)  # the last slot is +Inf
+        self._SUM = 0.0
+        self._LOCK = threading.Lock()
+
+    @property
+    def bounds(self) -> tuple:
+        return self._BOUNDS
+
+    def observe(self, value: float):
+        index = bisect_left(self._BOUNDS, value)  # first bucket with value <= le
+        with self._LOCK:
+            self._COUNTS[index] += 1
+            self._SUM += value
+
+    def snapshot(self) -> tuple:
+        with self._LOCK:
+            return list(self._COUNTS), self._SUM
+
+
+class _Family():
+    # One metric name, children told apart by the value of a single label
+
+    def __init__(self, kind: str, name: str, documentation: str, factory: callable, label: str = None):
+        self.kind = kind
+        self.name = name
+        self.documentation = documentation
+        self.label = label
+        self._FACTORY = factory
+        self._CHILDREN = {} if label else {None: factory()}
+        self._LOCK = threading.Lock()
+
+    def labels(self, value: str):
+        child = self._CHILDREN.get(value)
+        if child is None:
+            with self._LOCK:
+                child = self._CHILDREN.setdefault(value, self._FACTORY())
+        return child
+
+    def children(self) -> list:
+        with self._LOCK:
+            return sorted(self._CHILDREN.items(), key=lambda item: item[0] or '')
+
+
+def _labels(pairs: list) -> str:
+    pairs = [
+        '{}="{}"'.format(name, str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+        for name, value in pairs if name
+    ]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry():
+
+    def __init__(self):
+        self._FAMILIES = {}
+        self._LOCK = threading.Lock()
+
+    def _family(self, kind: str, name: str, documentation: str, factory: callable, label: str):
+        with self._LOCK:
+            family = self._FAMILIES.get(name)
+            if family is None:
+                family = self._FAMILIES[name] = _Family(kind, name, documentation, factory, label)
+        return family if label else family.labels(None)
+
+    def counter(self, name: str, documentation: str, label: str = None):
+        # Returns the Counter itself, or its family when `label` is given
+        return self._family('counter', name, documentation, Counter, label)
+
+    def histogram(self, name: str, documentation: str, label: str = None, buckets: tuple = LATENCY_BUCKETS):
+        return self._family('histogram', name, documentation, lambda: Histogram(buckets), label)
+
+    def get(self, name: str, label_value: str = None):
+        return self._FAMILIES[name].labels(label_value)
+
+    def render(self) -> str:
+        # Prometheus text exposition format 0.0.4
+        with self._LOCK:
+            families = sorted(self._FAMILIES.values(), key=lambda family: family.name)
+        lines = []
+        for family in families:
+            lines.append('# HELP {} {}'.format(family.name, family.documentation))
+            lines.append('# TYPE {} {}'.format(family.name, family.kind))
+            for label_value, metric in family.children():
+                label = (family.label, label_value)
+                if family.kind == 'counter':
+                    lines.append('{}{} {}'.format(family.name, _labels([label]), metric.value))
+                    continue
+                counts, total = metric.snapshot()
+                cumulative = 0
+                for bound, count in zip(metric.bounds + ('+Inf',), counts):
+                    cumulative += count
+                    lines.append('{}_bucket{} {}'.format(family.name, _labels([label, ('le', _number(bound))]), cumulative))
+                lines.append('{}_sum{} {}'.format(family.name, _labels([label]), _number(total)))
+                lines.append('{}_count{} {}'.format(family.name, _labels([label]), cumulative))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+counter = REGISTRY.counter
+histogram = REGISTRY.histogram
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            body, code = b'', 404
+        else:
+            body, code = self.server.registry.render().encode('utf-8'), 200
+        self.send_response(code)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MetricsServer(ThreadingHTTPServer):
+    # Serves GET /metrics for a Prometheus scraper, meant to listen on localhost only
+    daemon_threads = True
+
+    def __init__(self, address: tuple, registry: Registry = REGISTRY):
+        super().__init__(address, _MetricsHandler)
+        self.registry = registry
+        self._THREAD = threading.Thread(target=self.serve_forever, name='acremote-metrics', daemon=True)
+
+    def start(self):
+        self._THREAD.start()
+
+    def close(self):
+        if self._THREAD.is_alive():
+            self.shutdown()
+        self.server_close()
@@ -0,0 +1,337 @@
+import json
+import select
+import socket
+import struct
+import sys
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from acremote.events import IRSent, SensorSample, StateChanged
+
+# MQTT 3.1.1 control packet types (upper nibble of the first byte)
+CONNECT, CONNACK, PUBLISH, SUBSCRIBE, SUBACK = 0x10, 0x20, 0x30, 0x80, 0x90
+PINGREQ, PINGRESP, DISCONNECT = 0xC0, 0xD0, 0xE0
+
+# Home Assistant climate values <-> remote state
+HA_MODES = {'AUTO': 'auto', 'COOL': 'cool', 'DRY': 'dry', 'HEAT': 'heat', 'FAN': 'fan_only'}
+HA_FAN_MODES = {'AUTO': 'auto', 'LOW': 'low', 'MID': 'medium', 'HIGH': 'high'}
+
+
+def encode_string(value) -> bytes:
+    data = value.encode('utf-8') if isinstance(value, str) else bytes(value)
+    return struct.pack('>H', len(data)) + data
+
+
+def encode_packet(first_byte: int, body: bytes) -> bytes:
+    header = bytearray([first_byte])
+    length = len(body)
+    while True:  # remaining length, 7 bits per byte
+        byte, length = length & 0x7F, length >> 7
+        header.append(byte | 0x80 if length else byte)
+        if not length:
+            return bytes(header) + body
+
+
+def encode_publish(topic: str, payload, retain: bool = False) -> bytes:
+    payload = payload.encode('utf-8') if isinstance(payload, str) else payload
+    return encode_packet(PUBLISH | retain, encode_string(topic) + payload)
+
+
+def decode_publish(first_byte: int, body: bytes) -> tuple:
+    # -> (topic, payload), QoS 1/2 packet ids are skipped
+    length = struct.unpack_from('>H', body)[0]
+    topic = body[2:2 + length].decode('utf-8')
+    start = 2 + length + (2 if first_byte & 0x06 else 0)
+    return topic, body[start:]
+
+
+def read_packet(sock) -> tuple:
+    # -> (first byte, body), ConnectionError when the peer is gone
+    def read(count):
+        data = b''
+        while len(data) < count:
+            chunk = sock.recv(count - len(data))
+            if not chunk:
+                raise ConnectionError('MQTT connection closed')
+            data += chunk
+        return data
+
+    first_byte = read(1)[0]
+    length = shift = 0
+    while True:
+        byte = read(1)[0]
+        length |= (byte & 0x7F) << shift
+        shift += 7
+        if byte < 0x80:
+            break
+    return first_byte, read(length) if length else b''
+
+
+class MQTTClient():
+    # Minimal MQTT 3.1.1 client: QoS 0 publish/subscribe, retained messages, a last will,
+    # keep-alive pings and reconnects, all on one thread. Messages published while the
+    # broker is unreachable are dropped, on_connect is where retained state gets resent
+
+    def __init__(self, host: str, port: int = 1883, client_id: str = 'acremote', username: str = None,
+                 password: str = None, keepalive: int = 60, will: tuple = None,
+                 on_connect: callable = None, on_message: callable = None):
+        self._ADDRESS = (host, port)
+        self._CLIENT_ID = client_id
+        self._USERNAME = username
+        self._PASSWORD = password
+        self._KEEPALIVE = keepalive
+        self._WILL = will  # (topic, payload, retain)
+        self._ON_CONNECT = on_connect
+        self._ON_MESSAGE = on_message
+        self._SUBSCRIPTIONS = []
+        self._OUTBOX = deque(maxlen=256)
+        self._WAKE_R, self._WAKE_W = socket.socketpair()
+        self._CONNECTED = threading.Event()
+        self._RUNNING = True
+        self._THREAD = threading.Thread(target=self._run, name='acremote-mqtt', daemon=True)
+
+    @property
+    def connected(self) -> bool:
+        return self._CONNECTED.is_set()
+
+    def start(self):
+        self._THREAD.start()
+
+    def wait_connected(self, timeout: float = None) -> bool:
+        return self._CONNECTED.wait(timeout)
+
+    def subscribe(self, topic: str):
+        # Kept and renewed on every (re)connect
+        self._SUBSCRIPTIONS.append(topic)
+
+    def publish(self, topic: str, payload, retain: bool = False):
+        if self._CONNECTED.is_set():
+            self._OUTBOX.append(encode_publish(topic, payload, retain))
+            self._WAKE_W.send(b'\0')
+
+    def stop(self, timeout: float = None):
+        self._RUNNING = False
+        self._WAKE_W.send(b'\0')
+        self._THREAD.join(timeout)
+        self._WAKE_R.close()
+        self._WAKE_W.close()
+
+    def _connect_packet(self) -> bytes:
+        flags = 0x02  # clean session
+        payload = encode_string(self._CLIENT_ID)
+        if self._WILL:
+            topic, message, retain = self._WILL
+            flags |= 0x04 | (0x20 if retain else 0)
+            payload += encode_string(topic) + encode_string(message)
+        if self._USERNAME is not None:
+            flags |= 0x80
+            payload += encode_string(self._USERNAME)
+            if self._PASSWORD is not None:
+                flags |= 0x40
+                payload += encode_string(self._PASSWORD)
+        return encode_packet(CONNECT, encode_string('MQTT') + struct.pack('>BBH', 4, flags, self._KEEPALIVE) + payload)
+
+    def _session(self, sock):
+        sock.sendall(self._connect_packet())
+        first_byte, body = read_packet(sock)
+        if first_byte != CONNACK or len(body) != 2 or body[1]:
+            raise ConnectionError('MQTT connection refused: {!r}'.format(body))
+        for packet_id, topic in enumerate(self._SUBSCRIPTIONS, 1):
+            sock.sendall(encode_packet(SUBSCRIBE | 0x02, struct.pack('>H', packet_id) + encode_string(topic) + b'\0'))
+        self._OUTBOX.clear()
+        self._CONNECTED.set()
+        if self._ON_CONNECT:
+            self._ON_CONNECT()
+
+        idle = self._KEEPALIVE / 2
+        while self._RUNNING:
+            readable, _, _ = select.select([sock, self._WAKE_R], [], [], idle)
+            if self._WAKE_R in readable:
+                self._WAKE_R.recv(4096)
+            while self._OUTBOX:
+                sock.sendall(self._OUTBOX.popleft())
+            if sock in readable:
+                first_byte, body = read_packet(sock)
+                if first_byte & 0xF0 == PUBLISH and self._ON_MESSAGE:
+                    self._ON_MESSAGE(*decode_publish(first_byte, body))
+            elif not readable:
+                sock.sendall(encode_packet(PINGREQ, b''))
+        sock.sendall(encode_packet(DISCONNECT, b''))
+
+    def _run(self):
+        backoff = 1
+        while self._RUNNING:
+            try:
+                with socket.create_connection(self._ADDRESS, timeout=self._KEEPALIVE) as sock:
+                    backoff = 1
+                    self._session(sock)
+            except (OSError, ValueError) as error:
+                print('MQTT {}:{} failed: {!r}'.format(*self._ADDRESS, error), file=sys.stderr, flush=True)
+            finally:
+                self._CONNECTED.clear()
+            if self._RUNNING:
+                self._WAKE_R.settimeout(backoff)
+                try:
+                    self._WAKE_R.recv(4096)  # stop() interrupts the wait
+                except socket.timeout:
+                    pass
+                self._WAKE_R.settimeout(None)
+                backoff = min(backoff * 2, 60)
+
+
+class MQTTBridge():
+    # Publishes the remote state of every unit as retained topics in the Home Assistant
+    # MQTT climate format and turns its command topics into API calls of `user_id`,
+    # so they follow the same rules as chat commands:
+    #   PREFIX/UNIT/state             full state as JSON
+    #   PREFIX/UNIT/mode/state        off|auto|cool|dry|heat|fan_only   <- PREFIX/UNIT/mode/set
+    #   PREFIX/UNIT/temperature/state min..max temperature of the unit  <- PREFIX/UNIT/temperature/set
+    #   PREFIX/UNIT/fan_mode/state    auto|low|medium|high              <- PREFIX/UNIT/fan_mode/set
+    #   PREFIX/UNIT/swing_mode/state  on|off                            <- PREFIX/UNIT/swing_mode/set
+    #   PREFIX/UNIT/power/state       ON|OFF                            <- PREFIX/UNIT/power/set
+    #   PREFIX/current_temperature    room temperature of the first 1-Wire sensor
+    #   PREFIX/availability           online|offline (last will)
+
+    def __init__(self, remote, events, host: str, user_id: int, port: int = 1883, username: str = None,
+                 password: str = None, prefix: str = 'acremote', discovery_prefix: str = 'homeassistant'):
+        self._REMOTE = remote
+        self._EVENTS = events
+        self._USER_ID = user_id
+        self._PREFIX = prefix.rstrip('/')
+        self._DISCOVERY_PREFIX = discovery_prefix
+        self._STATES = {}        # {unit: state} last known, resent on reconnect
+        self._TEMP_RANGES = {}   # {unit: (min temp, max temp)} for discovery
+        self._ROOM_TEMP = None
+        self._LOCK = threading.Lock()
+        # Commands run here in arrival order, the IR transmission never holds up the client thread
+        self._COMMANDS = ThreadPoolExecutor(max_workers=1, thread_name_prefix='acremote-mqtt-cmd')
+        self._CLIENT = MQTTClient(
+            host, port, client_id='acremote-' + self._PREFIX.replace('/', '-'), username=username,
+            password=password, will=(self._PREFIX + '/availability', 'offline', True),
+            on_connect=self._on_connect, on_message=self._on_message,
+        )
+        self._CLIENT.subscribe(self._PREFIX + '/+/+/set')
+
+    @property
+    def client(self) -> MQTTClient:
+        return self._CLIENT
+
+    def start(self, states: dict, temp_ranges: dict):
+        self._STATES = dict(states)
+        self._TEMP_RANGES = dict(temp_ranges)
+        self._EVENTS.subscribe(StateChanged, self._on_state)
+        self._EVENTS.subscribe(SensorSample, self._on_sample)
+        self._EVENTS.subscribe(IRSent, self._on_ir_sent)
+        self._CLIENT.start()
+
+    def close(self):
+        self._EVENTS.unsubscribe(StateChanged, self._on_state)
+        self._EVENTS.unsubscribe(SensorSample, self._on_sample)
+        self._EVENTS.unsubscribe(IRSent, self._on_ir_sent)
+        self._CLIENT.publish(self._PREFIX + '/availability', 'offline', retain=True)
+        self._CLIENT.stop(timeout=5)
+        self._COMMANDS.shutdown(wait=False)
+
+    def _publish_state(self, unit: str, state: dict):
+        topic = '{}/{}/'.format(self._PREFIX, unit)
+        self._CLIENT.publish(topic + 'state', json.dumps(state, sort_keys=True), retain=True)
+        self._CLIENT.publish(topic + 'mode/state', HA_MODES[state['mode']] if state['on'] else 'off', retain=True)
+        self._CLIENT.publish(topic + 'temperature/state', str(state['temp']), retain=True)
+        self._CLIENT.publish(topic + 'fan_mode/state', HA_FAN_MODES[state['speed']], retain=True)
+        self._CLIENT.publish(topic + 'swing_mode/state', 'on' if state['swing'] else 'off', retain=True)
+        self._CLIENT.publish(topic + 'power/state', 'ON' if state['on'] else 'OFF', retain=True)
+
+    def _publish_discovery(self, unit: str):
+        topic = '{}/{}/'.format(self._PREFIX, unit)
+        min_temp, max_temp = self._TEMP_RANGES[unit]
+        config = {
+            'name': unit,
+            'unique_id': '{}_{}'.format(self._PREFIX.replace('/', '_'), unit),
+            'availability_topic': self._PREFIX + '/availability',
+            'current_temperature_topic': self._PREFIX + '/current_temperature',
+            'modes': ['off'] + list(HA_MODES.values()),
+            'fan_modes': list(HA_FAN_MODES.values()),
+            'swing_modes': ['on', 'off'],
+            'min_temp': min_temp,
+            'max_temp': max_temp,
+            'temp_step': 1,
+            'precision': 1.0,
+        }
+        for name in ('mode', 'temperature', 'fan_mode', 'swing_mode'):
+            config[name + '_state_topic'] = topic + name + '/state'
+            config[name + '_command_topic'] = topic + name + '/set'
+        config['power_command_topic'] = topic + 'power/set'
+        self._CLIENT.publish('{}/climate/{}/config'.format(self._DISCOVERY_PREFIX, config['unique_id']),
+                             json.dumps(config, sort_keys=True), retain=True)
+
+    def _on_connect(self):
+        # Runs on the client thread after every (re)connect
+        self._CLIENT.publish(self._PREFIX + '/availability', 'online', retain=True)
+        with self._LOCK:
+            states, room_temp = dict(self._STATES), self._ROOM_TEMP
+        for unit, state in states.items():
+            if self._DISCOVERY_PREFIX:
+                self._publish_discovery(unit)
+            self._publish_state(unit, state)
+        if room_temp is not None:
+            self._CLIENT.publish(self._PREFIX + '/current_temperature', str(room_temp), retain=True)
+
+    def _on_state(self, event: StateChanged):
+        with self._LOCK:
+            self._STATES[event.unit] = event.state
+        self._publish_state(event.unit, event.state)
+
+    def _on_sample(self, event: SensorSample):
+        if event.source != 'w1' or not event.readings:
+            return
+        with self._LOCK:
+            self._ROOM_TEMP = round(list(event.readings.values())[0], 1)
+        self._CLIENT.publish(self._PREFIX + '/current_temperature', str(self._ROOM_TEMP), retain=True)
+
+    def _on_ir_sent(self, event: IRSent):
+        self._CLIENT.publish('{}/{}/ir_sent'.format(self._PREFIX, event.unit),
+                             json.dumps({'seconds': round(event.seconds, 4)}))
+
+    def _changes(self, command: str, payload: str) -> dict:
+        # Home Assistant command -> partial state for ACRemote.api_patch
+        if command == 'mode':
+            if payload == 'off':
+                return {'on': False}
+            modes = {value: key for key, value in HA_MODES.items()}
+            return {'on': True, 'mode': modes[payload]}
+        if command == 'temperature':
+            return {'temp': round(float(payload))}  # an off unit keeps it for later, as in Home Assistant
+        if command == 'fan_mode':
+            return {'speed': {value: key for key, value in HA_FAN_MODES.items()}[payload]}
+        if command == 'swing_mode':
+            return {'swing': payload == 'on'}
+        if command == 'power':
+            return {'on': payload.upper() == 'ON'}
+        raise KeyError(command)
+
+    def _on_message(self, topic: str, payload: bytes):
+        # Runs on the client thread, the command itself is handed to the command thread
+        parts = topic[len(self._PREFIX) + 1:].split('/')
+        if len(parts) != 3 or parts[2] != 'set':
+            return
+        unit, command = parts[:2]
+        try:
+            changes = self._changes(command, payload.decode('utf-8').strip())
+        except (KeyError, ValueError, UnicodeDecodeError):
+            print('MQTT: ignored {} {!r}'.format(topic, payload), file=sys.stderr, flush=True)
+            return
+        try:
+            self._COMMANDS.submit(self._apply, topic, payload, unit, changes)
+        except RuntimeError:
+            pass  # closing
+
+    def _apply(self, topic: str, payload: bytes, unit: str, changes: dict):
+        try:
+            status, body = self._REMOTE.api_patch(self._USER_ID, unit, changes)
+        except Exception as error:
+            print('MQTT: {} {!r} failed: {!r}'.format(topic, payload, error), file=sys.stderr, flush=True)
+            return
+        if status >= 400:
+            print('MQTT: {} {!r} -> {} {}'.format(topic, payload, status, body.get('error')),
+                  file=sys.stderr, flush=True)
@@ -0,0 +1,154 @@
+import math
+import os
+import queue
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+
+
+def percentile(values: list, pct: float) -> float:
+    # Nearest-rank percentile of sorted values
+    return values[max(0, math.ceil(pct / 100 * len(values)) - 1)]
+
+
+class LatencyWindow():
+    # Per-command latencies of the last `window` seconds (at most `max_samples` per command)
+
+    def __init__(self, window: float = 3600, max_samples: int = 1024):
+        self._WINDOW = window
+        self._MAX_SAMPLES = max_samples
+        self._SAMPLES = {}  # {command: deque([(monotonic, latency)])}
+        self._LOCK = threading.Lock()
+
+    def record(self, command: str, latency: float):
+        with self._LOCK:
+            samples = self._SAMPLES.get(command)
+            if samples is None:
+                samples = self._SAMPLES[command] = deque(maxlen=self._MAX_SAMPLES)
+            samples.append((time.monotonic(), latency))
+
+    def percentiles(self) -> dict:
+        horizon = time.monotonic() - self._WINDOW
+        report = {}
+        with self._LOCK:
+            for command, samples in list(self._SAMPLES.items()):
+                while samples and samples[0][0] < horizon:
+                    samples.popleft()
+                if not samples:
+                    del self._SAMPLES[command]
+                    continue
+                latencies = sorted(latency for _, latency in samples)
+                report[command] = {
+                    'count': len(latencies),
+                    'p50': percentile(latencies, 50),
+                    'p95': percentile(latencies, 95),
+                    'p99': percentile(latencies, 99),
+                }
+        return report
+
+
+# Thread plumbing: a thread on top of these is parked on a lock, a queue or a condition
+_IDLE_FILES = {os.path.normcase(threading.__file__), os.path.normcase(queue.__file__)}
+
+
+def _frame_label(code) -> str:
+    return '{}:{}'.format(os.path.basename(code.co_filename), code.co_name)
+
+
+class SamplingProfiler():
+    # Samples the stacks of the threads handling the next `messages` messages
+    # (plus `extra_threads`, e.g. the hardware worker and the sender) every `interval` seconds.
+    # Nothing runs until the first message is entered and the thread exits after the last one.
+
+    def __init__(self, messages: int, on_done: callable, extra_threads: callable = lambda: (),
+                 interval: float = 0.001):
+        self._REMAINING = messages
+        self._ON_DONE = on_done
+        self._EXTRA_THREADS = extra_threads
+        self._INTERVAL = interval
+        self._ACTIVE = Counter()  # {thread ident: nested messages}
+        self._HITS = Counter()    # {function label: samples with the function on the stack}
+        self._OWN = Counter()     # {function label: samples with the function on top}
+        self._SAMPLES = 0
+        self._LOCK = threading.Lock()
+        self._STOP = threading.Event()
+        self._THREAD = None
+
+    @property
+    def remaining(self) -> int:
+        return self._REMAINING
+
+    @property
+    def samples(self) -> int:
+        return self._SAMPLES
+
+    @contextmanager
+    def message(self):
+        ident = threading.get_ident()
+        with self._LOCK:
+            if self._REMAINING <= 0:
+                counted = False
+            else:
+                counted = True
+                self._REMAINING -= 1
+                self._ACTIVE[ident] += 1
+                if self._THREAD is None:
+                    self._THREAD = threading.Thread(target=self._run, name='acremote-profiler', daemon=True)
+                    self._THREAD.start()
+        try:
+            yield
+        finally:
+            if counted:
+                self._leave(ident)
+
+    def _leave(self, ident: int):
+        with self._LOCK:
+            self._ACTIVE[ident] -= 1
+            if self._ACTIVE[ident] <= 0:
+                del self._ACTIVE[ident]
+            done = self._REMAINING <= 0 and not self._ACTIVE
+        if done:
+            self.stop()
+            self._ON_DONE(self)
+
+    def stop(self):
+        self._STOP.set()
+        if self._THREAD is not None and self._THREAD is not threading.current_thread():
+            self._THREAD.join(1)
+
+    def _run(self):
+        while not self._STOP.wait(self._INTERVAL):
+            with self._LOCK:
+                if not self._ACTIVE:
+                    continue
+                idents = set(self._ACTIVE)
+            idents.update(ident for ident in self._EXTRA_THREADS() if ident)
+            frames = sys._current_frames()
+            for ident in idents:
+                self._sample(frames.get(ident))
+
+    def _sample(self, frame):
+        if frame is None or os.path.normcase(frame.f_code.co_filename) in _IDLE_FILES:
+            return
+        self._SAMPLES += 1
+        self._OWN[_frame_label(frame.f_code)] += 1
+        seen = set()
+        while frame is not None:
+            label = _frame_label(frame.f_code)
+            # recursive functions count once per sample
+            if label not in seen and os.path.normcase(frame.f_code.co_filename) not in _IDLE_FILES:
+                seen.add(label)
+                self._HITS[label] += 1
+            frame = frame.f_back
+
+    def top(self, limit: int = 10) -> list:
+        # [(function, share of samples on top, share of samples on the stack)], hottest first
+        if not self._SAMPLES:
+            return []
+        ranked = sorted(self._HITS, key=lambda label: (self._OWN[label], self._HITS[label]), reverse=True)
+        return [
+            (label, self._OWN[label] / self._SAMPLES, self._HITS[label] / self._SAMPLES)
+            for label in ranked[:limit]
+        ]
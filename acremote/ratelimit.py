@@ -0,0 +1,58 @@
+import threading
+import time
+
+
+class TokenBucket():
+    # Not thread-safe, callers guard buckets with their own locks
+
+    def __init__(self, rate: float, capacity: float):
+        self._RATE = rate          # tokens per second
+        self._CAPACITY = capacity  # burst size
+        self._TOKENS = capacity
+        self._STAMP = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._TOKENS = min(self._CAPACITY, self._TOKENS + (now - self._STAMP) * self._RATE)
+        self._STAMP = now
+
+    @property
+    def tokens(self) -> float:
+        self._refill()
+        return self._TOKENS
+
+    def wait_time(self, tokens: float = 1) -> float:
+        self._refill()
+        return max(0.0, (tokens - self._TOKENS) / self._RATE)
+
+    def consume(self, tokens: float = 1) -> bool:
+        self._refill()
+        if self._TOKENS < tokens:
+            return False
+        self._TOKENS -= tokens
+        return True
+
+    def penalize(self, seconds: float):
+        # Server asked us to back off: no tokens for the next `seconds`
+        self._refill()
+        self._TOKENS = min(self._TOKENS, 1.0) - seconds * self._RATE
+
+
+class AdmissionControl():
+    # A token bucket per (user, lane) in front of the command dispatch: a user who
+    # floods one lane is refused there without using up the other lanes or anyone else's
+
+    def __init__(self, lanes: dict):
+        self._LANES = lanes  # {lane: (rate, burst)}
+        self._BUCKETS = {}   # {(user_id, lane): TokenBucket}
+        self._LOCK = threading.Lock()
+
+    def admit(self, user_id, lane: str) -> float:
+        # 0 when admitted, otherwise the seconds until the lane has a token again
+        with self._LOCK:
+            bucket = self._BUCKETS.get((user_id, lane))
+            if bucket is None:
+                bucket = self._BUCKETS[(user_id, lane)] = TokenBucket(*self._LANES[lane])
+            if bucket.consume():
+                return 0.0
+            return bucket.wait_time()
@@ -0,0 +1,204 @@
+import datetime
+import heapq
+import sys
+import threading
+import time
+
+from acremote.state import StateStore
+
+DAY_NAMES = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+
+_DAY_ALIASES = {
+    'once': (),
+    'daily': tuple(range(7)),
+    'weekdays': tuple(range(5)),
+    'weekends': (5, 6),
+}
+
+
+def parse_time(value: str) -> str:
+    # '8:30' -> '08:30'
+    hour, _, minute = value.partition(':')
+    parsed = datetime.time(int(hour), int(minute or 0))
+    return parsed.strftime('%H:%M')
+
+
+def parse_days(value: str) -> tuple:
+    # 'once', 'daily', 'weekdays', 'weekends', 'mon-fri', 'sat,sun' -> weekday numbers, () = once
+    value = value.lower()
+    if value in _DAY_ALIASES:
+        return _DAY_ALIASES[value]
+    days = set()
+    for part in value.split(','):
+        first, _, last = part.partition('-')
+        first = DAY_NAMES.index(first[:3])
+        last = DAY_NAMES.index(last[:3]) if last else first
+        days.update(range(first, last + 1) if first <= last else list(range(first, 7)) + list(range(last + 1)))
+    return tuple(sorted(days))
+
+
+def format_days(days) -> str:
+    days = tuple(days)
+    for alias, alias_days in _DAY_ALIASES.items():
+        if days == alias_days:
+            return alias
+    return ','.join(DAY_NAMES[day] for day in days)
+
+
+def next_due(job: dict, now: float) -> float:
+    # Next local wall clock time strictly after `now` on one of the job's days
+    at = datetime.datetime.strptime(job['time'], '%H:%M').time()
+    today = datetime.datetime.fromtimestamp(now).date()
+    for offset in range(8):
+        candidate = datetime.datetime.combine(today + datetime.timedelta(days=offset), at)
+        if candidate.timestamp() > now and (not job['days'] or candidate.weekday() in job['days']):
+            return candidate.timestamp()
+    raise ValueError('No due time for {!r}'.format(job))
+
+
+class Scheduler(threading.Thread):
+    # Timed and recurring jobs in a heap ordered by due time. One thread sleeps on a
+    # condition until the earliest job is due; adding or removing a job wakes it up.
+    # Removed jobs stay in the heap and are skipped when they surface.
+    # /schedule jobs are due at wall clock times, call_later() delays are measured on the
+    # monotonic clock in a heap of their own so a clock step at boot can't stretch them
+
+    def __init__(self, callback: callable, path: str = None, clock: callable = None,
+                 max_sleep: float = 3600, monotonic: callable = time.monotonic):
+        super().__init__(name='acremote-scheduler', daemon=True)
+        self._CALLBACK = callback
+        self._STORE = StateStore(path) if path else None
+        self._CLOCK = clock or (lambda: datetime.datetime.now().timestamp())
+        self._MONOTONIC = monotonic
+        self._MAX_SLEEP = max_sleep  # re-check the wall clock now and then (NTP sync at boot, DST)
+        self._HEAP = []   # [(due, job_id)] wall clock
+        self._CALLS = []  # [(due, job_id)] monotonic clock, call_later() only
+        self._JOBS = {}   # {job_id:job}
+        self._DUE = {}    # {job_id:due} to tell current heap entries from stale ones
+        self._NEXT_ID = 1
+        self._NEXT_CALL = 1  # call_later() ids count down from -1, never persisted
+        self._CONDITION = threading.Condition()
+        self._RUNNING = True
+
+    def load(self):
+        if not self._STORE:
+            return
+        data = self._STORE.load()
+        with self._CONDITION:
+            self._NEXT_ID = data.get('next_id', 1)
+            now = self._CLOCK()
+            for job in data.get('jobs', []):
+                if not job['days'] and job.get('due', 0) <= now:
+                    continue  # one-off job that expired while we were down
+                self._push(job, now)
+            self._CONDITION.notify()
+
+    def _push(self, job: dict, now: float):
+        due = next_due(job, now) if job['days'] or not job.get('due') else job['due']
+        job['due'] = due
+        self._JOBS[job['id']] = job
+        self._DUE[job['id']] = due
+        heapq.heappush(self._HEAP, (due, job['id']))
+
+    def _save(self):
+        # Called with _CONDITION held: only hands the jobs to the write-behind store, stop() flushes it
+        if self._STORE:
+            jobs = [dict(self._JOBS[job_id]) for job_id in sorted(self._JOBS) if job_id > 0]
+            self._STORE.update({'next_id': self._NEXT_ID, 'jobs': jobs})
+
+    def add(self, chat_id: int, at: str, days: tuple, action: str, unit: str = None) -> dict:
+        with self._CONDITION:
+            job = {
+                'id': self._NEXT_ID,
+                'chat_id': chat_id,
+                'time': parse_time(at),
+                'days': list(days),
+                'action': action,
+            }
+            if unit:
+                job['unit'] = unit
+            self._NEXT_ID += 1
+            self._push(job, self._CLOCK())
+            self._save()
+            self._CONDITION.notify()
+            return dict(job)
+
+    def call_later(self, delay: float, callback: callable) -> int:
+        # One-off callback on the scheduler thread, kept in memory only. Returns an id for remove()
+        with self._CONDITION:
+            job_id = -self._NEXT_CALL
+            self._NEXT_CALL += 1
+            due = self._MONOTONIC() + delay
+            self._JOBS[job_id] = {'id': job_id, 'days': [], 'due': due, 'callback': callback}
+            self._DUE[job_id] = due
+            heapq.heappush(self._CALLS, (due, job_id))
+            self._CONDITION.notify()
+            return job_id
+
+    def remove(self, job_id: int) -> bool:
+        with self._CONDITION:
+            if self._JOBS.pop(job_id, None) is None:
+                return False
+            del self._DUE[job_id]
+            if job_id > 0:
+                self._save()
+            self._CONDITION.notify()
+            return True
+
+    def jobs(self) -> list:
+        with self._CONDITION:
+            return [
+                dict(self._JOBS[job_id]) for job_id, _ in sorted(self._DUE.items(), key=lambda item: item[1])
+                if job_id > 0
+            ]
+
+    def stop(self, timeout: float = None):
+        with self._CONDITION:
+            self._RUNNING = False
+            self._CONDITION.notify()
+        if self.is_alive():
+            self.join(timeout)
+        if self._STORE:
+            self._STORE.flush()
+
+    def _next_job(self):
+        # Blocks until a job is due, None once stopped
+        with self._CONDITION:
+            while self._RUNNING:
+                for heap in (self._HEAP, self._CALLS):
+                    while heap and self._DUE.get(heap[0][1]) != heap[0][0]:
+                        heapq.heappop(heap)  # removed or rescheduled
+                # the heap whose earliest job is closest to being due, on its own clock
+                waits = [(heap[0][0] - clock(), heap) for heap, clock in
+                         ((self._HEAP, self._CLOCK), (self._CALLS, self._MONOTONIC)) if heap]
+                if not waits:
+                    self._CONDITION.wait()
+                    continue
+                wait, heap = min(waits, key=lambda item: item[0])
+                if wait > 0:
+                    self._CONDITION.wait(min(wait, self._MAX_SLEEP))
+                    continue
+                due, job_id = heapq.heappop(heap)
+                now = self._CLOCK()
+                job = self._JOBS[job_id]
+                if job['days']:
+                    self._push(job, max(now, due))
+                else:
+                    del self._JOBS[job_id], self._DUE[job_id]
+                if job_id > 0:
+                    self._save()
+                return dict(job, due=due)
+            return None
+
+    def run(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            try:
+                if 'callback' in job:
+                    job['callback']()
+                else:
+                    self._CALLBACK(job)
+            except Exception as error:
+                print('Scheduled job {} failed: {!r}'.format(job['id'], error), file=sys.stderr, flush=True)
@@ -0,0 +1,171 @@
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+from acremote.ratelimit import TokenBucket
+from acremote.telegram import TelegramError, TelegramSession, merge_messages
+
+
+class OutboundSender(threading.Thread):
+    # Per-chat outgoing message queues drained within Telegram's rate limits,
+    # bursts to the same chat are merged into a single message. Edits and deletes
+    # go through the same queues, after the messages they refer to
+
+    def __init__(self, session: TelegramSession, rate: float = 30, chat_rate: float = 1,
+                 chat_burst: float = 3, max_length: int = 4096):
+        super().__init__(name='acremote-sender', daemon=True)
+        self._SESSION = session
+        self._BUCKET = TokenBucket(rate, rate)  # global limit
+        self._CHAT_RATE = chat_rate
+        self._CHAT_BURST = chat_burst
+        self._CHAT_BUCKETS = {}  # {chat_id:TokenBucket}, dropped again once full and idle
+        self._SWEEP_INTERVAL = 60
+        self._SWEPT = time.monotonic()
+        self._MAX_LENGTH = max_length
+        # {chat_id:deque([(text, parse_mode, reply_markup, merge, future)])},
+        # other calls are queued as (None, method, (args, kwargs, ignore), False, future)
+        self._QUEUES = {}
+        self._READY = deque()    # chats with pending messages, served round-robin
+        self._CONDITION = threading.Condition()
+        self._PENDING = 0
+        self._RUNNING = True
+
+    @property
+    def pending(self) -> int:
+        return self._PENDING
+
+    def send(self, chat_id, text: str, parse_mode: str = None, reply_markup=None, merge: bool = True) -> Future:
+        return self._queue(chat_id, (text, parse_mode, reply_markup, merge))
+
+    def call(self, chat_id, method: str, *args, ignore: tuple = (), **kwargs) -> Future:
+        # Any other session method about the chat (editMessageText, deleteMessage...).
+        # Errors whose description contains one of `ignore` resolve the future with None
+        return self._queue(chat_id, (None, method, (args, kwargs, ignore), False))
+
+    def _queue(self, chat_id, item: tuple) -> Future:
+        future = Future()
+        with self._CONDITION:
+            queue = self._QUEUES.get(chat_id)
+            if queue is None:
+                queue = self._QUEUES[chat_id] = deque()
+                self._READY.append(chat_id)
+            queue.append(item + (future,))
+            self._PENDING += 1
+            self._CONDITION.notify_all()
+        return future
+
+    def drain(self, timeout: float = None) -> bool:
+        with self._CONDITION:
+            return self._CONDITION.wait_for(lambda: not self._PENDING, timeout)
+
+    def stop(self, timeout: float = None):
+        self.drain(timeout)
+        with self._CONDITION:
+            self._RUNNING = False
+            self._CONDITION.notify_all()
+        self.join(timeout)
+
+    def _take_batch(self, queue: deque) -> list:
+        batch = [queue.popleft()]
+        if batch[0][0] is None:
+            return batch  # a call, never merged
+        length = len(batch[0][0])
+        while batch[-1][3] and batch[-1][2] is None and queue and queue[0][3]:
+            length += len(queue[0][0]) + 1
+            if length > self._MAX_LENGTH:
+                break
+            batch.append(queue.popleft())
+        return batch
+
+    def _next_batch(self) -> tuple:
+        # -> (chat_id, batch) or (None, seconds to wait)
+        wait = self._BUCKET.wait_time()
+        if wait:
+            return None, wait
+        for _ in range(len(self._READY)):
+            chat_id = self._READY[0]
+            self._READY.rotate(-1)
+            bucket = self._CHAT_BUCKETS.get(chat_id)
+            if bucket is None:
+                bucket = self._CHAT_BUCKETS[chat_id] = TokenBucket(self._CHAT_RATE, self._CHAT_BURST)
+            chat_wait = bucket.wait_time()
+            if chat_wait:
+                wait = min(wait or chat_wait, chat_wait)
+                continue
+            bucket.consume()
+            self._BUCKET.consume()
+            queue = self._QUEUES[chat_id]
+            batch = self._take_batch(queue)
+            if not queue:
+                del self._QUEUES[chat_id]
+                self._READY.remove(chat_id)
+            return chat_id, batch
+        return None, wait or None
+
+    def _sweep_buckets(self):
+        # A full bucket is as good as a new one, so chats with nothing queued give theirs up
+        self._SWEPT = time.monotonic()
+        for chat_id in [chat_id for chat_id, bucket in self._CHAT_BUCKETS.items()
+                        if chat_id not in self._QUEUES and bucket.tokens >= self._CHAT_BURST]:
+            del self._CHAT_BUCKETS[chat_id]
+
+    def _requeue(self, chat_id, batch: list, retry_after: float):
+        with self._CONDITION:
+            self._CHAT_BUCKETS[chat_id].penalize(retry_after)
+            queue = self._QUEUES.get(chat_id)
+            if queue is None:
+                queue = self._QUEUES[chat_id] = deque()
+                self._READY.append(chat_id)
+            queue.extendleft(reversed(batch))
+
+    def _deliver(self, chat_id, batch: list):
+        ignore = ()
+        try:
+            if batch[0][0] is None:
+                _, method, (args, kwargs, ignore), _, _ = batch[0]
+                result = getattr(self._SESSION, method)(*args, **kwargs)
+            else:
+                method = 'sendMessage'
+                text, parse_mode, reply_markup = merge_messages([item[:3] for item in batch])
+                result = self._SESSION.sendMessage(chat_id, text, parse_mode=parse_mode, reply_markup=reply_markup)
+        except TelegramError as error:
+            retry_after = error.parameters.get('retry_after')
+            if retry_after:
+                self._requeue(chat_id, batch, retry_after)
+                return 0
+            if any(expected in (error.description or '') for expected in ignore):
+                batch[0][4].set_result(None)
+                return 1
+            outcome = error
+        except OSError as error:
+            outcome = error
+        else:
+            for item in batch:
+                item[4].set_result(result)
+            return len(batch)
+
+        print('{} to {} failed: {!r}'.format(method, chat_id, outcome), file=sys.stderr, flush=True)
+        for item in batch:
+            item[4].set_exception(outcome)
+        return len(batch)
+
+    def run(self):
+        while True:
+            with self._CONDITION:
+                while True:
+                    if not self._RUNNING and not self._PENDING:
+                        return
+                    chat_id, batch = self._next_batch()
+                    if chat_id is not None:
+                        break
+                    self._CONDITION.wait(batch)  # until a token is available or a new message arrives
+
+            done = self._deliver(chat_id, batch)
+
+            with self._CONDITION:
+                self._PENDING -= done
+                if time.monotonic() - self._SWEPT > self._SWEEP_INTERVAL:
+                    self._sweep_buckets()
+                self._CONDITION.notify_all()
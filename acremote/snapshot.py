@@ -0,0 +1,246 @@
+import json
+import math
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from acremote.events import SensorSample, StateChanged
+
+# Fixed little-endian layout, version 1:
+#   header  magic, sequence, layout version, unit slots, sensor slots, generation, last update
+#   units   name, flags, mode, speed, temp, timer, last update    (one slot per unit)
+#   sensors name, value (NaN when unavailable), last update       (filled in arrival order)
+# The sequence is odd while the writer is inside an update, a reader copies the values
+# and keeps them only when the sequence was even and did not change meanwhile (seqlock).
+# A file is never resized, a different slot count replaces it with a new file of the next
+# generation, and the old one gets that generation too so its readers know to reopen
+MAGIC = b'ACSS'
+LAYOUT = 1
+UNIT_NAME = 16    # bytes of UTF-8, longer names are left out
+SENSOR_NAME = 24
+HEADER = struct.Struct('<4sIHHHHd')
+UNIT = struct.Struct('<{}sHBBB3xdd'.format(UNIT_NAME))
+SENSOR = struct.Struct('<{}sdd'.format(SENSOR_NAME))
+SEQUENCE = struct.Struct('<I')  # 32 bits, a single store even on 32-bit ARM
+SEQUENCE_OFFSET = 4
+GENERATION = struct.Struct('<H')
+GENERATION_OFFSET = 14
+
+FLAGS = ('on', 'swing', 'health', 'strong', 'sleep', 'screen', 'clean', 'fresh', 'feeling')
+MODES = ('AUTO', 'COOL', 'DRY', 'HEAT', 'FAN')
+SPEEDS = ('AUTO', 'LOW', 'MID', 'HIGH')
+UNKNOWN = 255
+
+
+def snapshot_size(units: int, sensors: int) -> int:
+    return HEADER.size + units * UNIT.size + sensors * SENSOR.size
+
+
+def sensor_values(source: str, readings: dict) -> dict:
+    # SensorSample readings -> {'w1/28-0316a2795eff': 21.5, 'system/load.0': 0.12, ...}
+    values = {}
+    for key, value in readings.items():
+        if key == 'ts':
+            continue
+        name = '{}/{}'.format(source, key)
+        if isinstance(value, (tuple, list)):
+            values.update(('{}.{}'.format(name, index), item) for index, item in enumerate(value))
+        else:
+            values[name] = value
+    return {name: math.nan if value is None else float(value) for name, value in values.items()}
+
+
+class StateSnapshot():
+    # Writes the state of every unit and the latest sensor readings into a memory-mapped
+    # file (/dev/shm keeps it in RAM) whenever they change, so dashboards and scripts can
+    # read them with SnapshotReader instead of parsing the state files or asking the bot.
+    # Updates come from the event bus, the lock keeps them to one writer at a time
+
+    def __init__(self, path: str, events, units: int = 8, sensors: int = 32):
+        self._PATH = path
+        self._EVENTS = events
+        self._UNIT_SLOTS = units
+        self._SENSOR_SLOTS = sensors
+        self._UNITS = {}    # {unit name: slot}
+        self._SENSORS = {}  # {sensor name: slot}
+        self._LEFT_OUT = set()  # sensor names too long for a slot, reported once
+        self._LOCK = threading.Lock()
+        self._MAP = None
+        self._SEQUENCE = 0
+        self._GENERATION = 0
+
+    def start(self, states: dict):
+        size = snapshot_size(self._UNIT_SLOTS, self._SENSOR_SLOTS)
+        self._MAP = self._open(size)
+        with self._update():
+            self._MAP[HEADER.size:] = bytes(size - HEADER.size)
+            for name, state in states.items():
+                if len(self._UNITS) == self._UNIT_SLOTS:
+                    break
+                if len(name.encode('utf-8')) > UNIT_NAME:
+                    print('Snapshot: unit {!r} left out, names are limited to {} bytes'.format(name, UNIT_NAME),
+                          file=sys.stderr, flush=True)
+                    continue
+                self._UNITS[name] = len(self._UNITS)
+                self._write_unit(name, state)
+        self._EVENTS.subscribe(StateChanged, self._on_state)
+        self._EVENTS.subscribe(SensorSample, self._on_sample)
+
+    def _open(self, size: int) -> mmap.mmap:
+        # Continue the sequence of a previous run, readers that kept the file mapped notice the update
+        try:
+            fd = os.open(self._PATH, os.O_RDWR)
+        except FileNotFoundError:
+            return self._replace(size)
+        try:
+            current = os.fstat(fd).st_size
+            previous = mmap.mmap(fd, current) if current >= HEADER.size else None
+        finally:
+            os.close(fd)
+        if previous is None:
+            return self._replace(size)
+        magic, sequence, _, _, _, generation, _ = HEADER.unpack_from(previous)
+        if magic == MAGIC:
+            self._SEQUENCE = (sequence + sequence % 2) & 0xFFFFFFFF
+            self._GENERATION = generation
+            if current == size:
+                return previous
+            self._GENERATION = (generation + 1) & 0xFFFF
+            GENERATION.pack_into(previous, GENERATION_OFFSET, self._GENERATION)
+        previous.close()
+        return self._replace(size)
+
+    def _replace(self, size: int) -> mmap.mmap:
+        # Readers never see a partly written file, nor a mapped one shrinking under them (SIGBUS)
+        temp_path = '{}.{}.tmp'.format(self._PATH, os.getpid())
+        fd = os.open(temp_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            snapshot = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        HEADER.pack_into(snapshot, 0, MAGIC, self._SEQUENCE, LAYOUT, self._UNIT_SLOTS, self._SENSOR_SLOTS,
+                         self._GENERATION, time.time())
+        os.replace(temp_path, self._PATH)
+        return snapshot
+
+    def close(self):
+        self._EVENTS.unsubscribe(StateChanged, self._on_state)
+        self._EVENTS.unsubscribe(SensorSample, self._on_sample)
+        with self._LOCK:
+            if self._MAP:
+                self._MAP.close()
+                self._MAP = None
+
+    @contextmanager
+    def _update(self):
+        with self._LOCK:
+            self._SEQUENCE = (self._SEQUENCE + 1) & 0xFFFFFFFF  # odd: readers retry
+            SEQUENCE.pack_into(self._MAP, SEQUENCE_OFFSET, self._SEQUENCE)
+            try:
+                yield
+            finally:
+                self._SEQUENCE = (self._SEQUENCE + 1) & 0xFFFFFFFF
+                HEADER.pack_into(self._MAP, 0, MAGIC, self._SEQUENCE, LAYOUT, self._UNIT_SLOTS, self._SENSOR_SLOTS,
+                                 self._GENERATION, time.time())
+
+    def _write_unit(self, name: str, state: dict):
+        flags = sum(1 << bit for bit, flag in enumerate(FLAGS) if state.get(flag))
+        mode = MODES.index(state['mode']) if state.get('mode') in MODES else UNKNOWN
+        speed = SPEEDS.index(state['speed']) if state.get('speed') in SPEEDS else UNKNOWN
+        UNIT.pack_into(self._MAP, HEADER.size + self._UNITS[name] * UNIT.size, name.encode('utf-8'),
+                       flags, mode, speed, int(state.get('temp', 0)), float(state.get('timer', 0)), time.time())
+
+    def _on_state(self, event: StateChanged):
+        if event.unit not in self._UNITS or not self._MAP:
+            return
+        with self._update():
+            self._write_unit(event.unit, event.state)
+
+    def _on_sample(self, event: SensorSample):
+        if not self._MAP:
+            return
+        offset = HEADER.size + self._UNIT_SLOTS * UNIT.size
+        now = time.time()
+        with self._update():
+            for name, value in sensor_values(event.source, event.readings).items():
+                slot = self._SENSORS.get(name)
+                if slot is None:
+                    if len(self._SENSORS) == self._SENSOR_SLOTS or name in self._LEFT_OUT:
+                        continue  # full, later sensors are left out
+                    if len(name.encode('utf-8')) > SENSOR_NAME:
+                        self._LEFT_OUT.add(name)
+                        print('Snapshot: sensor {!r} left out, names are limited to {} bytes'.format(
+                            name, SENSOR_NAME), file=sys.stderr, flush=True)
+                        continue
+                    slot = self._SENSORS[name] = len(self._SENSORS)
+                SENSOR.pack_into(self._MAP, offset + slot * SENSOR.size, name.encode('utf-8'), value, now)
+
+
+class SnapshotReader():
+    # Maps a StateSnapshot file read-only and returns consistent copies of it.
+    # Nothing is parsed but the few fixed-size records, reading never blocks the bot
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as file_handle:
+            self._MAP = mmap.mmap(file_handle.fileno(), 0, access=mmap.ACCESS_READ)
+        self._GENERATION = GENERATION.unpack_from(self._MAP, GENERATION_OFFSET)[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._MAP.close()
+
+    def read(self, retries: int = 1000) -> dict:
+        for _ in range(retries):
+            sequence = SEQUENCE.unpack_from(self._MAP, SEQUENCE_OFFSET)[0]
+            if sequence % 2:
+                time.sleep(0)  # the writer is in the middle of an update
+                continue
+            snapshot = self._decode()
+            if SEQUENCE.unpack_from(self._MAP, SEQUENCE_OFFSET)[0] == sequence:
+                return snapshot
+        raise TimeoutError('No consistent snapshot after {} attempts'.format(retries))
+
+    def _decode(self) -> dict:
+        magic, sequence, layout, units, sensors, generation, updated = HEADER.unpack_from(self._MAP)
+        if magic != MAGIC or layout != LAYOUT:
+            raise ValueError('Not an acremote snapshot (layout {})'.format(LAYOUT))
+        if generation != self._GENERATION or snapshot_size(units, sensors) > len(self._MAP):
+            raise ValueError('Snapshot was replaced, open it again')
+        snapshot = {'sequence': sequence, 'updated': updated, 'units': {}, 'sensors': {}}
+        offset = HEADER.size
+        for _ in range(units):
+            name, flags, mode, speed, temp, timer, unit_updated = UNIT.unpack_from(self._MAP, offset)
+            offset += UNIT.size
+            if not name.strip(b'\0'):
+                continue
+            state = {flag: bool(flags >> bit & 1) for bit, flag in enumerate(FLAGS)}
+            state.update(mode=MODES[mode] if mode < len(MODES) else None,
+                         speed=SPEEDS[speed] if speed < len(SPEEDS) else None,
+                         temp=temp, timer=timer, updated=unit_updated)
+            snapshot['units'][name.rstrip(b'\0').decode('utf-8', 'replace')] = state
+        for _ in range(sensors):
+            name, value, sensor_updated = SENSOR.unpack_from(self._MAP, offset)
+            offset += SENSOR.size
+            if name.strip(b'\0'):
+                snapshot['sensors'][name.rstrip(b'\0').decode('utf-8', 'replace')] = {
+                    'value': None if math.isnan(value) else value, 'updated': sensor_updated}
+        return snapshot
+
+
+def read_snapshot(path: str) -> dict:
+    with SnapshotReader(path) as reader:
+        return reader.read()
+
+
+if __name__ == '__main__':
+    print(json.dumps(read_snapshot(sys.argv[1] if len(sys.argv) > 1 else '/dev/shm/acremote'), indent=2))
@@ -0,0 +1,102 @@
+import json
+import os
+import sys
+import tempfile
+import threading
+from time import perf_counter
+
+from acremote import metrics
+
+WRITE_SECONDS = metrics.histogram('acremote_state_write_seconds', 'Time to write the remote state file atomically')
+WRITE_ERRORS = metrics.counter('acremote_state_write_errors_total', 'Failed remote state file writes')
+COALESCED = metrics.counter('acremote_state_updates_coalesced_total', 'State changes merged into a pending write')
+
+
+class StateStore():
+    # Write-behind JSON store: changes are coalesced for `delay` seconds and written atomically
+
+    def __init__(self, path: str, delay: float = 5.0):
+        self._PATH = path
+        self._DELAY = delay
+        self._LOCK = threading.Lock()        # guards the fields below, never held during I/O
+        self._WRITE_LOCK = threading.Lock()  # one write at a time, in order
+        self._SAVED = None    # last state known to be on disk
+        self._WRITING = None  # state being written right now
+        self._PENDING = None  # newer state waiting for the timer
+        self._TIMER = None
+
+    @property
+    def dirty(self) -> bool:
+        return self._PENDING is not None or self._WRITING is not None
+
+    def load(self) -> dict:
+        if not os.path.isfile(self._PATH):
+            return {}
+        with open(self._PATH, 'r') as file_handle:
+            state = json.load(file_handle)
+        with self._LOCK:
+            self._SAVED = dict(state)
+        return state
+
+    def update(self, state: dict):
+        with self._LOCK:
+            latest = next((known for known in (self._PENDING, self._WRITING) if known is not None), self._SAVED)
+            if state == latest:
+                return
+            if self._PENDING is not None:
+                COALESCED.inc()
+            self._PENDING = dict(state)
+            if self._TIMER is None:
+                self._TIMER = threading.Timer(self._DELAY, self.flush)
+                self._TIMER.daemon = True
+                self._TIMER.start()
+
+    def flush(self):
+        # The slow part (write, fsync, rename) runs without _LOCK so update() never waits for the disk
+        with self._WRITE_LOCK:
+            with self._LOCK:
+                if self._TIMER is not None:
+                    self._TIMER.cancel()
+                    self._TIMER = None
+                state, self._PENDING = self._PENDING, None
+                if state is None:
+                    return
+                self._WRITING = state
+            started = perf_counter()
+            try:
+                self._write(state)
+            except OSError as error:
+                WRITE_ERRORS.inc()
+                print('Failed to save state to {}: {!r}'.format(self._PATH, error), file=sys.stderr, flush=True)
+                with self._LOCK:
+                    if self._PENDING is None:
+                        self._PENDING = state  # retried by the next flush
+                    self._WRITING = None
+                return
+            WRITE_SECONDS.observe(perf_counter() - started)
+            with self._LOCK:
+                self._SAVED = state
+                self._WRITING = None
+
+    def _write(self, state: dict):
+        directory = os.path.dirname(os.path.abspath(self._PATH))
+        fd, tmp_path = tempfile.mkstemp(prefix='.' + os.path.basename(self._PATH) + '.', dir=directory)
+        try:
+            with os.fdopen(fd, 'w') as file_handle:
+                json.dump(state, file_handle, separators=(',', ':'))
+                file_handle.flush()
+                os.fsync(file_handle.fileno())
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, self._PATH)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+        dir_fd = os.open(directory, os.O_RDONLY)  # persist the rename itself
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
@@ -0,0 +1,19 @@
+import os
+import socket
+
+
+def notify(state: str) -> bool:
+    # sd_notify(3) datagram protocol, a no-op unless started by systemd with Type=notify
+    address = os.environ.get('NOTIFY_SOCKET')
+    if not address:
+        return False
+    if address[0] == '@':
+        address = '\0' + address[1:]  # abstract namespace socket
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.connect(address)
+            sock.sendall(state.encode('utf-8'))
+    except OSError:
+        return False
+    return True
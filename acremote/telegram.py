@@ -0,0 +1,173 @@
+import html
+import http.client
+import json
+import threading
+from urllib.parse import urlsplit
+
+API_URL = 'https://api.telegram.org'
+
+
+class TelegramError(Exception):
+    def __init__(self, description, error_code=None, parameters=None):
+        super().__init__(description)
+        self.description = description
+        self.error_code = error_code
+        self.parameters = parameters or {}
+
+
+def jsonable(value):
+    # namedtuples (e.g. keyboards, buttons) -> plain JSON structures, None fields are left out
+    if hasattr(value, '_asdict'):
+        value = value._asdict()
+    if isinstance(value, dict):
+        return {key: jsonable(item) for key, item in value.items() if item is not None}
+    if isinstance(value, (list, tuple)):
+        return [jsonable(item) for item in value]
+    return value
+
+
+def message_target(msg_identifier) -> dict:
+    if len(msg_identifier) == 2:
+        return {'chat_id': msg_identifier[0], 'message_id': msg_identifier[1]}
+    return {'inline_message_id': msg_identifier[0]}
+
+
+def parse_result(status: int, data: bytes):
+    try:
+        result = json.loads(data)
+    except ValueError:
+        raise TelegramError('Bad response (HTTP {})'.format(status), status)
+    if not result.get('ok'):
+        raise TelegramError(
+            result.get('description'),
+            result.get('error_code', status),
+            result.get('parameters'),
+        )
+    return result['result']
+
+
+def merge_messages(messages: list) -> tuple:
+    # [(text, parse_mode, reply_markup)] -> one message, plain parts are escaped when mixed with HTML
+    as_html = any(parse_mode == 'HTML' for _, parse_mode, _ in messages)
+    text = '\n'.join(
+        text if parse_mode == 'HTML' or not as_html else html.escape(text)
+        for text, parse_mode, _ in messages
+    )
+    markups = [reply_markup for _, _, reply_markup in messages if reply_markup is not None]
+    return text, 'HTML' if as_html else None, markups[-1] if markups else None
+
+
+class TelegramSession():
+    # Blocking Bot API client keeping a pool of keep-alive connections
+
+    def __init__(self, token: str, api_url: str = API_URL, pool_size: int = 2, timeout: float = 30):
+        url = urlsplit(api_url)
+        self._TOKEN = token
+        self._HTTPS = url.scheme == 'https'
+        self._HOST = url.hostname
+        self._PORT = url.port or (443 if self._HTTPS else 80)
+        self._PATH = url.path.rstrip('/')
+        self._TIMEOUT = timeout
+        self._POOL_SIZE = pool_size
+        self._IDLE = []
+        self._LOCK = threading.Lock()
+
+    def _connect(self):
+        if self._HTTPS:
+            return http.client.HTTPSConnection(self._HOST, self._PORT, timeout=self._TIMEOUT)
+        return http.client.HTTPConnection(self._HOST, self._PORT, timeout=self._TIMEOUT)
+
+    def call(self, method: str, params: dict = None):
+        body = json.dumps(jsonable(params or {})).encode('utf-8')
+        headers = {'Content-Type': 'application/json', 'Connection': 'keep-alive'}
+        url = '{}/bot{}/{}'.format(self._PATH, self._TOKEN, method)
+
+        while True:
+            with self._LOCK:
+                connection = self._IDLE.pop() if self._IDLE else None
+            reused = connection is not None
+            if not reused:
+                connection = self._connect()
+            try:
+                connection.request('POST', url, body, headers)
+                response = connection.getresponse()
+                data = response.read()
+            except (http.client.HTTPException, OSError) as error:
+                connection.close()
+                if reused:
+                    continue  # the server dropped an idle connection, retry on a fresh one
+                raise ConnectionError('Telegram API connection failed: {!r}'.format(error))
+            break
+
+        with self._LOCK:
+            if response.will_close or len(self._IDLE) >= self._POOL_SIZE:
+                connection.close()
+            else:
+                self._IDLE.append(connection)
+
+        return parse_result(response.status, data)
+
+    def set_token(self, token: str):
+        # Requests already on the wire finish with the old token, idle connections are dropped
+        with self._LOCK:
+            self._TOKEN = token
+            while self._IDLE:
+                self._IDLE.pop().close()
+
+    def close(self):
+        with self._LOCK:
+            while self._IDLE:
+                self._IDLE.pop().close()
+
+    #################################################
+    # BOT API METHODS
+    #################################################
+
+    def getUpdates(self, offset=None, limit=None, timeout=None, allowed_updates=None):
+        # Long polling: timeout must stay below the socket timeout of the session
+        return self.call('getUpdates', {
+            'offset': offset,
+            'limit': limit,
+            'timeout': timeout,
+            'allowed_updates': allowed_updates,
+        })
+
+    def sendMessage(self, chat_id, text, parse_mode=None, disable_web_page_preview=None,
+                    disable_notification=None, reply_to_message_id=None, reply_markup=None):
+        return self.call('sendMessage', {
+            'chat_id': chat_id,
+            'text': text,
+            'parse_mode': parse_mode,
+            'disable_web_page_preview': disable_web_page_preview,
+            'disable_notification': disable_notification,
+            'reply_to_message_id': reply_to_message_id,
+            'reply_markup': reply_markup,
+        })
+
+    def editMessageText(self, msg_identifier, text, parse_mode=None,
+                        disable_web_page_preview=None, reply_markup=None):
+        params = message_target(msg_identifier)
+        params.update({
+            'text': text,
+            'parse_mode': parse_mode,
+            'disable_web_page_preview': disable_web_page_preview,
+            'reply_markup': reply_markup,
+        })
+        return self.call('editMessageText', params)
+
+    def deleteMessage(self, msg_identifier):
+        return self.call('deleteMessage', message_target(msg_identifier))
+
+    def deleteMessages(self, chat_id, message_ids: list):
+        # Up to 100 messages of one chat in a single request
+        return self.call('deleteMessages', {'chat_id': chat_id, 'message_ids': list(message_ids)})
+
+    def answerCallbackQuery(self, callback_query_id, text=None, show_alert=None,
+                            url=None, cache_time=None):
+        return self.call('answerCallbackQuery', {
+            'callback_query_id': callback_query_id,
+            'text': text,
+            'show_alert': show_alert,
+            'url': url,
+            'cache_time': cache_time,
+        })
@@ -0,0 +1,127 @@
+import glob
+import os
+import threading
+import time
+from collections import deque
+
+# Bits of the firmware's get_throttled value: what is happening now, and since boot
+THROTTLED_FLAGS = (
+    (0, 'under-voltage'),
+    (1, 'ARM frequency capped'),
+    (2, 'throttled'),
+    (3, 'soft temperature limit'),
+)
+THROTTLED_SINCE_BOOT = 16
+
+
+def throttled_flags(value: int) -> tuple:
+    # get_throttled value -> ([conditions now], [conditions seen since boot])
+    now = [name for bit, name in THROTTLED_FLAGS if value >> bit & 1]
+    since_boot = [name for bit, name in THROTTLED_FLAGS if value >> (bit + THROTTLED_SINCE_BOOT) & 1]
+    return now, since_boot
+
+
+class SystemTelemetry():
+    # CPU temperature, load, memory and throttling read from sysfs/procfs into a ring buffer.
+    # A sample is a few small file reads, nothing is spawned (vcgencmd is gone on newer images)
+
+    def __init__(self, size: int = 60, root: str = '/'):
+        self._ROOT = root
+        self._SAMPLES = deque(maxlen=size)
+        self._LOCK = threading.Lock()
+        self._THERMAL_ZONE = None  # detected on the first sample
+        self._THROTTLED_FILE = None
+
+    def _path(self, *parts) -> str:
+        return os.path.join(self._ROOT, *parts)
+
+    def _read(self, path: str):
+        try:
+            with open(path) as file_handle:
+                return file_handle.read().strip()
+        except OSError:
+            return None
+
+    def _detect_files(self):
+        zones = sorted(glob.glob(self._path('sys/class/thermal/thermal_zone*')))
+        self._THERMAL_ZONE = zones[0] if zones else ''
+        for zone in zones:
+            if self._read(os.path.join(zone, 'type')) in ('cpu-thermal', 'cpu_thermal', 'x86_pkg_temp'):
+                self._THERMAL_ZONE = zone
+                break
+
+        # Raspberry Pi firmware driver; older kernels only report under-voltage through hwmon
+        self._THROTTLED_FILE = self._path('sys/devices/platform/soc/soc:firmware/get_throttled')
+        if not os.path.isfile(self._THROTTLED_FILE):
+            self._THROTTLED_FILE = ''
+            for hwmon in glob.glob(self._path('sys/class/hwmon/hwmon*')):
+                if self._read(os.path.join(hwmon, 'name')) == 'rpi_volt':
+                    self._THROTTLED_FILE = os.path.join(hwmon, 'in0_lcrit_alarm')
+                    break
+
+    def _cpu_temp(self):
+        value = self._read(os.path.join(self._THERMAL_ZONE, 'temp')) if self._THERMAL_ZONE else None
+        return int(value) / 1000 if value else None
+
+    def _load(self):
+        value = self._read(self._path('proc/loadavg'))
+        return tuple(float(load) for load in value.split()[:3]) if value else None
+
+    def _memory(self) -> dict:
+        value = self._read(self._path('proc/meminfo')) or ''
+        memory = {}
+        for line in value.splitlines():
+            key, _, amount = line.partition(':')
+            if key in ('MemTotal', 'MemAvailable'):
+                memory[key] = int(amount.split()[0]) // 1024  # kB -> MB
+        return memory
+
+    def _throttled(self):
+        value = self._read(self._THROTTLED_FILE) if self._THROTTLED_FILE else None
+        if not value:
+            return None
+        return int(value, 16) if self._THROTTLED_FILE.endswith('get_throttled') else int(value)
+
+    def sample(self) -> dict:
+        if self._THERMAL_ZONE is None:
+            self._detect_files()
+        memory = self._memory()
+        sample = {
+            'ts': time.time(),
+            'cpu_temp': self._cpu_temp(),
+            'load': self._load(),
+            'mem_available': memory.get('MemAvailable'),
+            'mem_total': memory.get('MemTotal'),
+            'throttled': self._throttled(),
+        }
+        with self._LOCK:
+            self._SAMPLES.append(sample)
+        return sample
+
+    def latest(self) -> dict:
+        with self._LOCK:
+            if self._SAMPLES:
+                return self._SAMPLES[-1]
+        return self.sample()
+
+    def history(self) -> list:
+        with self._LOCK:
+            return list(self._SAMPLES)
+
+    def trend(self, key: str, index: int = None) -> dict:
+        # min/max/change of one value over the buffered samples, None when it is unavailable
+        values = []
+        for sample in self.history():
+            value = sample[key]
+            if value is not None and index is not None:
+                value = value[index]
+            if value is not None:
+                values.append((sample['ts'], value))
+        if not values:
+            return None
+        return {
+            'min': min(value for _, value in values),
+            'max': max(value for _, value in values),
+            'change': values[-1][1] - values[0][1],
+            'minutes': round((values[-1][0] - values[0][0]) / 60),
+        }
@@ -1,11 +1,21 @@
 import glob
 import os
+from time import perf_counter
+
+from acremote import metrics
+
+POLL_SECONDS = metrics.histogram('acremote_sensor_poll_seconds', 'Time to read all 1-Wire temperature sensors')
+CRC_RETRIES = metrics.counter('acremote_sensor_crc_retries_total', 'Sensor reads repeated after a failed CRC check')
 
 
 class W1Thermo():
-    def __init__(self):
+    def __init__(self, crc_retries: int = 3):
         self._DEV_BASE = '/sys/bus/w1/devices'
-        self._DEVICES = {
+        self._DEVICES = None  # detected on the first poll, keeps startup off sysfs
+        self._CRC_RETRIES = crc_retries  # a read takes ~750ms, a sensor that keeps failing is given up on
+
+    def _detect_devices(self) -> dict:
+        return {
             path.split('/')[-1]: None
             for path in glob.glob(self._DEV_BASE + '/28*')  # Detect DS18B20
         }
@@ -15,13 +25,23 @@ class W1Thermo():
             return [line.strip() for line in file.readlines()]
 
     def poll(self) -> dict:
+        started = perf_counter()
+        if self._DEVICES is None:
+            self._DEVICES = self._detect_devices()
+
         for device in self._DEVICES.keys():
             lines = self._read_w1_slave(device)
-            while lines[0][-3:] != 'YES':
+            for _ in range(self._CRC_RETRIES):
+                if lines[0][-3:] == 'YES':
+                    break
+                CRC_RETRIES.inc()
                 lines = self._read_w1_slave(device)
+            if lines[0][-3:] != 'YES':
+                raise ValueError('CRC check of {} failed {} times'.format(device, self._CRC_RETRIES + 1))
 
             self._DEVICES[device] = int(lines[1].split('=')[1]) / 1000
 
+        POLL_SECONDS.observe(perf_counter() - started)
         return self._DEVICES
 
 
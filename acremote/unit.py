@@ -0,0 +1,116 @@
+import threading
+from contextlib import contextmanager
+
+from acremote.events import EventBus
+from acremote.state import StateStore
+from acremote.vestel import VestelACRemote
+from acremote.worker import HardwareWorker
+
+
+class PriorityRLock():
+    # Reentrant lock where urgent acquirers (power commands) go ahead of everyone
+    # already waiting, so /off is not stuck behind a line of temperature tweaks
+
+    def __init__(self):
+        self._COND = threading.Condition(threading.Lock())
+        self._OWNER = None
+        self._DEPTH = 0
+        self._URGENT = 0  # urgent acquirers waiting
+
+    def acquire(self, urgent: bool = False):
+        me = threading.get_ident()
+        with self._COND:
+            if self._OWNER == me:
+                self._DEPTH += 1
+                return True
+            if urgent:
+                self._URGENT += 1
+            try:
+                while self._OWNER is not None or (not urgent and self._URGENT):
+                    self._COND.wait()
+            finally:
+                if urgent:
+                    self._URGENT -= 1
+            self._OWNER = me
+            self._DEPTH = 1
+            return True
+
+    def release(self):
+        with self._COND:
+            if self._OWNER != threading.get_ident():
+                raise RuntimeError('cannot release un-acquired lock')
+            self._DEPTH -= 1
+            if not self._DEPTH:
+                self._OWNER = None
+                self._COND.notify_all()
+
+    @contextmanager
+    def urgent(self):
+        self.acquire(urgent=True)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class ACUnit():
+    # One air conditioner: its remote, hardware worker, state file and power cooldown.
+    # Every unit has its own transaction lock, so commands to different rooms never wait
+    # on each other; power commands take it ahead of queued tweaks. start_time, stop_time,
+    # timer (the remote's timer dial) and pending (deferred power command) are owned by
+    # ACRemote and only changed under the lock
+
+    def __init__(self, name: str, gpio_pin: int, state_file: str, events: EventBus = None):
+        self._NAME = name
+        self._HANDLER = VestelACRemote(gpio_pin)
+        self._WORKER = HardwareWorker(self._HANDLER, name='acremote-hw-' + name, events=events, unit=name)
+        self._LOCK = PriorityRLock()
+        self._STORE = StateStore(state_file)
+        self.start_time = 0
+        self.stop_time = 0
+        self.timer = 0.0
+        self.pending = None
+
+    @property
+    def name(self) -> str:
+        return self._NAME
+
+    @property
+    def handler(self) -> VestelACRemote:
+        return self._HANDLER
+
+    @property
+    def worker(self) -> HardwareWorker:
+        return self._WORKER
+
+    @property
+    def lock(self) -> PriorityRLock:
+        return self._LOCK
+
+    @property
+    def store(self) -> StateStore:
+        return self._STORE
+
+    def load_state(self):
+        remote_state = self._STORE.load()
+        for attr in remote_state:
+            try:
+                setattr(self._HANDLER, attr, remote_state[attr])
+            except AttributeError:
+                pass  # skip properties without setter
+
+    def save_state(self):
+        self._STORE.update(self._HANDLER.state)  # written behind only if something changed
+
+    def start(self):
+        self._WORKER.start()
+
+    def stop(self, timeout: float = None):
+        self._WORKER.stop(timeout=timeout)
+        self._STORE.flush()
@@ -1,9 +1,16 @@
 # Based on Vestel YKR-H/002E AC remote
-from time import sleep
+from threading import Lock
+from time import perf_counter, sleep
+from acremote import metrics
 from acremote.thermo import W1Thermo
 
 import gpirblast
 
+IR_SEND_SECONDS = metrics.histogram('acremote_ir_send_seconds', 'Time to build and transmit one IR frame')
+
+# gpirblast initialises pigpio for every frame, so units on other pins still transmit one at a time
+_TX_LOCK = Lock()
+
 
 class VestelACRemote():
 
@@ -38,6 +45,10 @@ class VestelACRemote():
         self._SPEED = 'HIGH'
         self._GPIO_PIN = gpio_pin
         self._THERMO = W1Thermo()
+        self._STAGING = False  # transaction in progress, button presses don't transmit
+        self._FRAMES_SENT = 0
+        self._STAGED = False   # a transmission was deferred by the transaction
+        self._ROLLBACK = None
         self._DATA_FIELDS = [
             195,   # 00 Device ID 0
             0,     # 01 Temperature value from 64 to 192 (step=8) +7 if SWING=off
@@ -178,6 +189,14 @@ class VestelACRemote():
     def max_temp(self):
         return self._MAX_TEMP
 
+    @property
+    def modes(self) -> tuple:
+        return tuple(self._MODES)
+
+    @property
+    def speeds(self) -> tuple:
+        return tuple(self._SPEEDS)
+
     @property
     def mode(self):
         return self._MODE
@@ -221,6 +240,25 @@ class VestelACRemote():
             self._TIMER = 0.0
             raise ValueError(error)
 
+    @property
+    def state(self) -> dict:
+        # Every setting that has a setter, used for persistence
+        return {
+            'clean': self._CLEAN,
+            'feeling': self._FEELING,
+            'fresh': self._FRESH,
+            'health': self._HEALTH,
+            'mode': self._MODE,
+            'on': self._ON,
+            'screen': self._SCREEN,
+            'sleep': self._SLEEP,
+            'speed': self._SPEED,
+            'strong': self._STRONG,
+            'swing': self._SWING,
+            'temp': self._TEMP,
+            'timer': self._TIMER,
+        }
+
     # Dynamic property
     def timer_step(self, timer: float) -> float:
         if not timer:
@@ -327,8 +365,51 @@ class VestelACRemote():
         self._set_strong_and_timer_frac()
 
     def _send_code(self):
-        self._refresh_data_fields()
-        gpirblast.send_code(self._GPIO_PIN, self._form_bin_str())
+        if self._STAGING:
+            self._STAGED = True
+            return
+        with _TX_LOCK:
+            started = perf_counter()
+            self._refresh_data_fields()
+            gpirblast.send_code(self._GPIO_PIN, self._form_bin_str())
+            IR_SEND_SECONDS.observe(perf_counter() - started)
+            self._FRAMES_SENT += 1
+
+    #################################################
+    # TRANSACTIONS
+    #################################################
+
+    # Every frame carries the full state, so a series of button presses
+    # can be staged and transmitted as a single frame
+
+    @property
+    def staging(self) -> bool:
+        return self._STAGING
+
+    @property
+    def frames_sent(self) -> int:
+        return self._FRAMES_SENT
+
+    def begin(self):
+        self._STAGING = True
+        self._STAGED = False
+        self._ROLLBACK = self.state
+
+    def commit(self) -> bool:
+        self._STAGING = False
+        self._ROLLBACK = None
+        if self._STAGED:
+            self._STAGED = False
+            self._send_code()
+            return True
+        return False
+
+    def rollback(self):
+        for attr, value in self._ROLLBACK.items():
+            setattr(self, attr, value)
+        self._STAGING = False
+        self._STAGED = False
+        self._ROLLBACK = None
 
     #################################################
     # BUTTONS
@@ -344,8 +425,11 @@ class VestelACRemote():
         self._ON = True
         self.btn_on_off()
 
-    def btn_tmp_set(self, value: int) -> bool:
-        # Virtual button
+    def btn_tmp_set(self, value: int, switch_on: bool = True) -> bool:
+        # Virtual button, without switch_on an off unit only keeps the setpoint for when it is switched on
+        if not switch_on and not self._ON:
+            self.temp = int(value)
+            return
         self._DATA_FIELDS[9] = 32
         self._DATA_FIELDS[11] = 5
         self._ON = True
@@ -355,7 +439,7 @@ class VestelACRemote():
         try:
             self.temp = int(value)
         except ValueError:
-            raise ValueError('Temperature value must be within 16 and 32')
+            raise ValueError('Temperature value must be within {} and {}'.format(self._MIN_TEMP, self._MAX_TEMP))
 
         self._send_code()
         # return act_allow
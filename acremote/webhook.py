@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+
+# Standard library imports
+import hmac
+import json
+import queue
+import secrets
+import signal
+import ssl
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+# Project modules
+from acremote import systemd
+from acremote.main import ACRemote
+from acremote.telegram import TelegramError
+
+
+class _WebhookHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, code: int, headers: dict = None):
+        self.send_response(code)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_POST(self):
+        server = self.server
+        if self.path != server.path:
+            return self._reply(404)
+
+        secret = self.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+        if not server.secret_token or not hmac.compare_digest(secret.encode('utf-8'),
+                                                              server.secret_token.encode('utf-8')):
+            return self._reply(403)  # no secret configured: nothing is trusted
+
+        length = int(self.headers.get('Content-Length', 0))
+        if length > server.max_body:
+            self.close_connection = True
+            return self._reply(413)
+        try:
+            update = json.loads(self.rfile.read(length))
+        except ValueError:
+            return self._reply(400)
+
+        if not server.submit(update):
+            return self._reply(503, {'Retry-After': '1'})  # Telegram redelivers later
+        self._reply(200)
+
+
+class WebhookServer(ThreadingHTTPServer):
+    # Accepts Telegram update POSTs and hands them to a fixed pool of workers.
+    # Updates of one chat always land on the same worker to keep their order;
+    # a full worker queue is answered with 503 so Telegram backs off and retries.
+    daemon_threads = True
+
+    def __init__(self, address: tuple, handler: callable, key: callable, path: str = '/',
+                 secret_token: str = None, workers: int = 2, queue_size: int = 32,
+                 ssl_context: ssl.SSLContext = None, max_body: int = 1 << 20):
+        super().__init__(address, _WebhookHandler)
+        if ssl_context:
+            self.socket = ssl_context.wrap_socket(self.socket, server_side=True)
+        self.path = path
+        self.secret_token = secret_token
+        self.max_body = max_body
+        self._HANDLER = handler
+        self._KEY = key
+        self._QUEUES = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._WORKERS = [
+            threading.Thread(target=self._work, args=(worker_queue,), name='acremote-webhook', daemon=True)
+            for worker_queue in self._QUEUES
+        ]
+        for worker in self._WORKERS:
+            worker.start()
+
+    @property
+    def depth(self) -> int:
+        return sum(worker_queue.qsize() for worker_queue in self._QUEUES)
+
+    def submit(self, update: dict) -> bool:
+        try:
+            key = self._KEY(update)
+        except (KeyError, TypeError):
+            return True  # malformed or unsupported, nothing to do
+        if key is None:
+            return True
+        try:
+            self._QUEUES[hash(key) % len(self._QUEUES)].put_nowait(update)
+        except queue.Full:
+            return False
+        return True
+
+    def _work(self, worker_queue: queue.Queue):
+        while True:
+            update = worker_queue.get()
+            if update is None:
+                return
+            try:
+                self._HANDLER(update)
+            except Exception as error:
+                print('update_id={} error={!r}'.format(update.get('update_id'), error),
+                      file=sys.stderr, flush=True)
+
+    def close(self, timeout: float = 5):
+        self.shutdown()
+        self.server_close()
+        for worker_queue in self._QUEUES:
+            worker_queue.put(None)
+        for worker in self._WORKERS:
+            worker.join(timeout)
+
+
+class WebhookACRemote(ACRemote):
+
+    def __init__(self, *args, webhook_url: str, listen: str = '0.0.0.0', port: int = 8443,
+                 secret_token: str = None, certfile: str = None, keyfile: str = None,
+                 workers: int = 2, queue_size: int = 32, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self._WEBHOOK_URL = webhook_url
+
+        self._WEBHOOK_ADDRESS = (listen, port)
+
+        # Telegram sends it with every update, a random one is registered when none is configured
+        self._WEBHOOK_SECRET = secret_token or secrets.token_urlsafe(32)
+
+        self._WEBHOOK_TLS = (certfile, keyfile)
+
+        self._WEBHOOK_WORKERS = workers
+
+        self._WEBHOOK_QUEUE_SIZE = queue_size
+
+        self._WEBHOOK = None
+
+    def _update_chat(self, update):
+        route = self._route_update(update)
+        return route[0] if route else None
+
+    def _handle_update(self, update):
+        # Telegram redelivers updates it could not post, late ones are replayed one at a time
+        if self._is_stale(update):
+            self._replay_backlog([update])
+            return
+        route = self._route_update(update)
+        if route:
+            route[1](route[2])
+
+    def _make_server(self) -> WebhookServer:
+        certfile, keyfile = self._WEBHOOK_TLS
+        ssl_context = None
+        if certfile:
+            ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            ssl_context.load_cert_chain(certfile, keyfile)
+        return WebhookServer(
+            self._WEBHOOK_ADDRESS,
+            handler=self._handle_update,
+            key=self._update_chat,
+            path=urlsplit(self._WEBHOOK_URL).path or '/',
+            secret_token=self._WEBHOOK_SECRET,
+            workers=self._WEBHOOK_WORKERS,
+            queue_size=self._WEBHOOK_QUEUE_SIZE,
+            ssl_context=ssl_context,
+        )
+
+    def _set_webhook(self):
+        self._SESSION.call('setWebhook', {
+            'url': self._WEBHOOK_URL,
+            'secret_token': self._WEBHOOK_SECRET,
+            'max_connections': self._WEBHOOK_WORKERS,
+            'allowed_updates': ['message', 'callback_query'],
+        })
+
+    def _rotate_token(self, bot_token: str):
+        super()._rotate_token(bot_token)
+        if self._WEBHOOK is None:
+            return
+        # Updates for the new bot only arrive once it has the webhook registered
+        try:
+            self._set_webhook()
+        except (OSError, TelegramError) as error:
+            print('setWebhook failed: {!r}'.format(error), file=sys.stderr, flush=True)
+
+    #################################################
+    # USER METHODS
+    #################################################
+
+    def start(self):
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        self._WEBHOOK = self._make_server()
+        self._wait_for_network()
+        try:
+            self._set_webhook()
+        except (OSError, TelegramError) as error:
+            print('setWebhook failed: {!r}'.format(error), file=sys.stderr, flush=True)
+        systemd.notify('READY=1')
+        try:
+            self._WEBHOOK.serve_forever()
+        except KeyboardInterrupt:
+            sys.exit(0)
+        finally:
+            self._WEBHOOK.close()
+            self.shutdown()
@@ -0,0 +1,93 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from acremote.events import EventBus, IRSent, StateChanged
+from acremote.vestel import VestelACRemote
+
+
+class HardwareWorker(threading.Thread):
+    # Owns the VestelACRemote and the IR transmitter, executes button presses one by one.
+    # With an event bus it reports frames sent and state changes (committed ones only
+    # while a transaction is staged) on behalf of `unit`
+
+    def __init__(self, remote: VestelACRemote, name: str = 'acremote-hw', events: EventBus = None, unit: str = None):
+        super().__init__(name=name, daemon=True)
+        self._REMOTE = remote
+        self._EVENTS = events
+        self._UNIT = unit
+        self._PUBLISHED = None  # last state published as StateChanged
+        self._QUEUE = queue.Queue()
+        self._LOCK = threading.Lock()
+        self._PENDING = 0
+        self._STATS = {}  # {command:[count, wait_total, run_total, run_max]} (seconds)
+
+    @property
+    def remote(self) -> VestelACRemote:
+        return self._REMOTE
+
+    @property
+    def depth(self) -> int:
+        # Commands waiting in the queue plus the one being transmitted
+        return self._PENDING
+
+    def submit(self, command: str, *args, **kwargs) -> Future:
+        future = Future()
+        with self._LOCK:
+            self._PENDING += 1
+        self._QUEUE.put((future, command, args, kwargs, time.monotonic()))
+        return future
+
+    def stats(self) -> dict:
+        with self._LOCK:
+            return {
+                command: {
+                    'count': count,
+                    'wait_ms': round(wait_total / count * 1000, 1),
+                    'run_ms': round(run_total / count * 1000, 1),
+                    'max_ms': round(run_max * 1000, 1),
+                }
+                for command, (count, wait_total, run_total, run_max) in self._STATS.items()
+            }
+
+    def stop(self, timeout: float = None):
+        self._QUEUE.put(None)
+        self.join(timeout)
+
+    def _record(self, command: str, wait: float, run: float):
+        with self._LOCK:
+            self._PENDING -= 1
+            stats = self._STATS.setdefault(command, [0, 0.0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += wait
+            stats[2] += run
+            stats[3] = max(stats[3], run)
+
+    def _publish(self, frames_sent: int, seconds: float):
+        state = self._REMOTE.state
+        if self._REMOTE.frames_sent != frames_sent:
+            self._EVENTS.publish(IRSent(self._UNIT, state, seconds))
+        if not self._REMOTE.staging and state != self._PUBLISHED:
+            self._PUBLISHED = state
+            self._EVENTS.publish(StateChanged(self._UNIT, state))
+
+    def run(self):
+        self._PUBLISHED = self._REMOTE.state  # loaded before the worker starts
+        while True:
+            item = self._QUEUE.get()
+            if item is None:
+                break
+            future, command, args, kwargs, queued_at = item
+            started_at = time.monotonic()
+            frames_sent = self._REMOTE.frames_sent
+            if future.set_running_or_notify_cancel():
+                try:
+                    result = getattr(self._REMOTE, command)(*args, **kwargs)
+                except Exception as error:
+                    future.set_exception(error)
+                else:
+                    if self._EVENTS:  # before the caller wakes up, so its reads see the events published
+                        self._publish(frames_sent, time.monotonic() - started_at)
+                    future.set_result(result)
+            self._record(command, started_at - queued_at, time.monotonic() - started_at)
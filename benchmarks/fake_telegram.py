@@ -0,0 +1,99 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from acremote.telegram import TelegramSession, jsonable
+
+
+class FakeTelegram(ThreadingHTTPServer):
+    # Local stand-in for the Bot API: serves queued updates and records every other call
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _FakeTelegramHandler)
+        self.updates = []
+        self.calls = []  # [(perf_counter, method, params)]
+        self.called = threading.Event()
+
+    @property
+    def url(self) -> str:
+        return 'http://127.0.0.1:{}'.format(self.server_address[1])
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def handle_error(self, request, client_address):
+        pass  # the bot process is killed mid-request at the end of every run
+
+
+class FakeSession(TelegramSession):
+    # In-process stand-in for TelegramSession: requests are encoded but never leave the process
+
+    def __init__(self, latency: float = 0):
+        super().__init__('bench', api_url='http://127.0.0.1')
+        self.latency = latency
+        self.calls = 0
+
+    def call(self, method: str, params: dict = None):
+        json.dumps(jsonable(params or {}))
+        if self.latency:
+            time.sleep(self.latency)
+        self.calls += 1
+        return {'message_id': self.calls, 'chat': {'id': (params or {}).get('chat_id')}}
+
+
+class _FakeTelegramHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _params(self) -> dict:
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        return json.loads(body or b'{}')
+
+    def do_POST(self):
+        method = self.path.rsplit('/', 1)[-1]
+        params = self._params()
+        if method == 'getUpdates':
+            offset = int(params.get('offset') or 0)
+            result = [update for update in self.server.updates if update['update_id'] >= offset]
+            if not result:
+                time.sleep(0.05)
+        else:
+            self.server.calls.append((time.perf_counter(), method, params))
+            self.server.called.set()
+            result = {'message_id': len(self.server.calls), 'chat': {'id': params.get('chat_id')}}
+        body = json.dumps({'ok': True, 'result': result}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def make_update(update_id: int, user_id: int, text: str) -> dict:
+    entities = []
+    position = text.find('/')
+    while position != -1:
+        end = text.find(' ', position)
+        end = len(text) if end == -1 else end
+        entities.append({'type': 'bot_command', 'offset': position, 'length': end - position})
+        position = text.find('/', end)
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Bench'},
+            'chat': {'id': user_id, 'type': 'private'},
+            'text': text,
+            'entities': entities,
+        },
+    }
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks of the hot paths: IR frame encoding, update dispatch,
+state persistence and sensor reads.
+
+IR transmission and the Bot API are simulated and the 1-Wire sensors are read
+from a fake sysfs tree, so the suite runs on any Linux box. Results are printed
+as JSON; pass --compare with the output of a previous run to flag regressions
+(exit status 1).
+
+Usage: python3 benchmarks/micro.py [--filter SUBSTRING] [--output FILE]
+                                   [--compare FILE] [--threshold 0.2]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'benchmarks'), ROOT]
+
+import gpirblast  # noqa: E402
+
+from acremote.main import ACRemote  # noqa: E402
+from acremote.sender import OutboundSender  # noqa: E402
+from acremote.thermo import W1Thermo  # noqa: E402
+from fake_telegram import FakeSession  # noqa: E402
+
+UPDATES_FILE = os.path.join(ROOT, 'benchmarks', 'updates.json')
+
+
+def simulated_send_code(gpio_pin: int, bin_str: str):
+    pass  # stands in for the pigpio wave transmission
+
+
+def make_sysfs(directory: str, sensors: int = 2) -> str:
+    for index in range(sensors):
+        device = os.path.join(directory, '28-00000{:07x}'.format(index + 1))
+        os.makedirs(device)
+        with open(os.path.join(device, 'w1_slave'), 'w') as file_handle:
+            file_handle.write('72 01 4b 46 7f ff 0e 10 57 : crc=57 YES\n')
+            file_handle.write('72 01 4b 46 7f ff 0e 10 57 t={}\n'.format(23125 + index * 500))
+    return directory
+
+
+def make_remote(directory: str, sysfs: str) -> ACRemote:
+    remote = ACRemote(
+        bot_token='bench',
+        gpio_pin=22,
+        state_file=os.path.join(directory, 'acremote_state.json'),
+        admin_ids=[1],
+        user_ids=[2],
+        easter_eggs={'cake': 'is a lie'},
+    )
+    remote._SENDER.stop(5)
+    remote._SESSION = FakeSession()
+    remote._SENDER = OutboundSender(remote._SESSION, rate=1e9, chat_rate=1e9, chat_burst=1e9)
+    remote._SENDER.start()
+    remote._THERMO._DEV_BASE = remote._AC_HANDLER._THERMO._DEV_BASE = sysfs
+    return remote
+
+
+def load_updates() -> list:
+    with open(UPDATES_FILE) as file_handle:
+        updates = json.load(file_handle)
+    fresh = int(time.time()) + 3600  # older messages are dropped by the handlers
+    for update in updates:
+        msg = update.get('message') or update['callback_query']['message']
+        msg['date'] = fresh
+    return updates
+
+
+def cases(directory: str) -> dict:
+    # {name: (callable, operations per call)}
+    sysfs = make_sysfs(os.path.join(directory, 'w1'))
+    remote = make_remote(directory, sysfs)
+    handler = remote._AC_HANDLER
+    updates = load_updates()
+    routes = [route for route in map(remote._route_update, updates) if route]
+    single = updates[7]['message']    # /mode_cool
+    multi = updates[10]['message']    # /set 22 /mode_cool /speed_auto
+    thermo = W1Thermo()
+    thermo._DEV_BASE = sysfs
+    temps = iter(range(1 << 62))
+
+    def dispatch():
+        for chat_id, route_handler, msg in routes:
+            route_handler(msg)
+
+    def save_changed():
+        handler._TEMP = 16 + next(temps) % 20
+        remote._save_remote_state()
+
+    def save_and_flush():
+        save_changed()
+        remote._AC_STORE.flush()
+
+    return {
+        'vestel.form_bin_str': (handler._form_bin_str, 1),
+        'vestel.refresh_data_fields': (handler._refresh_data_fields, 1),
+        'vestel.send_code': (handler._send_code, 1),
+        'main.process_entities.single': (lambda: remote._process_entities(single), 1),
+        'main.process_entities.multi': (lambda: remote._process_entities(multi), 1),
+        'main.dispatch.recorded': (dispatch, len(routes)),
+        'state.save_unchanged': (remote._save_remote_state, 1),
+        'state.save_changed': (save_changed, 1),
+        'state.save_and_flush': (save_and_flush, 1),
+        'state.load': (remote._load_remote_state, 1),
+        'thermo.poll': (thermo.poll, 1),
+    }, remote
+
+
+def measure(func: callable, operations: int, repeat: int, min_time: float) -> dict:
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    number = max(1, int(number * min_time / 0.2))
+    per_op = sorted(total / number / operations for total in timer.repeat(repeat, number))
+    return {
+        'number': number,
+        'repeat': repeat,
+        'min_ns': round(per_op[0] * 1e9, 1),
+        'median_ns': round(statistics.median(per_op) * 1e9, 1),
+        'max_ns': round(per_op[-1] * 1e9, 1),
+        'ops_per_sec': round(1 / statistics.median(per_op), 1),
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get('results', {}).get(name)
+        if not before:
+            continue
+        ratio = result['median_ns'] / before['median_ns']
+        result['baseline_median_ns'] = before['median_ns']
+        result['ratio'] = round(ratio, 3)
+        if ratio > 1 + threshold:
+            regressions.append(name)
+    return regressions
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, universal_newlines=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--filter', default='', help='only run benchmarks containing this substring')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--min-time', type=float, default=0.2, help='seconds per repeat, roughly')
+    parser.add_argument('--output', help='also write the JSON report to this file')
+    parser.add_argument('--compare', help='JSON report of a previous run')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed slowdown of the median, 0.2 = 20%%')
+    options = parser.parse_args()
+
+    gpirblast.send_code = simulated_send_code
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        # command handlers log every command to stdout, keep it for the report
+        with contextlib.redirect_stdout(io.StringIO()):
+            benchmarks, remote = cases(directory)
+            try:
+                for name, (func, operations) in benchmarks.items():
+                    if options.filter in name:
+                        results[name] = measure(func, operations, options.repeat, options.min_time)
+            finally:
+                remote.shutdown()
+
+    report = {
+        'suite': 'acremote-micro',
+        'timestamp': int(time.time()),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'results': results,
+    }
+    regressions = []
+    if options.compare:
+        with open(options.compare) as file_handle:
+            regressions = compare(results, json.load(file_handle), options.threshold)
+        report['regressions'] = regressions
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if options.output:
+        with open(options.output, 'w') as file_handle:
+            file_handle.write(output + '\n')
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Cold start benchmark.
+
+Spawns the bot against a local fake Bot API with a /help command already waiting
+and reports, in milliseconds from process spawn:
+  - import_ms:        importing acremote.main in a fresh interpreter
+  - ready_ms:         READY=1 received on NOTIFY_SOCKET
+  - first_command_ms: the reply to the waiting command reached the Bot API
+
+Usage: python3 benchmarks/startup.py [--mode asyncio|polling] [--runs N]
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'benchmarks'), ROOT]
+
+from fake_telegram import FakeTelegram, make_update  # noqa: E402
+
+BOOTSTRAP = '''
+import sys
+api_url, mode, state_file = sys.argv[1:4]
+kwargs = dict(bot_token='bench', gpio_pin=22, state_file=state_file,
+              admin_ids=[1], user_ids=[], easter_eggs={}, api_url=api_url)
+if mode == 'asyncio':
+    from acremote.aio import AsyncACRemote
+    server = AsyncACRemote(poll_timeout=0, **kwargs)
+else:
+    from acremote.main import ACRemote
+    server = ACRemote(**kwargs)
+server.start()
+'''
+
+IMPORT = '''
+import time
+started = time.perf_counter()
+import acremote.main
+print((time.perf_counter() - started) * 1000)
+'''
+
+
+def _env(**extra) -> dict:
+    env = dict(os.environ, **extra)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [ROOT, env.get('PYTHONPATH')]))
+    return env
+
+
+def measure_import() -> float:
+    result = subprocess.run([sys.executable, '-c', IMPORT], env=_env(), check=True,
+                            stdout=subprocess.PIPE, universal_newlines=True)
+    return float(result.stdout)
+
+
+def measure_start(mode: str, timeout: float = 30) -> dict:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        notify_path = os.path.join(tmp_dir, 'notify.sock')
+        notify_socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        notify_socket.bind(notify_path)
+        notify_socket.settimeout(timeout)
+        ready = {}
+
+        def wait_ready():
+            try:
+                while b'READY=1' not in notify_socket.recv(4096):
+                    pass
+                ready['at'] = time.perf_counter()
+            except OSError:
+                pass
+
+        telegram = FakeTelegram().start()
+        telegram.updates.append(make_update(1, 1, '/help'))
+        listener = threading.Thread(target=wait_ready, daemon=True)
+        listener.start()
+
+        spawned = time.perf_counter()
+        process = subprocess.Popen(
+            [sys.executable, '-c', BOOTSTRAP, telegram.url, mode, os.path.join(tmp_dir, 'state.json')],
+            env=_env(NOTIFY_SOCKET=notify_path),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            deadline = spawned + timeout
+            replied = None
+            while replied is None and time.perf_counter() < deadline:
+                replied = next((at for at, method, _ in list(telegram.calls) if method == 'sendMessage'), None)
+                time.sleep(0.001)
+            listener.join(max(0, deadline - time.perf_counter()))
+        finally:
+            process.terminate()
+            process.wait(10)
+            telegram.stop()
+            notify_socket.close()
+
+    if replied is None:
+        raise RuntimeError('No reply within {}s'.format(timeout))
+    return {
+        'ready_ms': (ready['at'] - spawned) * 1000 if 'at' in ready else None,
+        'first_command_ms': (replied - spawned) * 1000,
+    }
+
+
+def _summary(values: list) -> dict:
+    values = [value for value in values if value is not None]
+    if not values:
+        return None
+    return {
+        'min': round(min(values), 1),
+        'median': round(statistics.median(values), 1),
+        'max': round(max(values), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', choices=('asyncio', 'polling'), default='asyncio')
+    parser.add_argument('--runs', type=int, default=5)
+    options = parser.parse_args()
+
+    imports = [measure_import() for _ in range(options.runs)]
+    starts = [measure_start(options.mode) for _ in range(options.runs)]
+    print(json.dumps({
+        'benchmark': 'startup',
+        'mode': options.mode,
+        'runs': options.runs,
+        'python': sys.version.split()[0],
+        'import_ms': _summary(imports),
+        'ready_ms': _summary([run['ready_ms'] for run in starts]),
+        'first_command_ms': _summary([run['first_command_ms'] for run in starts]),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -25,7 +25,8 @@ setup(  # TODO fill the form
     ext_modules=[module_gpirblast],
     packages=find_packages(exclude=['tests', 'config_templates']),
     python_requires='>=3.7',
-    install_requires=[
-        'telepot',
-    ],
+    install_requires=[],  # the Bot API client is built in (acremote.telegram)
+    extras_require={
+        'batch': ['numpy'],  # acremote.irbatch
+    },
 )
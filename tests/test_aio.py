@@ -0,0 +1,131 @@
+import asyncio
+import json
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from acremote import aio
+
+
+class FakeTelegram(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeTelegramHandler)
+        self.updates = []
+        self.calls = []
+        self.errors = []  # replies returned instead of the next results
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self.server_address[1])
+
+    def sent(self, method):
+        return [params for name, params in self.calls if name == method]
+
+
+class FakeTelegramHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        method = self.path.rsplit('/', 1)[-1]
+        params = json.loads(self.rfile.read(int(self.headers['Content-Length'])) or b'{}')
+        if method == 'getUpdates':
+            offset = params.get('offset') or 0
+            result = [update for update in self.server.updates if update['update_id'] >= offset]
+            if not result:
+                time.sleep(0.05)
+            reply = {'ok': True, 'result': result}
+        elif method == 'fail':
+            reply = {'ok': False, 'error_code': 400, 'description': 'Bad Request'}
+        elif self.server.errors:
+            reply = self.server.errors.pop(0)
+        else:
+            self.server.calls.append((method, params))
+            reply = {'ok': True, 'result': {'message_id': len(self.server.calls), 'chat': {'id': params.get('chat_id')}}}
+        body = json.dumps(reply).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def make_update(update_id, user_id, text):
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Test'},
+            'chat': {'id': user_id, 'type': 'private'},
+            'text': text,
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}],
+        },
+    }
+
+
+class TestAsyncBot(unittest.TestCase):
+    def setUp(self):
+        self._server = FakeTelegram()
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def test_keep_alive_requests(self):
+        async def scenario():
+            bot = aio.AsyncBot('token', api_url=self._server.url)
+            await bot._request('sendMessage', {'chat_id': 1, 'text': 'first'})
+            await bot._request('sendMessage', {'chat_id': 1, 'text': 'second'})
+            idle = len(bot._IDLE)
+            await bot.close()
+            return idle
+
+        self.assertEqual(asyncio.run(scenario()), 1)
+        self.assertEqual([p['text'] for p in self._server.sent('sendMessage')], ['first', 'second'])
+
+    def test_api_error(self):
+        async def scenario():
+            bot = aio.AsyncBot('token', api_url=self._server.url)
+            try:
+                await bot._request('fail')
+            finally:
+                await bot.close()
+
+        with self.assertRaises(aio.TelegramError):
+            asyncio.run(scenario())
+
+    def test_remote_serves_many_chats(self):
+        """
+        Updates from different chats are routed through the regular command handlers
+        """
+        self._server.updates = [make_update(10, 1, '/timer_get'), make_update(11, 2, '/help')]
+        remote = aio.AsyncACRemote(
+            bot_token='token', gpio_pin=22, state_file='/nonexistent/acremote_state.json',
+            admin_ids=[1], user_ids=[2], easter_eggs={},
+            api_url=self._server.url, poll_timeout=0,
+        )
+        remote._save_remote_state = lambda: None
+
+        async def scenario():
+            task = asyncio.ensure_future(remote.run())
+            for _ in range(100):
+                if len(self._server.sent('sendMessage')) >= 2:
+                    break
+                await asyncio.sleep(0.02)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+        asyncio.run(scenario())
+        self.assertEqual(sorted(p['chat_id'] for p in self._server.sent('sendMessage')), [1, 2])
+        self.assertEqual(len(remote._CHAT_LOCKS), 0)  # idle chats keep no lock
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import http.client
+import json
+import time
+
+from tests.test_main import ACRemoteTestCase
+
+TOKEN = 'user-token-0123456789'
+
+
+class TestLocalAPI(ACRemoteTestCase):
+    def make_remote(self, **kwargs):
+        api = {'listen': '127.0.0.1', 'port': 0, 'tokens': {TOKEN: 2, 'admin-token-0123456789': 7}}
+        return super().make_remote(api=api, **kwargs)
+
+    def setUp(self):
+        super().setUp()
+        self.connection = http.client.HTTPConnection(*self.remote._API.server_address, timeout=5)
+        self.addCleanup(self.connection.close)
+
+    def request(self, method, path, body=None, token=TOKEN):
+        headers = {'Authorization': 'Bearer ' + token} if token else {}
+        if body is not None:
+            body = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        self.connection.request(method, path, body, headers)
+        response = self.connection.getresponse()
+        return response.status, json.loads(response.read())
+
+    def test_get_and_patch_on_one_connection(self):
+        status, body = self.request('GET', '/state')
+        self.assertEqual(status, 200)
+        self.assertEqual(body['units'][0]['unit'], 'ac')
+        sock = self.connection.sock
+
+        status, body = self.request('PATCH', '/state/ac', {'on': True, 'mode': 'cool', 'temp': 22, 'swing': False})
+        self.assertEqual(status, 200)
+        self.assertEqual(self.send_code.call_count, 1)
+        self.assertEqual((body['on'], body['mode'], body['temp'], body['swing']), (True, 'COOL', 22, False))
+        self.assertEqual(body['messages'], ['Turning on the AC'])
+        self.assertIs(self.connection.sock, sock)  # keep-alive
+        self.assertEqual(self.session.sendMessage.call_count, 0)
+
+        self.remote._AC_STORE.flush()
+        with open(self.remote._AC_STORE._PATH) as file_handle:
+            self.assertEqual(json.load(file_handle)['temp'], 22)
+
+    def test_cooldown(self):
+        self.remote._AC_HANDLER.on = True
+        self.remote._AC_START_TIME = int(time.time())
+        status, body = self.request('PATCH', '/state', {'on': False, 'temp': 20})
+        self.assertEqual(status, 409)
+        self.assertRegex(body['error'], r'^AC is starting, please wait \d+s$')
+        self.assertEqual(self.send_code.call_count, 0)
+
+    def test_temp_keeps_an_off_unit_off(self):
+        self.remote._AC_STOP_TIME = int(time.time())  # just switched off, still shutting down
+        for changes in ({'temp': 22}, {'on': False, 'temp': 23}):
+            status, body = self.request('PATCH', '/state', changes)
+            self.assertEqual(status, 200)
+            self.assertEqual((body['on'], body['temp']), (False, changes['temp']))
+        self.assertEqual(self.send_code.call_count, 0)
+        self.assertEqual(self.request('PATCH', '/state', {'on': True, 'temp': 24})[0], 409)
+
+        self.remote._AC_STOP_TIME = 0
+        status, body = self.request('PATCH', '/state', {'on': True})
+        self.assertEqual((status, body['on'], body['temp']), (200, True, 23))
+        self.assertGreater(self.remote._AC_START_TIME, 0)
+
+    def test_rejected(self):
+        self.assertEqual(self.request('GET', '/state', token=None)[0], 401)
+        self.assertEqual(self.request('GET', '/state', token='admin-token-0123456789')[0], 401)  # not a bot user
+        self.assertEqual(self.request('GET', '/state/bedroom')[0], 404)
+        status, body = self.request('PATCH', '/state', {'temp': 40})
+        self.assertEqual(status, 400)
+        self.assertRegex(body['error'], r'^temp must be within 16 and \d+$')
+        self.assertEqual(self.request('PATCH', '/state', {'colour': 'red'})[0], 400)
+        self.assertEqual(self.send_code.call_count, 0)
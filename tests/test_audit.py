@@ -0,0 +1,43 @@
+import os
+import tempfile
+import time
+import unittest
+
+from acremote import audit
+
+
+class TestAuditLog(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._dir.cleanup)
+        self._db_file = os.path.join(self._dir.name, 'audit.sqlite3')
+
+    def test_record_and_query(self):
+        log = audit.AuditLog(self._db_file)
+        log.start()
+        log.record(1, 'alice', '/on', [], 0.15, 'ok', {'on': True})
+        log.record(2, 'bob', '/off', [], 0.14, 'ok', {'on': False})
+        log.record(1, 'alice', '/set', ['22'], 0.16, 'ok', {'on': True, 'temp': 22})
+        log.close(5)
+
+        records = log.query(command='/off')
+        self.assertEqual([(r['username'], r['state']) for r in records], [('bob', {'on': False})])
+        self.assertEqual(len(log.query(user='@alice')), 2)
+        self.assertEqual(log.query(user='1')[0]['args'], ['22'])
+        self.assertEqual(log.query(since=time.time() + 60), [])
+
+    def test_retention_pruning(self):
+        log = audit.AuditLog(self._db_file, retention_days=1)
+        log.start()
+        log._QUEUE.put((time.time() - 2 * 86400, 1, 'alice', '/on', [], 0.1, 'ok', {}))
+        log.record(1, 'alice', '/off', [], 0.1, 'ok', {})
+        log.close(5)
+
+        log = audit.AuditLog(self._db_file, retention_days=1)
+        log.start()  # prunes on startup
+        log.close(5)
+        self.assertEqual([r['command'] for r in log.query()], ['/off'])
+
+
+if __name__ == '__main__':
+    unittest.main()
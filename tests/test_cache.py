@@ -0,0 +1,81 @@
+import time
+import unittest
+
+from acremote import cache
+from tests.test_main import ACRemoteTestCase, make_message
+
+
+class TestExpiringCache(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.cache = cache.ExpiringCache(ttl=10, max_size=3, clock=lambda: self.now)
+
+    def test_ttl(self):
+        self.cache['a'] = 1
+        self.cache.set('b', 2, ttl=30)
+        self.now += 10
+        self.assertNotIn('a', self.cache)
+        self.assertEqual(self.cache['b'], 2)
+        with self.assertRaises(KeyError):
+            self.cache['a']
+        self.assertEqual(self.cache.sweep(), [('a', 1)])  # dropped lazily, handed out once
+        self.assertEqual(self.cache.sweep(), [])
+
+    def test_max_size(self):
+        for key in 'abcd':
+            self.cache[key] = key.upper()
+        self.assertEqual(len(self.cache), 3)
+        self.assertNotIn('a', self.cache)
+        self.assertEqual(self.cache.sweep(), [('a', 'A')])
+
+    def test_sweep(self):
+        self.cache['a'] = 1
+        self.cache['b'] = 2
+        self.cache['a'] = 3  # replaced values are handed out too
+        self.now += 11
+        self.assertEqual(sorted(self.cache.sweep()), [('a', 1), ('a', 3), ('b', 2)])
+        self.assertEqual(len(self.cache), 0)
+
+
+class TestConfirmationExpiry(ACRemoteTestCase):
+    def expire(self):
+        for entries in (self.remote._CONFIRM_CMDS, self.remote._SENT_MSG_ID):
+            entries._CLOCK = lambda: float('inf')
+
+    def test_prompts_deleted_in_batches(self):
+        self.session.sendMessage.side_effect = [
+            {'message_id': message_id, 'chat': {'id': chat_id}} for message_id, chat_id in [(10, 1), (11, 2)]
+        ]
+        self.remote._on_chat_message(make_message(1, '/test'))
+        self.remote._on_chat_message(make_message(2, '/test'))
+        self.expire()
+        self.remote._sweep_caches()
+        self.remote._SENDER.drain(5)
+        self.assertEqual(self.session.deleteMessages.call_args_list, [((1, [10]),), ((2, [11]),)])
+        self.assertEqual(len(self.remote._CONFIRM_CMDS), 0)
+        self.session.deleteMessage.assert_not_called()
+
+    def test_late_answer_within_ttl(self):
+        """
+        A prompt can be answered until its TTL is up, the answered prompt is deleted in the background
+        """
+        self.session.sendMessage.return_value = {'message_id': 10, 'chat': {'id': 2}}
+        self.remote._on_chat_message(make_message(2, '/test'))
+        self.remote._on_callback_query({
+            'id': '1',
+            'data': 'confirm:1',
+            'from': {'id': 2},
+            'message': {'date': int(time.time()) - 60, 'chat': {'id': 2}},
+        })
+        self.assertTrue(self.replies(2)[-1].startswith('Passed'))
+        self.session.deleteMessage.assert_called_once_with((2, 10))
+
+    def test_expired_confirmation(self):
+        self.remote._on_chat_message(make_message(2, '/test'))
+        self.expire()
+        self.remote.ilkb_confirm(2, '1')
+        self.assertEqual(self.replies(2)[-1], 'This confirmation has expired, please send the command again')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import json
+import os
+import unittest
+
+from acremote import main
+from tests.test_main import ACRemoteTestCase, make_message
+
+
+def make_config(**overrides):
+    config = {
+        'bot_token': 'token',
+        'gpio_pin': 22,
+        'state_file': '/var/tmp/acremote_state.json',
+        'admin_ids': [1],
+        'user_ids': [2],
+        'easter_eggs': {},
+    }
+    config.update(overrides)
+    return config
+
+
+class TestValidate(unittest.TestCase):
+    def test_valid(self):
+        main._ConfigHandler.validate(make_config())
+
+    def test_lists_every_problem(self):
+        with self.assertRaises(ValueError) as context:
+            main._ConfigHandler.validate(make_config(bot_token='', user_ids=['2'], mode='push'))
+        message = str(context.exception)
+        for key in ('bot_token', 'user_ids', 'mode'):
+            self.assertIn(key, message)
+
+    def test_units(self):
+        units = [{'name': 'living', 'gpio_pin': 22, 'state_file': 'living.json'},
+                 {'name': 'living', 'gpio_pin': '23', 'state_file': 'bedroom.json'}]
+        with self.assertRaises(ValueError) as context:
+            main._ConfigHandler.validate(make_config(gpio_pin=None, state_file=None, units=units))
+        self.assertEqual(str(context.exception), 'gpio_pin of living must be an integer; unit names must be unique')
+
+
+    def test_api(self):
+        main._ConfigHandler.validate(make_config(api={'port': 8080, 'tokens': {'0123456789abcdef': 2}}))
+        with self.assertRaises(ValueError) as context:
+            main._ConfigHandler.validate(make_config(api={'port': 8080, 'tokens': {'short': 2}}))
+        self.assertEqual(str(context.exception), 'api tokens must map strings of 16+ characters to user IDs')
+
+    def test_mqtt(self):
+        main._ConfigHandler.validate(make_config(mqtt={'host': 'broker.lan', 'user_id': 2}))
+        with self.assertRaises(ValueError) as context:
+            main._ConfigHandler.validate(make_config(mqtt={'host': 'broker.lan'}))
+        self.assertEqual(str(context.exception), 'mqtt must be an object with a host and the user_id commands run as')
+
+
+    def test_webhook_needs_a_secret(self):
+        hook = {'webhook_url': 'https://example.com/hook', 'secret_token': 'Abc_0123456789-xyz'}
+        main._ConfigHandler.validate(make_config(mode='webhook', webhook=hook))
+        invalid = (None, dict(hook, secret_token=''), dict(hook, secret_token='short'), {'secret_token': 'x' * 16})
+        for webhook in invalid:
+            with self.assertRaises(ValueError) as context:
+                main._ConfigHandler.validate(make_config(mode='webhook', webhook=webhook))
+            self.assertIn('webhook', str(context.exception))
+        main._ConfigHandler.validate(make_config(webhook=dict(hook, secret_token='')))  # polling, not used
+
+
+class TestReload(ACRemoteTestCase):
+    def setUp(self):
+        super().setUp()
+        self.path = os.path.join(self._dir.name, 'acremote.json')
+        self.write(make_config())
+        handler = main._ConfigHandler(self.path)
+        self.remote.watch_config(handler, handler.read_config())
+
+    def write(self, config):
+        with open(self.path, 'w') as file_handle:
+            json.dump(config, file_handle)
+
+    def test_reload_users(self):
+        self.write(make_config(user_ids=[3], easter_eggs={'cake': 'is a lie'}))
+        self.assertTrue(self.remote.reload_config())
+        self.assertIsInstance(self.remote._ALLOWED_IDS, frozenset)
+        self.assertEqual(self.remote._ALLOWED_IDS, {1, 3})
+        self.remote._on_chat_message(make_message(3, 'cake'))
+        self.assertEqual(self.replies(3), ['is a lie'])
+
+    def test_rotate_token(self):
+        self.write(make_config(bot_token='rotated'))
+        self.assertTrue(self.remote.reload_config())
+        self.session.set_token.assert_called_once_with('rotated')
+
+    def test_invalid_config_kept(self):
+        self.write(make_config(admin_ids=None, user_ids=[3]))
+        self.assertFalse(self.remote.reload_config())
+        with open(self.path, 'w') as file_handle:
+            file_handle.write('{"bot_token": ')
+        self.assertFalse(self.remote.reload_config())
+        self.assertEqual(self.remote._ADMIN_IDS, {1})
+        self.assertEqual(self.remote._ALLOWED_IDS, {1, 2})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import io
+import random
+import sys
+import types
+import unittest
+from unittest import mock
+
+from acremote import gpirdecode
+from acremote.vestel import VestelACRemote
+
+
+def vestel_frame() -> tuple:
+    remote = VestelACRemote(22)
+    remote._refresh_data_fields()
+    octets = list(remote._DATA_FIELDS) + [sum(remote._DATA_FIELDS) & 0xFF]
+    return remote._form_bin_str(), octets
+
+
+def fake_pigpio():
+    callbacks = []
+    pi = mock.Mock(connected=True)
+    pi.callback.side_effect = lambda gpio, edge, func: callbacks.append(func) or mock.Mock()
+    module = types.SimpleNamespace(
+        INPUT=0,
+        EITHER_EDGE=2,
+        TIMEOUT=2,
+        pi=lambda host: pi,
+        tickDiff=lambda t1, t2: (t2 - t1) & 0xFFFFFFFF,
+    )
+    return module, callbacks
+
+
+class TestDecode(unittest.TestCase):
+    def test_vestel_frame(self):
+        bits, octets = vestel_frame()
+        frame = gpirdecode.decode(gpirdecode.nec_pulses(bits))
+        self.assertEqual(frame['octets'], octets)
+        self.assertTrue(frame['checksum_ok'])
+
+    def test_jitter(self):
+        bits, octets = vestel_frame()
+        jitter = random.Random(1)
+        pulses = [(level, duration + jitter.randint(-150, 150)) for level, duration in gpirdecode.nec_pulses(bits)]
+        self.assertEqual(gpirdecode.decode(iter(pulses))['octets'], octets)
+
+    def test_invalid(self):
+        with self.assertRaises(gpirdecode.DecodeError):
+            gpirdecode.decode([(0, 9000)])
+        with self.assertRaises(gpirdecode.DecodeError):
+            gpirdecode.decode(gpirdecode.nec_pulses('0101'))
+
+
+class TestReplay(unittest.TestCase):
+    def test_round_trip(self):
+        bits, _ = vestel_frame()
+        frames = [gpirdecode.nec_pulses(bits), [(0, 1200000), (1, 70000), (0, 5)]]
+        file_handle = io.BytesIO()
+        self.assertEqual(gpirdecode.write_replay(file_handle, frames), 2)
+        self.assertLess(len(file_handle.getvalue()), 2.5 * len(frames[0]))
+        file_handle.seek(0)
+        self.assertEqual(list(gpirdecode.read_replay(file_handle)), frames)
+
+    def test_not_a_replay(self):
+        with self.assertRaises(gpirdecode.DecodeError):
+            list(gpirdecode.read_replay(io.BytesIO(b'{"pulses": []}')))
+
+
+class TestEdgeCapture(unittest.TestCase):
+    def test_frames_from_edges(self):
+        """
+        Pulse lengths come from the edge ticks, also across the 32 bit tick wrap-around
+        """
+        pigpio, callbacks = fake_pigpio()
+        with mock.patch.dict(sys.modules, pigpio=pigpio):
+            capture = gpirdecode.EdgeCapture(23)
+        bits, octets = vestel_frame()
+        tick = 0xFFFFFFFF - 20000
+        level = 1
+        for _, duration in gpirdecode.nec_pulses(bits) + [(1, 0)]:
+            level ^= 1
+            callbacks[0](23, level, tick & 0xFFFFFFFF)
+            tick += duration
+        callbacks[0](23, pigpio.TIMEOUT, tick)
+        capture.close()
+        frames = list(capture.frames())
+        self.assertEqual(len(frames), 1)
+        self.assertEqual(frames[0], gpirdecode.nec_pulses(bits))
+        self.assertEqual(gpirdecode.decode(frames[0])['octets'], octets)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import io
+import random
+import unittest
+
+from acremote import gpirdecode
+from tests.test_gpirdecode import vestel_frame
+
+try:
+    from acremote import irbatch
+except ImportError:  # numpy is optional
+    irbatch = None
+
+
+def corpus(frames: int) -> list:
+    bits, _ = vestel_frame()
+    jitter = random.Random(2)
+    pulses = []
+    for index in range(frames):
+        frame = [(level, duration + jitter.randint(-150, 150)) for level, duration in gpirdecode.nec_pulses(bits)]
+        if index % 5 == 1:
+            frame[-4] = (frame[-4][0], 2200 - frame[-4][1])  # flip a checksum bit
+        elif index % 5 == 2:
+            frame = frame[:40]  # cut off
+        elif index % 5 == 3:
+            frame[1] = (1, 900)  # no NEC leader
+        pulses.append(frame)
+    return pulses + [[], [(0, 9000)]]
+
+
+@unittest.skipIf(irbatch is None, 'numpy is not installed')
+class TestDecodeBatch(unittest.TestCase):
+    def test_matches_single_decoder(self):
+        frames = corpus(50)
+        result = irbatch.decode_batch(frames)
+        for index, pulses in enumerate(frames):
+            try:
+                frame = gpirdecode.decode(pulses)
+            except gpirdecode.DecodeError:
+                self.assertFalse(result['valid'][index], index)
+                continue
+            self.assertTrue(result['valid'][index], index)
+            self.assertEqual(irbatch.frame_octets(result, index), frame['octets'])
+            self.assertEqual(bool(result['checksum_ok'][index]), frame['checksum_ok'])
+        self.assertEqual(int(result['checksum_ok'].sum()), 20)
+
+    def test_load_replay(self):
+        frames = corpus(10)
+        file_handle = io.BytesIO()
+        gpirdecode.write_replay(file_handle, frames + [[(0, 1200000), (1, 70000)]])
+        file_handle.seek(0)
+        loaded = irbatch.load_replay(file_handle)
+        expected = irbatch.to_arrays([pulses for pulses in frames if pulses] + [[(0, 1200000), (1, 70000)]])
+        for array, expected_array in zip(loaded, expected):
+            self.assertEqual(array.tolist(), expected_array.tolist())
+
+    def test_empty(self):
+        result = irbatch.decode_batch([])
+        self.assertEqual(len(result['valid']), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
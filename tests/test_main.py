@@ -0,0 +1,435 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from acremote import main
+
+
+def make_message(user_id, text):
+    entities = []
+    position = text.find('/')
+    while position != -1:
+        end = text.find(' ', position)
+        end = len(text) if end == -1 else end
+        entities.append({'type': 'bot_command', 'offset': position, 'length': end - position})
+        position = text.find('/', end)
+    return {
+        'message_id': 1,
+        'date': int(time.time()),
+        'from': {'id': user_id, 'is_bot': False, 'first_name': 'Test'},
+        'chat': {'id': user_id, 'type': 'private'},
+        'text': text,
+        'entities': entities,
+    }
+
+
+class ACRemoteTestCase(unittest.TestCase):
+    remote_class = main.ACRemote
+
+    def setUp(self):
+        patcher = mock.patch('gpirblast.send_code', create=True)
+        self.send_code = patcher.start()
+        self.addCleanup(patcher.stop)
+        self._dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._dir.cleanup)
+        self.remote = self.make_remote()
+        self.addCleanup(self.remote.shutdown)
+        self.session = self.remote._SENDER._SESSION = self.remote._SESSION = mock.Mock()
+        self.session.sendMessage.return_value = {'message_id': 1, 'chat': {'id': 0}}
+
+    def make_remote(self, **kwargs):
+        return self.remote_class(
+            bot_token='token',
+            gpio_pin=22,
+            state_file=os.path.join(self._dir.name, 'acremote_state.json'),
+            admin_ids=[1],
+            user_ids=[2],
+            easter_eggs={},
+            **kwargs
+        )
+
+    def replies(self, chat_id=None):
+        self.remote._SENDER.drain(5)
+        return [
+            args[1] for args, kwargs in self.session.sendMessage.call_args_list
+            if chat_id is None or args[0] == chat_id
+        ]
+
+
+class TestACRemote(ACRemoteTestCase):
+    def test_single_command(self):
+        self.remote._AC_HANDLER.on = True
+        self.remote._on_chat_message(make_message(2, '/mode_heat'))
+        self.assertEqual(self.send_code.call_count, 1)
+        self.assertEqual(self.replies(2), ['AC mode: <b>HEAT</b>'])
+
+    def test_multi_command_transaction(self):
+        """
+        All state changes of one message are sent as a single IR frame with a combined reply
+        """
+        self.remote._on_chat_message(make_message(2, '/set 22 /mode_cool /speed_low /swing'))
+        self.assertEqual(self.send_code.call_count, 1)
+        handler = self.remote._AC_HANDLER
+        self.assertEqual((handler.on, handler.temp, handler.mode, handler.speed, handler.swing),
+                         (True, 22, 'COOL', 'LOW', False))
+        self.assertEqual(len(self.replies(2)), 1)
+        self.assertEqual(self.replies(2)[0].count('\n'), 3)
+
+    def test_unknown_command_in_transaction(self):
+        self.remote._on_chat_message(make_message(2, '/set 20 /bogus'))
+        self.assertEqual(self.send_code.call_count, 1)
+        self.assertIn('Unknown command &quot;/bogus&quot;', self.replies(2)[0])
+
+
+class TestPowerCooldown(ACRemoteTestCase):
+    def start_cooldown(self):
+        self.remote._AC_HANDLER.on = True
+        self.remote._AC_COOLDOWN = 0
+        self.remote._AC_START_TIME = int(time.time())  # just switched on, 1s to go
+
+    def test_refused(self):
+        self.start_cooldown()
+        self.remote._ac_cmd(2, 'btn_off')
+        self.assertEqual(self.send_code.call_count, 0)
+        self.assertRegex(self.replies(2)[0], r'AC is starting, please wait \ds')
+
+    def test_deferred(self):
+        """
+        The latest power command requested during the cooldown runs when it ends
+        """
+        self.remote = self.make_remote(defer_power=True)
+        self.addCleanup(self.remote.shutdown)
+        self.session = self.remote._SENDER._SESSION = self.remote._SESSION = mock.Mock()
+        self.start_cooldown()
+        self.remote._ac_cmd(2, 'btn_on')
+        self.remote._ac_cmd(1, 'btn_off')
+        self.assertEqual(self.send_code.call_count, 0)
+        for _ in range(300):
+            if self.send_code.call_count:
+                break
+            time.sleep(0.01)
+        self.assertEqual(self.send_code.call_count, 1)
+        self.assertFalse(self.remote._AC_HANDLER.on)
+        self.assertGreater(self.remote._AC_STOP_TIME, 0)
+        self.assertTrue('\n'.join(self.replies(2)).endswith('Your queued power command was replaced by a newer one'))
+        self.assertRegex('\n'.join(self.replies(1)), r'^AC is starting, turning it off in \ds\nTurning off the AC$')
+
+
+class TestAdmission(ACRemoteTestCase):
+    def test_flood_does_not_block_power(self):
+        """
+        Tweaks beyond the burst are refused without a transmission, /off still gets through
+        """
+        self.remote._AC_HANDLER.on = True
+        for _ in range(8):
+            self.remote._on_chat_message(make_message(2, '/temp_up'))
+        self.assertEqual(self.send_code.call_count, 5)
+        self.assertEqual('\n'.join(self.replies(2)).count('Too many commands, ignored /temp_up. Try again in'), 3)
+        self.remote._on_chat_message(make_message(2, '/off /temp_up'))
+        self.assertRegex('\n'.join(self.replies(2)), r'ignored /temp_up\. Try again in \ds\nAre you sure\?$')
+        self.remote._on_chat_message(make_message(1, '/temp_up'))
+        self.assertEqual(self.send_code.call_count, 6)
+
+    def test_menus_are_free(self):
+        self.remote._AC_HANDLER.on = True
+        for text in ('/help', '/timer_get', '/main', '/speed', '/nonsense') * 3 + ('/panel',):
+            self.remote._on_chat_message(make_message(2, text))
+        self.assertNotIn('Too many commands', '\n'.join(self.replies(2)))
+        for _ in range(5):
+            self.remote._on_chat_message(make_message(2, '/temp_up'))
+        self.assertEqual(self.send_code.call_count, 5)
+
+    def test_power_goes_first(self):
+        lock = self.remote._AC_TXN_LOCK
+        order = []
+
+        def press(urgent, name):
+            with lock.urgent() if urgent else lock:
+                order.append(name)
+
+        lock.acquire()
+        threads = [threading.Thread(target=press, args=(False, 'tweak'))]
+        threads[0].start()
+        time.sleep(0.05)
+        threads.append(threading.Thread(target=press, args=(True, 'power')))
+        threads[1].start()
+        time.sleep(0.05)
+        lock.release()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(order, ['power', 'tweak'])
+
+
+class TestAudit(ACRemoteTestCase):
+    def make_remote(self, **kwargs):
+        return super().make_remote(audit_db=os.path.join(self._dir.name, 'audit.sqlite3'), **kwargs)
+
+    def answer(self, value):
+        self.remote._on_callback_query({
+            'id': '1',
+            'data': 'confirm:' + value,
+            'from': {'id': 2, 'username': 'bob'},
+            'message': {'date': int(time.time()), 'chat': {'id': 2}},
+        })
+
+    def test_confirmed_command(self):
+        """
+        The prompt and the answer are separate records, the answer carries the resulting state
+        """
+        self.remote._AC_HANDLER.on = True
+        self.remote._on_chat_message(make_message(2, '/off'))
+        self.answer('1')
+        self.remote._AC_HANDLER.on = True
+        self.remote._on_chat_message(make_message(2, '/off'))
+        self.answer('0')
+        self.remote._AUDIT.close(5)
+        records = self.remote._AUDIT.query(command='/off')
+        self.assertEqual([(record['outcome'], record['state']['on']) for record in reversed(records)],
+                         [('prompted', True), ('confirmed', False), ('prompted', True), ('declined', True)])
+
+
+class TestCommandLog(ACRemoteTestCase):
+    def test_slow_stdout_does_not_block(self):
+        release = threading.Event()
+        lines = []
+
+        class SlowStream():
+            def write(self, text):
+                release.wait(5)
+                lines.append(text)
+
+            def flush(self):
+                pass
+
+        self.remote._CMD_LOG_LISTENER.handlers[0].setStream(SlowStream())
+        started = time.monotonic()
+        for _ in range(3):
+            self.remote._on_chat_message(make_message(2, '/timer_get'))
+        self.assertLess(time.monotonic() - started, 2)
+        release.set()
+        self.remote.shutdown()
+        self.assertEqual(len(lines), 3)
+        self.assertRegex(lines[0], r'^user_id=2 .* command=/timer_get latency=\d\.\d{3}s outcome=ok\n$')
+
+
+class TestBacklog(ACRemoteTestCase):
+    def late_update(self, update_id, user_id, text):
+        msg = make_message(user_id, text)
+        msg['date'] -= 600
+        return {'update_id': update_id, 'message': msg}
+
+    def test_coalesced(self):
+        """
+        Messages sent while offline end up as one IR frame and one summary, power asks first
+        """
+        self.remote._AC_HANDLER.on = True
+        self.remote._dispatch_updates([
+            self.late_update(10, 2, '/mode_heat'),
+            self.late_update(11, 2, '/set 24 /speed_low'),
+            self.late_update(12, 2, '/off'),
+            self.late_update(13, 2, '/get_stat'),
+            self.late_update(14, 3, '/mode_cool'),
+        ])
+        self.assertEqual(self.send_code.call_count, 1)
+        handler = self.remote._AC_HANDLER
+        self.assertEqual((handler.on, handler.mode, handler.temp, handler.speed), (True, 'HEAT', 24, 'LOW'))
+        replies = self.replies(2)
+        self.assertEqual(len(replies), 2)
+        self.assertEqual(replies[0], '4 message(s) arrived late, applying them now\nNot repeated: /get_stat\n'
+                                     'AC mode: <b>HEAT</b>\nAC temperature: <b>24°C</b>\nAC speed: <b>LOW</b>')
+        self.assertEqual(replies[1], 'Are you sure?')
+        self.assertEqual(self.replies(3), [])
+
+    def test_backlog_admitted(self):
+        """
+        A backlog replayed after a restart goes through the same admission as live messages
+        """
+        self.remote._AC_HANDLER.on = True
+        for _ in range(5):
+            self.remote._on_chat_message(make_message(2, '/temp_up'))
+        self.remote._dispatch_updates([self.late_update(10, 2, '/set 24'), self.late_update(11, 2, '/off')])
+        self.assertEqual(self.send_code.call_count, 5)
+        self.assertNotEqual(self.remote._AC_HANDLER.temp, 24)
+        replies = self.replies(2)
+        self.assertRegex(replies[-2], r'ignored /set\. Try again in \ds$')
+        self.assertEqual(replies[-1], 'Are you sure?')
+
+    def test_offset_persisted(self):
+        path = os.path.join(self._dir.name, 'offset.json')
+        self.remote = self.make_remote(offset_file=path)
+        self.remote._SESSION = mock.Mock()
+        self.remote._SESSION.getUpdates.return_value = [self.late_update(41, 3, '/on')]
+        self.remote._fetch_updates()
+        with open(path) as file_handle:  # already on disk, a crash now does not replay the /on
+            self.assertEqual(json.load(file_handle), {'offset': 42})
+        self.remote.shutdown()
+
+        restarted = self.make_remote(offset_file=path)
+        self.addCleanup(restarted.shutdown)
+        restarted._SESSION = mock.Mock()
+        restarted._SESSION.getUpdates.return_value = []
+        restarted._load_offset()
+        restarted._fetch_updates()
+        self.assertEqual(restarted._SESSION.getUpdates.call_args[1]['offset'], 42)
+
+
+class TestPanel(ACRemoteTestCase):
+    def press(self, action, age=0):
+        self.remote._on_callback_query({
+            'id': '1',
+            'data': 'panel:' + action,
+            'from': {'id': 2},
+            'message': {'date': int(time.time()) - age, 'chat': {'id': 2}},
+        })
+
+    def wait_for_edits(self, count):
+        for _ in range(300):
+            if self.session.editMessageText.call_count >= count:
+                break
+            time.sleep(0.01)
+        time.sleep(self.remote._PANEL_DELAY * 2)
+        return self.session.editMessageText.call_args_list
+
+    def test_quick_presses_share_one_edit(self):
+        self.remote._PANEL_DELAY = 0.1
+        self.remote._AC_HANDLER.on = True
+        self.remote._on_chat_message(make_message(2, '/panel'))
+        self.assertEqual(self.session.sendMessage.call_count, 1)
+        self.press('temp_down')
+        self.press('temp_down')
+        self.press('mode_heat')
+        edits = self.wait_for_edits(1)
+        self.assertEqual(len(edits), 1)
+        self.assertEqual(self.send_code.call_count, 3)
+        self.assertIn('Mode: <b>HEAT</b>', edits[0][0][1])
+        self.assertIn('Temperature: <b>25°C</b>', edits[0][0][1])
+        self.assertEqual(self.session.sendMessage.call_count, 1)
+
+        self.press('mode_heat')  # nothing to redraw
+        self.assertEqual(len(self.wait_for_edits(2)), 1)
+
+    def test_removed_user_loses_the_panel(self):
+        self.remote._AC_HANDLER.on = True
+        self.remote._on_chat_message(make_message(2, '/panel'))
+        self.remote._ALLOWED_IDS = frozenset({1})  # as after a config reload
+        self.press('temp_up')
+        self.assertEqual(self.send_code.call_count, 0)
+        self.assertEqual(self.remote._AC_HANDLER.temp, 27)
+        self.session.answerCallbackQuery.assert_called_once_with('1', text='You are not allowed to do this',
+                                                                 show_alert=True)
+
+    @mock.patch('subprocess.run')
+    def test_demoted_admin_cannot_confirm(self, run):
+        self.remote._on_chat_message(make_message(1, '/shutdown'))
+        self.remote._ADMIN_IDS = frozenset()
+        self.remote._ALLOWED_IDS = frozenset({1, 2})
+        self.remote._on_callback_query({'id': '1', 'data': 'confirm:1', 'from': {'id': 1},
+                                        'message': {'date': int(time.time()), 'chat': {'id': 1}}})
+        run.assert_not_called()
+        self.assertNotIn('<code>Shutting down</code>', self.replies(1))
+
+    def test_old_panel_still_works(self):
+        """
+        The date of a button press is when the panel was sent, an old panel is not a backlog
+        """
+        self.remote._PANEL_DELAY = 0.1
+        self.remote._AC_HANDLER.on = True
+        self.remote._on_chat_message(make_message(2, '/panel'))
+        self.press('temp_down', age=self.remote._STALE_AGE * 2)
+        self.assertEqual(self.send_code.call_count, 1)
+        self.assertEqual(self.remote._AC_HANDLER.temp, 26)
+        self.assertEqual(len(self.wait_for_edits(1)), 1)
+
+    def test_failed_edit_is_redrawn(self):
+        self.remote._PANEL_DELAY = 0.1
+        self.remote._AC_HANDLER.on = True
+        self.remote._on_chat_message(make_message(2, '/panel'))
+        self.session.editMessageText.side_effect = [ConnectionError('offline'), None]
+        self.press('temp_down')
+        self.wait_for_edits(1)
+        self.press('mode_cool')  # changes nothing, but the panel still shows the old temperature
+        edits = self.wait_for_edits(2)
+        self.assertEqual(len(edits), 2)
+        self.assertIn('Temperature: <b>26°C</b>', edits[-1][0][1])
+
+    def test_power_confirmed_on_the_panel(self):
+        self.remote._PANEL_DELAY = 0.1
+        self.remote._on_chat_message(make_message(2, '/panel'))
+        self.press('power')
+        edits = self.wait_for_edits(1)
+        self.assertEqual(edits[-1][1]['reply_markup']['inline_keyboard'][0][0]['text'], 'Turn on? Yes')
+        self.assertEqual(self.send_code.call_count, 0)
+        self.press('yes')
+        edits = self.wait_for_edits(2)
+        self.assertTrue(self.remote._AC_HANDLER.on)
+        self.assertIn('<i>Turning on the AC</i>', edits[-1][0][1])
+        self.assertEqual(self.session.sendMessage.call_count, 1)
+
+
+class TestUnits(ACRemoteTestCase):
+    def make_remote(self, **kwargs):
+        units = [
+            {'name': name, 'gpio_pin': pin, 'state_file': os.path.join(self._dir.name, name + '.json')}
+            for name, pin in (('living', 22), ('bedroom', 23))
+        ]
+        return super().make_remote(units=units, **kwargs)
+
+    def confirm(self, chat_id):
+        self.remote._on_callback_query({
+            'id': '1',
+            'data': 'confirm:1',
+            'from': {'id': chat_id},
+            'message': {'date': int(time.time()), 'chat': {'id': chat_id}},
+        })
+
+    def test_select_unit(self):
+        living, bedroom = self.remote._UNITS['living'], self.remote._UNITS['bedroom']
+        living.handler.on = bedroom.handler.on = True
+        self.remote._on_chat_message(make_message(2, '/unit bedroom'))
+        self.remote._on_chat_message(make_message(2, '/mode_heat'))
+        self.remote._on_chat_message(make_message(1, '/mode_fan'))
+        self.assertEqual((living.handler.mode, bedroom.handler.mode), ('FAN', 'HEAT'))
+        self.assertEqual(self.send_code.call_args_list[0][0][0], 23)
+        self.remote._on_chat_message(make_message(2, '/unit'))
+        self.assertIn('bedroom ON HEAT 27°C (current)', self.replies(2)[-1])
+
+    def test_all_off(self):
+        """
+        A group command sends one frame per unit and replies once
+        """
+        for unit in self.remote._UNITS.values():
+            unit.handler.on = True
+        self.remote._on_chat_message(make_message(2, '/all off'))
+        self.assertEqual(self.replies(2), ['Are you sure?'])
+        self.confirm(2)
+        self.assertEqual(self.send_code.call_count, 2)
+        self.assertFalse(any(unit.handler.on for unit in self.remote._UNITS.values()))
+        self.assertEqual(self.replies(2)[-1],
+                         '<b>living</b>\nTurning off the AC\n<b>bedroom</b>\nTurning off the AC')
+
+    def test_units_dont_wait_on_each_other(self):
+        locked, release = threading.Event(), threading.Event()
+
+        def hold_living():
+            with self.remote._UNITS['living'].lock:
+                locked.set()
+                release.wait(5)
+
+        holder = threading.Thread(target=hold_living)
+        holder.start()
+        self.addCleanup(holder.join)
+        self.addCleanup(release.set)
+        locked.wait(5)
+        self.remote._UNITS['bedroom'].handler.on = True
+        self.remote._on_chat_message(make_message(2, '/unit bedroom /swing /set 20'))
+        self.assertEqual(self.send_code.call_count, 1)
+        self.assertFalse(self.remote._UNITS['bedroom'].handler.swing)
+        self.assertTrue(self.remote._UNITS['living'].handler.swing)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+import urllib.error
+import urllib.request
+
+from acremote import metrics
+from tests.test_main import ACRemoteTestCase, make_message
+
+
+class TestRegistry(unittest.TestCase):
+    def setUp(self):
+        self.registry = metrics.Registry()
+
+    def test_histogram_buckets(self):
+        histogram = self.registry.histogram('test_seconds', 'Test', buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 3.0):
+            histogram.observe(value)
+        self.assertEqual(histogram.snapshot(), ([2, 1, 1], 3.65))
+        self.assertEqual(self.registry.render(), '\n'.join([
+            '# HELP test_seconds Test',
+            '# TYPE test_seconds histogram',
+            'test_seconds_bucket{le="0.1"} 2',
+            'test_seconds_bucket{le="1.0"} 3',
+            'test_seconds_bucket{le="+Inf"} 4',
+            'test_seconds_sum 3.65',
+            'test_seconds_count 4',
+        ]) + '\n')
+
+    def test_labelled_counter(self):
+        family = self.registry.counter('test_total', 'Test', label='command')
+        family.labels('/on').inc()
+        family.labels('/on').inc(2)
+        family.labels('say "hi"').inc()
+        self.assertIs(self.registry.counter('test_total', 'Test', label='command'), family)
+        self.assertIn('test_total{command="/on"} 3\n', self.registry.render())
+        self.assertIn(r'test_total{command="say \"hi\""} 1', self.registry.render())
+
+    def test_server(self):
+        self.registry.counter('test_total', 'Test').inc()
+        server = metrics.MetricsServer(('127.0.0.1', 0), self.registry)
+        server.start()
+        self.addCleanup(server.close)
+        url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+        with urllib.request.urlopen(url + '/metrics', timeout=5) as response:
+            self.assertTrue(response.headers['Content-Type'].startswith('text/plain; version=0.0.4'))
+            self.assertIn(b'test_total 1\n', response.read())
+        with self.assertRaises(urllib.error.HTTPError):
+            urllib.request.urlopen(url + '/other', timeout=5)
+
+
+class TestInstrumentation(ACRemoteTestCase):
+    def count(self, name, label=None):
+        return sum(metrics.REGISTRY.get(name, label).snapshot()[0])
+
+    def test_command_and_ir_send(self):
+        before = (self.count('acremote_command_seconds', '/mode_heat'),
+                  self.count('acremote_command_seconds', 'unknown'),
+                  self.count('acremote_ir_send_seconds'))
+        self.remote._AC_HANDLER.on = True
+        self.remote._on_chat_message(make_message(2, '/mode_heat /no_such_command'))
+        self.assertEqual((self.count('acremote_command_seconds', '/mode_heat'),
+                          self.count('acremote_command_seconds', 'unknown'),
+                          self.count('acremote_ir_send_seconds')),
+                         (before[0] + 1, before[1] + 1, before[2] + 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+import json
+import socketserver
+import threading
+import time
+import unittest
+from unittest import mock
+
+from acremote import events, mqtt
+from tests.test_main import ACRemoteTestCase, make_message
+
+
+def topic_matches(topic_filter: str, topic: str) -> bool:
+    filter_levels, levels = topic_filter.split('/'), topic.split('/')
+    for index, level in enumerate(filter_levels):
+        if level == '#':
+            return True
+        if index >= len(levels) or level not in ('+', levels[index]):
+            return False
+    return len(filter_levels) == len(levels)
+
+
+class _BrokerHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        broker = self.server
+        self.filters = []
+        try:
+            while True:
+                first_byte, body = mqtt.read_packet(self.request)
+                kind = first_byte & 0xF0
+                if kind == mqtt.CONNECT:
+                    broker.connects.append(body)
+                    self.request.sendall(b'\x20\x02\x00\x00')
+                    with broker.lock:
+                        broker.clients.append(self)
+                elif kind == mqtt.SUBSCRIBE:
+                    topic_filter = mqtt.decode_publish(0, body[2:])[0]
+                    self.filters.append(topic_filter)
+                    self.request.sendall(mqtt.encode_packet(mqtt.SUBACK, body[:2] + b'\0'))
+                elif kind == mqtt.PUBLISH:
+                    broker.publish(*mqtt.decode_publish(first_byte, body), retain=first_byte & 1)
+                elif kind == mqtt.PINGREQ:
+                    self.request.sendall(mqtt.encode_packet(mqtt.PINGRESP, b''))
+                elif kind == mqtt.DISCONNECT:
+                    return
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            with broker.lock:
+                if self in broker.clients:
+                    broker.clients.remove(self)
+
+
+class FakeBroker(socketserver.ThreadingTCPServer):
+    # In-process MQTT broker: QoS 0, retained messages, + and # filters
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _BrokerHandler)
+        self.lock = threading.Lock()
+        self.clients = []
+        self.connects = []
+        self.retained = {}
+
+    def publish(self, topic, payload, retain=False):
+        with self.lock:
+            if retain:
+                self.retained[topic] = payload
+            clients = list(self.clients)
+        for client in clients:
+            if any(topic_matches(topic_filter, topic) for topic_filter in client.filters):
+                client.request.sendall(mqtt.encode_publish(topic, payload))
+
+    def wait_for(self, topic, payload, timeout=5):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.retained.get(topic) == payload:
+                return True
+            time.sleep(0.01)
+        return False
+
+
+class TestEventBus(unittest.TestCase):
+    def test_failing_subscriber_is_skipped(self):
+        bus = events.EventBus()
+        received = []
+        bus.subscribe(events.SensorSample, lambda event: 1 / 0)
+        bus.subscribe(events.SensorSample, received.append)
+        bus.publish(events.SensorSample('w1', {'28-1': 21.5}))
+        bus.publish(events.IRSent('ac', {}, 0.1))  # nobody listens
+        self.assertEqual(received, [events.SensorSample('w1', {'28-1': 21.5})])
+
+
+class TestWorkerEvents(ACRemoteTestCase):
+    def test_transaction_is_one_state_change(self):
+        received = []
+        self.remote._EVENTS.subscribe(events.StateChanged, received.append)
+        self.remote._EVENTS.subscribe(events.IRSent, received.append)
+        self.remote._on_chat_message(make_message(2, '/set 22 /mode_cool /speed_low'))
+        self.assertEqual([type(event) for event in received], [events.IRSent, events.StateChanged])
+        self.assertEqual((received[1].unit, received[1].state['temp'], received[1].state['mode']), ('ac', 22, 'COOL'))
+
+
+class TestMQTTBridge(ACRemoteTestCase):
+    def make_remote(self, **kwargs):
+        self.broker = FakeBroker()
+        threading.Thread(target=self.broker.serve_forever, daemon=True).start()
+        self.addCleanup(self.broker.server_close)
+        self.addCleanup(self.broker.shutdown)
+        config = {'host': '127.0.0.1', 'port': self.broker.server_address[1], 'user_id': 2}
+        return super().make_remote(mqtt=config, **kwargs)
+
+    def setUp(self):
+        super().setUp()
+        self.assertTrue(self.remote._MQTT.client.wait_connected(5))
+        # sent after SUBSCRIBE on the same connection, so the broker handled that first
+        self.assertTrue(self.broker.wait_for('acremote/availability', b'online'))
+
+    def test_retained_state(self):
+        self.assertTrue(self.broker.wait_for('acremote/ac/mode/state', b'off'))
+        discovery = json.loads(self.broker.retained['homeassistant/climate/acremote_ac/config'])
+        self.assertEqual(discovery['mode_command_topic'], 'acremote/ac/mode/set')
+        handler = self.remote._AC_HANDLER
+        self.assertEqual((discovery['min_temp'], discovery['max_temp']), (handler.min_temp, handler.max_temp))
+
+        self.remote._AC_HANDLER.on = True
+        self.remote._on_chat_message(make_message(2, '/mode_heat'))
+        self.assertTrue(self.broker.wait_for('acremote/ac/mode/state', b'heat'))
+        self.assertEqual(json.loads(self.broker.retained['acremote/ac/state'])['mode'], 'HEAT')
+
+    def test_home_assistant_commands(self):
+        self.broker.publish('acremote/ac/mode/set', b'cool')
+        self.assertTrue(self.broker.wait_for('acremote/ac/mode/state', b'cool'))
+        self.broker.publish('acremote/ac/temperature/set', b'22.0')
+        self.assertTrue(self.broker.wait_for('acremote/ac/temperature/state', b'22'))
+        self.assertEqual(self.send_code.call_count, 2)
+        self.assertTrue(self.remote._AC_HANDLER.on)
+
+    def test_temperature_while_off(self):
+        self.assertTrue(self.broker.wait_for('acremote/ac/mode/state', b'off'))
+        self.broker.publish('acremote/ac/temperature/set', b'22')
+        self.assertTrue(self.broker.wait_for('acremote/ac/temperature/state', b'22'))
+        self.assertEqual(self.broker.retained['acremote/ac/mode/state'], b'off')
+        self.assertFalse(self.remote._AC_HANDLER.on)
+        self.assertEqual(self.send_code.call_count, 0)
+
+    def test_commands_leave_client_thread(self):
+        threads = []
+        api_patch = self.remote.api_patch
+
+        def record(*args):
+            threads.append(threading.current_thread().name)
+            return api_patch(*args)
+
+        with mock.patch.object(self.remote, 'api_patch', side_effect=record):
+            self.broker.publish('acremote/ac/power/set', b'ON')
+            self.assertTrue(self.broker.wait_for('acremote/ac/power/state', b'ON'))
+        self.assertEqual(len(threads), 1)
+        self.assertTrue(threads[0].startswith('acremote-mqtt-cmd'))
+
+    def test_last_will(self):
+        connect = self.broker.connects[0]
+        self.assertIn(b'acremote/availability', connect)
+        self.assertTrue(connect[7] & 0x24 == 0x24)  # will flag, retained
+
+
+if __name__ == '__main__':
+    unittest.main()
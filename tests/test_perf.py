@@ -0,0 +1,73 @@
+import threading
+import time
+import unittest
+from unittest import mock
+
+from acremote import perf
+from tests.test_main import ACRemoteTestCase, make_message
+
+
+def busy_loop(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+class TestLatencyWindow(unittest.TestCase):
+    def test_percentiles(self):
+        window = perf.LatencyWindow()
+        for latency in range(1, 101):
+            window.record('/on', latency / 1000)
+        stats = window.percentiles()['/on']
+        self.assertEqual(stats['count'], 100)
+        self.assertEqual((stats['p50'], stats['p95'], stats['p99']), (0.05, 0.095, 0.099))
+
+    def test_window_expires(self):
+        window = perf.LatencyWindow(window=60)
+        with mock.patch('time.monotonic', return_value=1000.0):
+            window.record('/on', 0.1)
+        with mock.patch('time.monotonic', return_value=1030.0):
+            window.record('/off', 0.2)
+        with mock.patch('time.monotonic', return_value=1070.0):
+            self.assertEqual(list(window.percentiles()), ['/off'])
+
+
+class TestSamplingProfiler(unittest.TestCase):
+    def test_profiles_next_messages(self):
+        done = threading.Event()
+        profiler = perf.SamplingProfiler(2, on_done=lambda profiler: done.set())
+        for _ in range(3):
+            with profiler.message():
+                busy_loop(0.05)
+        self.assertTrue(done.is_set())
+        self.assertEqual(profiler.remaining, 0)
+        self.assertGreater(profiler.samples, 0)
+        function, own, total = profiler.top()[0]
+        self.assertEqual(function, 'test_perf.py:busy_loop')
+        self.assertGreater(own, 0.5)
+
+
+class TestPerfCommand(ACRemoteTestCase):
+    def test_latency_report(self):
+        self.remote._on_chat_message(make_message(1, '/timer_get'))
+        self.remote._on_chat_message(make_message(1, '/perf'))
+        self.assertRegex(self.replies(1)[-1], r'/timer_get n=1 p50=\d+ms p95=\d+ms p99=\d+ms')
+
+    def test_not_for_users(self):
+        self.remote._on_chat_message(make_message(2, '/perf profile'))
+        self.assertIsNone(self.remote._PROFILER)
+
+    def test_profile(self):
+        self.remote._COMMANDS['/busy'] = lambda chat_id: busy_loop(0.05)
+        self.remote._on_chat_message(make_message(1, '/perf profile 2'))
+        self.assertEqual(self.replies(1), ['Profiling the next 2 messages'])
+        self.remote._on_chat_message(make_message(1, '/busy'))
+        self.remote._on_chat_message(make_message(2, '/busy'))
+        self.assertIsNone(self.remote._PROFILER)
+        report = self.replies(1)[-1]
+        self.assertIn('test_perf.py:busy_loop', report.split('\n')[2])
+        self.assertIn('main.py:_process_entities', report)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+import datetime
+import os
+import queue
+import tempfile
+import unittest
+
+from acremote import scheduler
+from tests.test_main import ACRemoteTestCase, make_message
+
+
+def timestamp(*args):
+    return datetime.datetime(*args).timestamp()
+
+
+class TestParsing(unittest.TestCase):
+    def test_parse_days(self):
+        self.assertEqual(scheduler.parse_days('weekdays'), (0, 1, 2, 3, 4))
+        self.assertEqual(scheduler.parse_days('mon-wed,sat'), (0, 1, 2, 5))
+        self.assertEqual(scheduler.parse_days('fri-mon'), (0, 4, 5, 6))
+        self.assertEqual(scheduler.parse_days('once'), ())
+        self.assertEqual(scheduler.format_days((5, 6)), 'weekends')
+        self.assertEqual(scheduler.format_days((0, 2)), 'mon,wed')
+        with self.assertRaises(ValueError):
+            scheduler.parse_days('cool')
+
+    def test_next_due(self):
+        job = {'time': '08:30', 'days': [0, 1, 2, 3, 4]}
+        friday_evening = timestamp(2024, 5, 10, 20, 0)
+        self.assertEqual(scheduler.next_due(job, friday_evening), timestamp(2024, 5, 13, 8, 30))
+        once = {'time': '23:00', 'days': []}
+        self.assertEqual(scheduler.next_due(once, friday_evening), timestamp(2024, 5, 10, 23, 0))
+
+
+class TestScheduler(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._dir.cleanup)
+        self._path = os.path.join(self._dir.name, 'schedule.json')
+        self.now = timestamp(2024, 5, 10, 20, 0)  # Friday
+        self.fired = queue.Queue()
+
+    def make_scheduler(self):
+        jobs = scheduler.Scheduler(self.fired.put, self._path, clock=lambda: self.now, max_sleep=0.01)
+        jobs.load()
+        jobs.start()
+        self.addCleanup(jobs.stop, 5)
+        return jobs
+
+    def test_jobs_fire_in_order(self):
+        jobs = self.make_scheduler()
+        daily = jobs.add(1, '21:00', scheduler.parse_days('daily'), 'cool 24')
+        once = jobs.add(1, '20:30', (), 'off')
+        self.assertEqual([job['id'] for job in jobs.jobs()], [once['id'], daily['id']])
+
+        self.now = timestamp(2024, 5, 10, 21, 0)
+        self.assertEqual(self.fired.get(timeout=5)['id'], once['id'])
+        self.assertEqual(self.fired.get(timeout=5)['id'], daily['id'])
+        # the one-off job is gone, the daily one moved to tomorrow
+        self.assertEqual([(job['id'], job['due']) for job in jobs.jobs()],
+                         [(daily['id'], timestamp(2024, 5, 11, 21, 0))])
+
+    def test_remove(self):
+        jobs = self.make_scheduler()
+        job = jobs.add(1, '20:30', (), 'off')
+        self.assertTrue(jobs.remove(job['id']))
+        self.assertFalse(jobs.remove(job['id']))
+        self.now = timestamp(2024, 5, 10, 21, 0)
+        with self.assertRaises(queue.Empty):
+            self.fired.get(timeout=0.1)
+
+    def test_persisted(self):
+        jobs = self.make_scheduler()
+        jobs.add(1, '8:30', scheduler.parse_days('weekdays'), 'cool 24')
+        jobs.add(1, '20:30', (), 'off')
+        self.assertFalse(os.path.exists(self._path))  # write-behind, add() never waits for the disk
+        jobs.stop(5)
+
+        self.now = timestamp(2024, 5, 10, 22, 0)  # the one-off job expired while stopped
+        restored = self.make_scheduler()
+        self.assertEqual([(job['id'], job['time'], job['action']) for job in restored.jobs()],
+                         [(1, '08:30', 'cool 24')])
+        self.assertEqual(restored.add(1, '9:00', (), 'on')['id'], 3)
+
+
+    def test_call_later_ignores_clock_steps(self):
+        """
+        Delays run on the monotonic clock, a wall clock step back at boot does not hold them up
+        """
+        self.monotonic = 100.0
+        jobs = scheduler.Scheduler(self.fired.put, clock=lambda: self.now, max_sleep=0.01,
+                                   monotonic=lambda: self.monotonic)
+        jobs.start()
+        self.addCleanup(jobs.stop, 5)
+        jobs.call_later(5, lambda: self.fired.put('deferred'))
+        daily = jobs.add(1, '21:00', scheduler.parse_days('daily'), 'cool 24')
+        self.now -= 3600
+        self.monotonic += 5
+        self.assertEqual(self.fired.get(timeout=5), 'deferred')
+        self.now = timestamp(2024, 5, 10, 21, 0)
+        self.assertEqual(self.fired.get(timeout=5)['id'], daily['id'])
+
+
+class TestScheduleCommand(ACRemoteTestCase):
+    def test_add_list_delete(self):
+        self.remote._on_chat_message(make_message(2, '/schedule add 8:30 weekdays cool 24'))
+        self.remote._on_chat_message(make_message(2, '/schedule add 23:00 off'))
+        self.remote._on_chat_message(make_message(2, '/schedule add 23:00 warm'))
+        self.remote._on_chat_message(make_message(2, '/schedule'))
+        lines = '\n'.join(self.replies(2)).split('\n')  # the sender may merge replies of one chat
+        self.assertTrue(lines[0].startswith('Scheduled #1: 08:30 weekdays cool 24'))
+        self.assertTrue(lines[2].startswith('Usage'))
+        self.assertEqual(sorted(line[:16] for line in lines[-2:]),
+                         ['#1 08:30 weekday', '#2 23:00 once of'])
+        self.remote._on_chat_message(make_message(2, '/schedule del 2'))
+        self.assertEqual(self.replies(2)[-1], 'Schedule removed')
+
+    def test_run_job(self):
+        """
+        A scheduled action goes out as a single IR frame
+        """
+        self.remote._run_schedule({'id': 1, 'chat_id': 2, 'time': '08:30', 'days': [0], 'action': 'heat 24'})
+        handler = self.remote._AC_HANDLER
+        self.assertEqual((handler.on, handler.mode, handler.temp), (True, 'HEAT', 24))
+        self.assertEqual(self.send_code.call_count, 1)
+        self.assertEqual(len(self.replies(2)), 1)
+        self.assertGreater(self.remote._AC_START_TIME, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
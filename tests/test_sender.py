@@ -0,0 +1,124 @@
+import threading
+import time
+import unittest
+
+from acremote import ratelimit, sender, telegram
+from tests.test_aio import FakeTelegram
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_consume_and_refill(self):
+        bucket = ratelimit.TokenBucket(rate=100, capacity=2)
+        self.assertTrue(bucket.consume())
+        self.assertTrue(bucket.consume())
+        self.assertFalse(bucket.consume())
+        self.assertGreater(bucket.wait_time(), 0)
+        time.sleep(0.02)
+        self.assertTrue(bucket.consume())
+
+    def test_penalize(self):
+        bucket = ratelimit.TokenBucket(rate=1, capacity=5)
+        bucket.penalize(3)
+        self.assertAlmostEqual(bucket.wait_time(), 3, places=1)
+
+
+class TestAdmissionControl(unittest.TestCase):
+    def test_lanes_and_users_are_separate(self):
+        admission = ratelimit.AdmissionControl({'priority': (0.1, 1), 'tweak': (0.1, 2)})
+        self.assertEqual(admission.admit(1, 'tweak'), 0)
+        self.assertEqual(admission.admit(1, 'tweak'), 0)
+        self.assertAlmostEqual(admission.admit(1, 'tweak'), 10, places=0)
+        self.assertEqual(admission.admit(1, 'priority'), 0)
+        self.assertEqual(admission.admit(2, 'tweak'), 0)
+
+
+class TestOutboundSender(unittest.TestCase):
+    def setUp(self):
+        self._server = FakeTelegram()
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        self.addCleanup(self._server.server_close)
+        self.addCleanup(self._server.shutdown)
+        self._session = telegram.TelegramSession('token', api_url=self._server.url)
+        self.addCleanup(self._session.close)
+
+    def make_sender(self, **kwargs):
+        outbound = sender.OutboundSender(self._session, **kwargs)
+        outbound.start()
+        self.addCleanup(outbound.stop, 5)
+        return outbound
+
+    def test_burst_is_merged(self):
+        """
+        Messages queued while the chat is rate limited go out as one message
+        """
+        outbound = self.make_sender(chat_rate=1, chat_burst=1)
+        first = outbound.send(1, 'first')
+        first.result(5)
+        futures = [outbound.send(1, text, parse_mode=mode) for text, mode in
+                   [('<b>bold</b>', 'HTML'), ('a < b', None), ('last', None)]]
+        results = [future.result(5) for future in futures]
+        self.assertEqual(len({result['message_id'] for result in results}), 1)
+        self.assertEqual(
+            [(p['text'], p.get('parse_mode')) for p in self._server.sent('sendMessage')],
+            [('first', None), ('<b>bold</b>\na &lt; b\nlast', 'HTML')],
+        )
+
+    def test_unmergeable_messages(self):
+        outbound = self.make_sender(chat_rate=1, chat_burst=1)
+        outbound.send(1, 'first').result(5)
+        outbound.send(1, 'prompt', merge=False)
+        outbound.send(1, 'second').result(5)
+        self.assertEqual([p['text'] for p in self._server.sent('sendMessage')], ['first', 'prompt', 'second'])
+
+    def test_retry_after(self):
+        self._server.errors = [{
+            'ok': False, 'error_code': 429, 'description': 'Too Many Requests',
+            'parameters': {'retry_after': 0.2},
+        }]
+        outbound = self.make_sender(chat_rate=100, chat_burst=5)
+        started = time.monotonic()
+        outbound.send(1, 'hello').result(5)
+        self.assertGreaterEqual(time.monotonic() - started, 0.2)
+        self.assertEqual([p['text'] for p in self._server.sent('sendMessage')], ['hello'])
+
+    def test_idle_chat_buckets_evicted(self):
+        outbound = self.make_sender(chat_rate=100, chat_burst=1)
+        outbound._SWEEP_INTERVAL = 0
+        for chat_id in range(1, 6):
+            outbound.send(chat_id, 'hello').result(5)
+        time.sleep(0.05)  # full again
+        outbound.send(6, 'hello').result(5)
+        outbound.drain(5)
+        self.assertLessEqual(set(outbound._CHAT_BUCKETS), {6})
+
+    def test_calls_keep_chat_order(self):
+        """
+        Edits queue behind the messages of their chat, expected errors are not failures
+        """
+        outbound = self.make_sender(chat_rate=100, chat_burst=5)
+        outbound.send(1, 'panel', merge=False)
+        edited = outbound.call(1, 'editMessageText', (1, 1), 'panel v2')
+        self.assertEqual(edited.result(5)['message_id'], 2)
+        self._server.errors = [{'ok': False, 'error_code': 400,
+                                'description': 'Bad Request: message to delete not found'}]
+        deleted = outbound.call(1, 'deleteMessage', (1, 7), ignore=('message to delete not found',))
+        self.assertIsNone(deleted.result(5))
+        self.assertEqual([name for name, _ in self._server.calls], ['sendMessage', 'editMessageText'])
+
+    def test_set_token_drops_idle_connections(self):
+        self._session.call('getMe')
+        self.assertEqual(len(self._session._IDLE), 1)
+        self._session.set_token('rotated')
+        self.assertEqual(self._session._IDLE, [])
+        self._session.call('getMe')
+        self.assertEqual(self._session._TOKEN, 'rotated')
+
+    def test_api_error_fails_future(self):
+        self._server.errors = [{'ok': False, 'error_code': 403, 'description': 'Forbidden'}]
+        outbound = self.make_sender()
+        with self.assertRaises(telegram.TelegramError):
+            outbound.send(1, 'hello').result(5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import io
+import math
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from acremote import events, snapshot
+from tests.test_main import ACRemoteTestCase, make_message
+
+STATE = {'clean': False, 'feeling': False, 'fresh': False, 'health': True, 'mode': 'HEAT', 'on': True,
+         'screen': True, 'sleep': False, 'speed': 'LOW', 'strong': False, 'swing': False, 'temp': 24, 'timer': 1.5}
+
+
+class TestStateSnapshot(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._dir.cleanup)
+        self.path = os.path.join(self._dir.name, 'acremote.snapshot')
+        self.bus = events.EventBus()
+        self.writer = snapshot.StateSnapshot(self.path, self.bus, units=2, sensors=4)
+        self.writer.start({'living': dict(STATE, on=False), 'bedroom': STATE})
+        self.addCleanup(self.writer.close)
+
+    def test_states_and_samples(self):
+        self.bus.publish(events.StateChanged('living', dict(STATE, temp=21, mode='COOL')))
+        self.bus.publish(events.StateChanged('garage', STATE))  # not in the snapshot
+        self.bus.publish(events.SensorSample('system', {'ts': 0, 'cpu_temp': 48.3, 'load': (0.5, 0.25, 0.1),
+                                                        'throttled': None}))
+        self.bus.publish(events.SensorSample('w1', {'28-0316a2795eff': 21.5}))  # no slot left
+
+        result = snapshot.read_snapshot(self.path)
+        self.assertEqual(sorted(result['units']), ['bedroom', 'living'])
+        living = result['units']['living']
+        self.assertEqual((living['on'], living['mode'], living['speed'], living['temp'], living['timer']),
+                         (True, 'COOL', 'LOW', 21, 1.5))
+        self.assertTrue(living['health'])
+        self.assertFalse(result['units']['bedroom']['swing'])
+        self.assertEqual({name: sensor['value'] for name, sensor in result['sensors'].items()},
+                         {'system/cpu_temp': 48.3, 'system/load.0': 0.5, 'system/load.1': 0.25, 'system/load.2': 0.1})
+        self.assertEqual(result['sequence'] % 2, 0)
+
+    def test_reader_waits_for_the_writer(self):
+        with snapshot.SnapshotReader(self.path) as reader:
+            with self.writer._update():
+                with self.assertRaises(TimeoutError):
+                    reader.read(retries=3)
+            self.assertEqual(reader.read()['units']['bedroom']['temp'], 24)
+
+    def test_no_torn_reads(self):
+        # temp and timer are always written together, a reader must never see them disagree
+        done = threading.Event()
+
+        def write():
+            for index in range(2000):
+                self.bus.publish(events.StateChanged('living', dict(STATE, temp=16 + index % 16, timer=index % 16)))
+            done.set()
+
+        threading.Thread(target=write).start()
+        with snapshot.SnapshotReader(self.path) as reader:
+            while not done.is_set():
+                living = reader.read()['units']['living']
+                self.assertEqual(living['temp'] - 16, living['timer'])
+
+    def test_restart_continues_the_sequence(self):
+        sequence = snapshot.read_snapshot(self.path)['sequence']
+        self.writer.close()
+        self.writer = snapshot.StateSnapshot(self.path, self.bus, units=2, sensors=4)
+        self.writer.start({'living': STATE})
+        result = snapshot.read_snapshot(self.path)
+        self.assertGreater(result['sequence'], sequence)
+        self.assertEqual(list(result['units']), ['living'])
+
+    def test_new_layout_replaces_the_file(self):
+        reader = snapshot.SnapshotReader(self.path)
+        self.addCleanup(reader.close)
+        self.writer.close()
+        self.writer = snapshot.StateSnapshot(self.path, self.bus, units=1, sensors=1)
+        self.writer.start({'living': STATE})
+        with self.assertRaisesRegex(ValueError, 'replaced'):
+            reader.read()  # the old file is still mapped in full, no SIGBUS
+        self.assertEqual(len(reader._MAP), snapshot.snapshot_size(2, 4))
+        self.assertEqual(list(snapshot.read_snapshot(self.path)['units']), ['living'])
+        self.assertEqual(os.listdir(self._dir.name), ['acremote.snapshot'])
+
+    def test_long_names_left_out(self):
+        self.writer.close()
+        self.writer = snapshot.StateSnapshot(self.path, self.bus, units=2, sensors=4)
+        with mock.patch('sys.stderr', new_callable=io.StringIO) as stderr:
+            self.writer.start({'x' * 17: STATE, 'living': STATE})
+            for _ in range(2):
+                self.bus.publish(events.SensorSample('w1', {'28-0316a2795eff': 21.5, '28-0316a2795eff-outdoor': 20.0}))
+        result = snapshot.read_snapshot(self.path)
+        self.assertEqual(list(result['units']), ['living'])
+        self.assertEqual(list(result['sensors']), ['w1/28-0316a2795eff'])
+        self.assertEqual(stderr.getvalue().count('left out'), 2)
+
+    def test_sensor_values(self):
+        values = snapshot.sensor_values('system', {'ts': 1, 'mem_available': 512, 'cpu_temp': None})
+        self.assertEqual(values['system/mem_available'], 512.0)
+        self.assertTrue(math.isnan(values['system/cpu_temp']))
+
+
+class TestRemoteSnapshot(ACRemoteTestCase):
+    def make_remote(self, **kwargs):
+        self.snapshot_file = os.path.join(self._dir.name, 'acremote.snapshot')
+        return super().make_remote(snapshot_file=self.snapshot_file, **kwargs)
+
+    def test_commands_update_the_snapshot(self):
+        self.assertEqual(snapshot.read_snapshot(self.snapshot_file)['units']['ac']['temp'],
+                         self.remote._AC_HANDLER.state['temp'])
+        self.remote._on_chat_message(make_message(2, '/set 22'))
+        self.assertEqual(snapshot.read_snapshot(self.snapshot_file)['units']['ac']['temp'], 22)
+
+
+if __name__ == '__main__':
+    unittest.main()
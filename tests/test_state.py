@@ -0,0 +1,85 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from acremote import state, vestel
+
+
+class TestStateStore(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._dir.cleanup)
+        self._path = os.path.join(self._dir.name, 'acremote_state.json')
+
+    def test_write_behind(self):
+        """
+        Updates are only written on flush and unchanged states do not mark the store dirty
+        """
+        store = state.StateStore(self._path, delay=60)
+        store.update({'temp': 22})
+        self.assertTrue(store.dirty)
+        self.assertFalse(os.path.exists(self._path))
+        store.flush()
+        self.assertFalse(store.dirty)
+        store.update({'temp': 22})
+        self.assertFalse(store.dirty)
+        self.assertEqual(os.listdir(self._dir.name), ['acremote_state.json'])
+        with open(self._path) as file_handle:
+            self.assertEqual(json.load(file_handle), {'temp': 22})
+
+    def test_timer_coalesces_updates(self):
+        store = state.StateStore(self._path, delay=0.05)
+        for temp in range(20, 25):
+            store.update({'temp': temp})
+        time.sleep(0.3)
+        self.assertFalse(store.dirty)
+        self.assertEqual(state.StateStore(self._path).load(), {'temp': 24})
+
+    def test_update_during_slow_write(self):
+        """
+        A slow disk does not hold up update(), the newer state is written by the next flush
+        """
+        store = state.StateStore(self._path, delay=60)
+        writing, release = threading.Event(), threading.Event()
+        write = store._write
+
+        def slow_write(value):
+            writing.set()
+            release.wait(5)
+            write(value)
+
+        store._write = slow_write
+        store.update({'temp': 22})
+        flush = threading.Thread(target=store.flush)
+        flush.start()
+        self.assertTrue(writing.wait(5))
+        started = time.monotonic()
+        store.update({'temp': 22})  # already being written
+        store.update({'temp': 23})
+        self.assertLess(time.monotonic() - started, 1)
+        release.set()
+        flush.join(5)
+        self.assertTrue(store.dirty)
+        store.flush()
+        self.assertFalse(store.dirty)
+        self.assertEqual(state.StateStore(self._path).load(), {'temp': 23})
+
+    def test_remote_state_roundtrip(self):
+        remote = vestel.VestelACRemote(22)
+        remote.temp = 18
+        remote.mode = 'HEAT'
+        store = state.StateStore(self._path)
+        store.update(remote.state)
+        store.flush()
+
+        restored = vestel.VestelACRemote(22)
+        for attr, value in state.StateStore(self._path).load().items():
+            setattr(restored, attr, value)
+        self.assertEqual(restored.state, remote.state)
+
+
+if __name__ == '__main__':
+    unittest.main()
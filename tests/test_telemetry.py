@@ -0,0 +1,71 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from acremote import telemetry
+from tests.test_main import ACRemoteTestCase, make_message
+
+
+def write(root, path, text):
+    path = os.path.join(root, path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as file_handle:
+        file_handle.write(text)
+
+
+class TestSystemTelemetry(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._dir.cleanup)
+        self.root = self._dir.name
+        write(self.root, 'sys/class/thermal/thermal_zone0/type', 'gpu-thermal\n')
+        write(self.root, 'sys/class/thermal/thermal_zone0/temp', '99000\n')
+        write(self.root, 'sys/class/thermal/thermal_zone1/type', 'cpu-thermal\n')
+        write(self.root, 'sys/class/thermal/thermal_zone1/temp', '48312\n')
+        write(self.root, 'proc/loadavg', '0.41 0.34 0.32 2/71 18536\n')
+        write(self.root, 'proc/meminfo', 'MemTotal:  445096 kB\nMemFree:  100 kB\nMemAvailable:  204800 kB\n')
+        write(self.root, 'sys/devices/platform/soc/soc:firmware/get_throttled', '50005\n')
+
+    def test_sample(self):
+        sample = telemetry.SystemTelemetry(root=self.root).sample()
+        self.assertEqual(sample['cpu_temp'], 48.312)
+        self.assertEqual(sample['load'], (0.41, 0.34, 0.32))
+        self.assertEqual((sample['mem_available'], sample['mem_total']), (200, 434))
+        self.assertEqual(telemetry.throttled_flags(sample['throttled']),
+                         (['under-voltage', 'throttled'], ['under-voltage', 'throttled']))
+
+    def test_missing_files(self):
+        sample = telemetry.SystemTelemetry(root=os.path.join(self.root, 'nothing')).sample()
+        self.assertEqual((sample['cpu_temp'], sample['load'], sample['throttled']), (None, None, None))
+
+    def test_ring_buffer_trend(self):
+        sampler = telemetry.SystemTelemetry(size=3, root=self.root)
+        for minute, temp in enumerate((40000, 45000, 52000, 47000)):
+            write(self.root, 'sys/class/thermal/thermal_zone1/temp', str(temp))
+            with mock.patch('time.time', return_value=minute * 60):
+                sampler.sample()
+        self.assertEqual(len(sampler.history()), 3)
+        self.assertEqual(sampler.trend('cpu_temp'), {'min': 45.0, 'max': 52.0, 'change': 2.0, 'minutes': 2})
+        self.assertEqual(sampler.trend('load', 0)['change'], 0)
+
+
+class TestTelemetryCommands(ACRemoteTestCase):
+    def test_answers_from_memory(self):
+        sampler = self.remote._TELEMETRY = mock.Mock()
+        sampler.latest.return_value = {
+            'ts': 0, 'cpu_temp': 51.5, 'load': (1.0, 0.5, 0.25),
+            'mem_available': 200, 'mem_total': 434, 'throttled': 0x20000,
+        }
+        sampler.trend.return_value = {'min': 40.0, 'max': 52.0, 'change': -1.5, 'minutes': 60}
+        with mock.patch('subprocess.run') as run:
+            self.remote._on_chat_message(make_message(1, '/cpu_temp'))
+            self.remote._on_chat_message(make_message(1, '/sys_stat'))
+        run.assert_not_called()
+        replies = self.replies(1)
+        self.assertEqual(replies[0], '<code>CPU temperature: 51.5°C (40.0°C..52.0°C, -1.5°C in 60 min)</code>')
+        self.assertIn('Throttling: none\nSince boot: ARM frequency capped', replies[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import os
+import tempfile
+import threading
+import unittest
+
+from acremote import thermo
+from tests.test_main import ACRemoteTestCase
+
+
+def write_sensor(base, device, crc, millidegrees=21500):
+    os.makedirs(os.path.join(base, device), exist_ok=True)
+    with open(os.path.join(base, device, 'w1_slave'), 'w') as file_handle:
+        file_handle.write('72 01 4b 46 7f ff 0e 10 57 : crc=57 {}\n'.format(crc))
+        file_handle.write('72 01 4b 46 7f ff 0e 10 57 t={}\n'.format(millidegrees))
+
+
+class TestW1Thermo(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._dir.cleanup)
+        self.sensors = thermo.W1Thermo(crc_retries=2)
+        self.sensors._DEV_BASE = self._dir.name
+
+    def test_poll(self):
+        write_sensor(self._dir.name, '28-0316a2795eff', 'YES')
+        self.assertEqual(self.sensors.poll(), {'28-0316a2795eff': 21.5})
+
+    def test_crc_retries_are_bounded(self):
+        write_sensor(self._dir.name, '28-0316a2795eff', 'NO')
+        with self.assertRaisesRegex(ValueError, 'failed 3 times'):
+            self.sensors.poll()
+
+
+class TestBackgroundIO(ACRemoteTestCase):
+    def test_slow_sensor_does_not_hold_up_the_scheduler(self):
+        reading, release = threading.Event(), threading.Event()
+
+        def slow_poll():
+            reading.set()
+            release.wait(5)
+            return {'28-0316a2795eff': 21.5}
+
+        self.remote._THERMO.poll = slow_poll
+        self.addCleanup(release.set)
+        self.remote._SCHEDULER.call_later(0, self.remote._in_background(self.remote._sample_sensors))
+        self.assertTrue(reading.wait(5))
+        fired = threading.Event()
+        self.remote._SCHEDULER.call_later(0, fired.set)
+        self.assertTrue(fired.wait(1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,5 @@
 import unittest
+from unittest import mock
 from acremote import vestel
 
 
@@ -66,6 +67,56 @@ class TestVestelACRemote(unittest.TestCase):
             '11000011111001100000011100000000100001100111101000000001000000000000000000000110000000000000000010010101'
         )
 
+    @mock.patch('gpirblast.send_code', create=True)
+    def test_transaction_sends_single_frame(self, send_code):
+        """
+        Staged button presses are transmitted once with the final state
+        """
+        testobj = vestel.VestelACRemote(self._gpio_pin)
+        testobj.on = True
+        testobj.begin()
+        testobj.btn_mode('HEAT')
+        testobj.btn_tmp_set(20)
+        testobj.btn_speed('LOW')
+        testobj.btn_swing()
+        testobj.btn_strong()
+        testobj.btn_timer(1.5)
+        send_code.assert_not_called()
+        self.assertTrue(testobj.commit())
+
+        expected = vestel.VestelACRemote(self._gpio_pin)
+        expected.on = True
+        expected.temp = 20
+        expected.speed = 'LOW'
+        expected.swing = False
+        expected.mode = 'HEAT'
+        expected.strong = True
+        expected.timer = 1.5
+        expected._DATA_FIELDS[11] = 13  # last pressed button
+        expected._refresh_data_fields()
+        send_code.assert_called_once_with(self._gpio_pin, expected._form_bin_str())
+        self.assertFalse(testobj.commit())
+
+    @mock.patch('gpirblast.send_code', create=True)
+    def test_transaction_rollback(self, send_code):
+        testobj = vestel.VestelACRemote(self._gpio_pin)
+        testobj.on = True
+        testobj.begin()
+        testobj.btn_tmp_up()
+        testobj.btn_mode('FAN')
+        testobj.rollback()
+        send_code.assert_not_called()
+        self.assertEqual((testobj.temp, testobj.mode), (27, 'COOL'))
+
+    @mock.patch('gpirblast.send_code', create=True)
+    def test_tmp_set_range(self, send_code):
+        testobj = vestel.VestelACRemote(self._gpio_pin)
+        testobj.btn_tmp_set(36)
+        self.assertEqual(testobj.temp, 36)
+        with self.assertRaisesRegex(ValueError, '^Temperature value must be within 16 and 36$'):
+            testobj.btn_tmp_set(37)
+        self.assertEqual(send_code.call_count, 1)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,85 @@
+import http.client
+import json
+import threading
+import unittest
+
+from acremote import webhook
+from tests.test_aio import make_update
+from tests.test_main import ACRemoteTestCase
+
+
+class WebhookTestCase(unittest.TestCase):
+    def serve(self, server):
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.close)
+        return server
+
+    def post(self, server, update, secret='secret', path='/hook'):
+        connection = http.client.HTTPConnection(*server.server_address, timeout=5)
+        headers = {'Content-Type': 'application/json', 'X-Telegram-Bot-Api-Secret-Token': secret}
+        connection.request('POST', path, json.dumps(update), headers)
+        status = connection.getresponse().status
+        connection.close()
+        return status
+
+
+class TestWebhookServer(WebhookTestCase):
+    def test_secret_and_path(self):
+        received = []
+        server = self.serve(webhook.WebhookServer(
+            ('127.0.0.1', 0), handler=received.append, key=lambda update: 1,
+            path='/hook', secret_token='secret',
+        ))
+        self.assertEqual(self.post(server, {'update_id': 1}, secret='wrong'), 403)
+        self.assertEqual(self.post(server, {'update_id': 1}, path='/other'), 404)
+        self.assertEqual(self.post(server, {'update_id': 1}), 200)
+        server.close()
+        self.assertEqual(received, [{'update_id': 1}])
+
+    def test_no_secret_refuses_everything(self):
+        received = []
+        server = self.serve(webhook.WebhookServer(
+            ('127.0.0.1', 0), handler=received.append, key=lambda update: 1, path='/hook', secret_token='',
+        ))
+        self.assertEqual(self.post(server, {'update_id': 1}, secret=''), 403)
+        self.assertEqual(self.post(server, {'update_id': 1}), 403)
+        server.close()
+        self.assertEqual(received, [])
+
+    def test_backpressure(self):
+        """
+        A full worker queue is answered with 503 so Telegram retries later
+        """
+        release = threading.Event()
+        server = self.serve(webhook.WebhookServer(
+            ('127.0.0.1', 0), handler=lambda update: release.wait(5), key=lambda update: 1,
+            path='/hook', secret_token='secret', workers=1, queue_size=1,
+        ))
+        statuses = [self.post(server, {'update_id': update_id}) for update_id in range(4)]
+        release.set()
+        self.assertEqual(statuses[0], 200)
+        self.assertEqual(statuses[-1], 503)
+
+
+class TestWebhookACRemote(ACRemoteTestCase, WebhookTestCase):
+    remote_class = webhook.WebhookACRemote
+
+    def make_remote(self, **kwargs):
+        return super().make_remote(
+            webhook_url='https://example.com/hook', listen='127.0.0.1', port=0, secret_token='secret', **kwargs
+        )
+
+    def test_secret_generated(self):
+        remote = ACRemoteTestCase.make_remote(self, webhook_url='https://example.com/hook', listen='127.0.0.1', port=0)
+        self.addCleanup(remote.shutdown)
+        self.assertGreaterEqual(len(remote._WEBHOOK_SECRET), 16)
+
+    def test_updates_reach_router(self):
+        server = self.serve(self.remote._make_server())
+        self.assertEqual(self.post(server, make_update(1, 2, '/timer_get')), 200)
+        server.close()
+        self.assertEqual(self.replies(2), ['AC timer set to: <b>0.0</b> hours'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import threading
+import unittest
+from unittest import mock
+
+from acremote import vestel, worker
+
+
+class TestHardwareWorker(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch('gpirblast.send_code', create=True)
+        self._send_code = patcher.start()
+        self.addCleanup(patcher.stop)
+        self._worker = worker.HardwareWorker(vestel.VestelACRemote(22))
+        self._worker.start()
+        self.addCleanup(self._worker.stop, 1)
+
+    def test_submit_returns_result(self):
+        self.assertTrue(self._worker.submit('btn_tmp_down').result(1))
+        self.assertEqual(self._worker.remote.temp, 26)
+        self.assertEqual(self._worker.stats()['btn_tmp_down']['count'], 1)
+        self.assertEqual(self._worker.depth, 0)
+
+    def test_submit_propagates_errors(self):
+        with self.assertRaises(ValueError):
+            self._worker.submit('btn_tmp_set', 99).result(1)
+
+    def test_commands_are_serialized(self):
+        """
+        Queue depth counts the running command and everything waiting behind it
+        """
+        release = threading.Event()
+        self._send_code.side_effect = lambda *args: release.wait(1)
+        futures = [self._worker.submit('btn_on_off') for _ in range(3)]
+        self.assertEqual(self._worker.depth, 3)
+        release.set()
+        for future in futures:
+            future.result(1)
+        self.assertEqual(self._send_code.call_count, 3)
+        self.assertTrue(self._worker.remote.on)
+
+
+if __name__ == '__main__':
+    unittest.main()